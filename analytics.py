@@ -0,0 +1,242 @@
+import time
+from datetime import date, datetime, timedelta, UTC
+from decimal import Decimal
+from typing import List, NamedTuple, Optional
+import click
+from sqlalchemy import Date, delete, func, select, true, type_coerce
+from app import app, db
+from db_utils import upsert
+from models import (
+    Category,
+    DailyCategorySales,
+    DailyItemSales,
+    DailySales,
+    Item,
+    Order,
+    OrderItem,
+)
+from money import from_cents
+
+MAX_REPORT_DAYS = 366
+ROLLUPS = (DailySales, DailyItemSales, DailyCategorySales)
+
+
+class DayTotals(NamedTuple):
+    day: date
+    orders: int
+    revenue: Decimal
+
+
+class ItemTotals(NamedTuple):
+    item_id: int
+    name: str
+    units: int
+    revenue: Decimal
+
+
+class CategoryTotals(NamedTuple):
+    category_id: int
+    name: str
+    units: int
+    revenue: Decimal
+
+
+class SalesReport(NamedTuple):
+    """The sales of the `len(days)` days up to today, read from the rollup tables."""
+
+    days: List[DayTotals]
+    orders: int
+    revenue: Decimal
+    average_order_value: Decimal
+    top_items: List[ItemTotals]
+    categories: List[CategoryTotals]
+
+
+def _adding(table, columns):
+    # The SET of an upsert that adds the incoming counts to an existing rollup row
+    return lambda incoming: {column: table.c[column] + incoming[column] for column in columns}
+
+
+def _roll_up(condition) -> int:
+    """Add the orders matching `condition` to the rollup tables.
+
+    Each rollup is aggregated by the database with one GROUP BY over `orders`
+    and `order_items` and added to the existing rows with one upsert, so the
+    cost depends on the number of days and items, not on the number of orders.
+
+    Returns:
+        int: The number of orders rolled up.
+    """
+    # SQLite's date() returns text, which the Date type parses back into a date
+    day = type_coerce(func.date(Order.timestamp), Date).label('day')
+    units = func.sum(OrderItem.quantity).label('units')
+    revenue_cents = func.sum(OrderItem.price_cents * OrderItem.quantity).label('revenue_cents')
+    item_id = func.coalesce(OrderItem.item_id, 0).label('item_id')
+    category_id = func.coalesce(Item.category_id, 0).label('category_id')
+
+    days = db.session.execute(
+        select(
+            day,
+            func.count(Order.id).label('orders'),
+            func.sum(Order.total_amount_cents).label('revenue_cents'),
+        )
+        .where(condition)
+        .group_by(day)
+    ).all()
+    items = db.session.execute(
+        select(day, item_id, func.max(OrderItem.name).label('name'), units, revenue_cents)
+        .select_from(OrderItem)
+        .join(Order, OrderItem.order_id == Order.id)
+        .where(condition)
+        .group_by(day, item_id)
+    ).all()
+    categories = db.session.execute(
+        select(day, category_id, units, revenue_cents)
+        .select_from(OrderItem)
+        .join(Order, OrderItem.order_id == Order.id)
+        .outerjoin(Item, OrderItem.item_id == Item.id)
+        .where(condition)
+        .group_by(day, category_id)
+    ).all()
+
+    for model, rows, key, counts in (
+        (DailySales, days, ['day'], ['orders', 'revenue_cents']),
+        (DailyItemSales, items, ['day', 'item_id'], ['units', 'revenue_cents']),
+        (DailyCategorySales, categories, ['day', 'category_id'], ['units', 'revenue_cents']),
+    ):
+        table = model.__table__
+        upsert(
+            table,
+            [row._asdict() for row in rows],
+            key=key,
+            # Item rows take the name of the latest sale; everything else is summed
+            update_columns=['name'] if model is DailyItemSales else [],
+            set_=_adding(table, counts),
+        )
+    return sum(row.orders for row in days)
+
+
+def record_order(order: Order) -> None:
+    """Add a newly finalized order to the rollups, in the order's own transaction.
+
+    The order and its line items must be flushed. The caller commits.
+    """
+    _roll_up(Order.id == order.id)
+
+
+def backfill(since: Optional[date] = None) -> int:
+    """Rebuild the rollups of the days from `since` on (default: every day) from the orders.
+
+    Orders finalized while this runs may be counted twice on Postgres, so run it
+    while checkout is quiet, or run it again for the affected days. The caller
+    commits.
+
+    Returns:
+        int: The number of orders rolled up.
+    """
+    for model in ROLLUPS:
+        stmt = delete(model)
+        if since is not None:
+            stmt = stmt.where(model.day >= since)
+        db.session.execute(stmt)
+    if since is None:
+        return _roll_up(true())
+    return _roll_up(Order.timestamp >= datetime.combine(since, datetime.min.time()))
+
+
+def sales_report(days: int, top: int = 10) -> SalesReport:
+    """Return the sales of the last `days` days, including today (UTC).
+
+    Only reads the rollup tables, which hold one row per day, per item sold on
+    a day and per category sold on a day.
+    """
+    days = min(max(days, 1), MAX_REPORT_DAYS)
+    today = datetime.now(UTC).date()
+    since = today - timedelta(days=days - 1)
+
+    totals = {
+        row.day: row for row in DailySales.query.filter(DailySales.day >= since)
+    }
+    series = []
+    for n in range(days):
+        day = since + timedelta(days=n)
+        row = totals.get(day)
+        series.append(
+            DayTotals(day, row.orders, from_cents(row.revenue_cents))
+            if row is not None
+            else DayTotals(day, 0, from_cents(0))
+        )
+    orders = sum(row.orders for row in totals.values())
+    revenue_cents = sum(row.revenue_cents for row in totals.values())
+
+    item_revenue = func.sum(DailyItemSales.revenue_cents)
+    top_items = [
+        ItemTotals(
+            row.item_id,
+            row.name if row.item_id else 'Deleted items',
+            row.units,
+            from_cents(row.revenue_cents),
+        )
+        for row in db.session.execute(
+            select(
+                DailyItemSales.item_id,
+                func.max(DailyItemSales.name).label('name'),
+                func.sum(DailyItemSales.units).label('units'),
+                item_revenue.label('revenue_cents'),
+            )
+            .where(DailyItemSales.day >= since)
+            .group_by(DailyItemSales.item_id)
+            .order_by(item_revenue.desc())
+            .limit(top)
+        )
+    ]
+
+    category_revenue = func.sum(DailyCategorySales.revenue_cents)
+    categories = [
+        CategoryTotals(
+            row.category_id,
+            row.name or ('Uncategorized' if not row.category_id else 'Deleted category'),
+            row.units,
+            from_cents(row.revenue_cents),
+        )
+        for row in db.session.execute(
+            select(
+                DailyCategorySales.category_id,
+                Category.name,
+                func.sum(DailyCategorySales.units).label('units'),
+                category_revenue.label('revenue_cents'),
+            )
+            .outerjoin(Category, DailyCategorySales.category_id == Category.id)
+            .where(DailyCategorySales.day >= since)
+            .group_by(DailyCategorySales.category_id, Category.name)
+            .order_by(category_revenue.desc())
+        )
+    ]
+
+    return SalesReport(
+        days=series,
+        orders=orders,
+        revenue=from_cents(revenue_cents),
+        average_order_value=from_cents(round(revenue_cents / orders) if orders else 0),
+        top_items=top_items,
+        categories=categories,
+    )
+
+
+@app.cli.group('analytics')
+def analytics_cli():
+    """Sales analytics commands."""
+
+
+@analytics_cli.command('backfill')
+@click.option(
+    '--since',
+    type=click.DateTime(formats=['%Y-%m-%d']),
+    help='Only rebuild the days from this date on (default: every day).',
+)
+def backfill_command(since):
+    """Rebuild the sales rollups from the orders, e.g. after upgrading or a correction."""
+    started = time.perf_counter()
+    orders = backfill(since.date() if since else None)
+    db.session.commit()
+    click.echo(f'Rolled up {orders} order(s) in {time.perf_counter() - started:.2f}s.')
@@ -0,0 +1,431 @@
+import gzip
+import hashlib
+import json
+from datetime import datetime
+from decimal import Decimal
+from functools import wraps
+from flask import Blueprint, Response, abort, current_app, request
+from flask_login import current_user, login_user, logout_user
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy.orm import selectinload
+from werkzeug.exceptions import HTTPException
+from app import app, csrf, db, response_cache
+from cart import (
+    add_cart_item,
+    cart_total_cents,
+    get_cart_item_count,
+    invalidate_cart,
+    load_cart,
+    set_cart_quantity,
+)
+from category_cache import all_categories
+from db_replicas import read_replica
+from images import image_src, image_variants
+from models import Item, Order, User
+from money import from_cents
+from pagination import clamp_per_page, keyset_paginate
+from rate_limit import limit_attempts
+from session_cart import merge_session_cart
+import routes  # not `from routes import`: routes may still be importing when this runs
+from user_cache import invalidate_user
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+
+def _money(cents: int) -> str:
+    return str(from_cents(cents))
+
+
+# Selectable item fields: name -> (columns the field is read from, serializer)
+ITEM_FIELDS = {
+    'id': ((Item.id,), lambda row: row.id),
+    'name': ((Item.name,), lambda row: row.name),
+    'description': ((Item.description,), lambda row: row.description),
+    'price': ((Item.price_cents,), lambda row: _money(row.price_cents)),
+    'price_cents': ((Item.price_cents,), lambda row: row.price_cents),
+    'stock': ((Item.stock,), lambda row: row.stock),
+    'weight': ((Item.weight,), lambda row: row.weight),
+    'category_id': ((Item.category_id,), lambda row: row.category_id),
+    'image': (
+        (Item.image, Item.image_digest, Item.image_width),
+        lambda row: image_src(row, external=True),
+    ),
+    'images': (
+        (Item.image_digest, Item.image_width),
+        lambda row: image_variants(row, external=True),
+    ),
+}
+
+ORDER_FIELDS = {
+    'id': lambda order: order.id,
+    'status': lambda order: order.status,
+    'payment_status': lambda order: order.payment_status,
+    'total': lambda order: _money(order.total_amount_cents),
+    'total_cents': lambda order: order.total_amount_cents,
+    'timestamp': lambda order: order.timestamp,
+    'items': lambda order: [
+        {
+            'item_id': line.item_id,
+            'name': line.name,
+            'price': _money(line.price_cents),
+            'price_cents': line.price_cents,
+            'quantity': line.quantity,
+            'image': line.image,
+        }
+        for line in order.line_items
+    ],
+}
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def dumps(data) -> bytes:
+    """Serialize to compact JSON, with orjson if it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, separators=(',', ':'), default=_default).encode()
+
+
+def api_response(data, status: int = 200) -> Response:
+    return Response(dumps(data), status=status, mimetype='application/json')
+
+
+def selected_fields(available) -> list:
+    """Return the fields named by `?fields=a,b`, or every field without it.
+
+    Aborts with 400 on a field that does not exist.
+    """
+    requested = request.args.get('fields')
+    if not requested:
+        return list(available)
+    fields = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        abort(400, f'Unknown field(s): {", ".join(unknown)}')
+    return fields
+
+
+def json_body() -> dict:
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400, 'Expected a JSON object')
+    return body
+
+
+def api_login_required(view):
+    """Like `login_required`, but answers 401 instead of redirecting to the login page."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            abort(401)
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@api_v1.errorhandler(HTTPException)
+def handle_http_error(e):
+    response = e.get_response()
+    response.set_data(dumps({'error': e.description, 'status': e.code}))
+    response.mimetype = 'application/json'
+    return response
+
+
+@api_v1.after_request
+def finalize_response(response):
+    """Make GETs conditional on an ETag and compress bodies the client accepts compressed."""
+    if (
+        request.method == 'GET'
+        and response.status_code == 200
+        and not response.direct_passthrough
+    ):
+        if 'ETag' not in response.headers:
+            # Weak, since the same entity is sent with different encodings
+            response.set_etag(hashlib.md5(response.get_data()).hexdigest(), weak=True)
+            response.cache_control.no_cache = True
+            if current_user.is_authenticated:
+                response.cache_control.private = True
+        response = response.make_conditional(request)
+    _compress(response)
+    return response
+
+
+def _compress(response) -> None:
+    response.vary.add('Accept-Encoding')
+    if (
+        response.status_code in (204, 304)
+        or response.direct_passthrough
+        or 'Content-Encoding' in response.headers
+    ):
+        return
+    data = response.get_data()
+    if len(data) < current_app.config['API_COMPRESS_MIN_SIZE']:
+        return
+    if brotli is not None and request.accept_encodings['br']:
+        data, encoding = brotli.compress(data, quality=5), 'br'
+    elif request.accept_encodings['gzip']:
+        data, encoding = gzip.compress(data, compresslevel=6), 'gzip'
+    else:
+        return
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+
+
+@api_v1.route('/categories')
+@response_cache.cached('catalog')
+@read_replica
+def list_categories():
+    return api_response(
+        {'data': [{'id': category.id, 'name': category.name} for category in all_categories()]}
+    )
+
+
+def _item_query(fields, *extra_columns):
+    columns = {'id': Item.id}
+    for name in fields:
+        columns.update((column.key, column) for column in ITEM_FIELDS[name][0])
+    columns.update((column.key, column) for column in extra_columns)
+    return db.session.query(*columns.values())
+
+
+def _serialize_item(row, fields) -> dict:
+    return {name: ITEM_FIELDS[name][1](row) for name in fields}
+
+
+@api_v1.route('/items')
+@response_cache.cached('catalog')
+@read_replica
+def list_items():
+    """List items with `?category_id=`, `?sort=`, `?limit=`, `?after=` and `?fields=`.
+
+    Only the columns behind the selected fields are queried.
+    """
+    fields = selected_fields(ITEM_FIELDS)
+    sort = request.args.get('sort', 'newest')
+    if sort not in routes.CATALOG_SORTS:
+        abort(400, f'Unknown sort {sort!r}')
+    sort_column, descending = routes.CATALOG_SORTS[sort]
+    limit = clamp_per_page(
+        request.args.get('limit', type=int),
+        current_app.config['ITEMS_PER_PAGE'],
+        current_app.config['MAX_ITEMS_PER_PAGE'],
+    )
+
+    query = _item_query(fields, sort_column)
+    category_id = request.args.get('category_id', type=int)
+    if category_id:
+        query = query.filter(Item.category_id == category_id)
+    page = keyset_paginate(
+        query,
+        sort_column,
+        Item.id,
+        cursor=request.args.get('after'),
+        per_page=limit,
+        descending=descending,
+    )
+    return api_response(
+        {
+            'data': [_serialize_item(row, fields) for row in page.items],
+            'next_cursor': page.next_cursor,
+        }
+    )
+
+
+@api_v1.route('/items/<int:item_id>')
+@response_cache.cached('catalog')
+@read_replica
+def get_item(item_id):
+    fields = selected_fields(ITEM_FIELDS)
+    row = _item_query(fields).filter(Item.id == item_id).first()
+    if row is None:
+        abort(404)
+    return api_response({'data': _serialize_item(row, fields)})
+
+
+def _cart_payload(user_id: int) -> dict:
+    lines = load_cart(user_id)
+    return {
+        'data': [
+            {
+                'id': line.id,
+                'item_id': line.item_id,
+                'name': line.item.name,
+                'price': _money(line.item.price_cents),
+                'price_cents': line.item.price_cents,
+                'quantity': line.quantity,
+                'image': image_src(line.item, external=True),
+            }
+            for line in lines
+        ],
+        'count': sum(line.quantity for line in lines),
+        'total': _money(cart_total_cents(user_id)),
+    }
+
+
+@api_v1.route('/cart')
+@api_login_required
+def get_cart():
+    return api_response(_cart_payload(current_user.id))
+
+
+def _quantity(body: dict, default=None) -> int:
+    quantity = body.get('quantity', default)
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 0:
+        abort(400, 'quantity must be a non-negative integer')
+    return quantity
+
+
+@api_v1.route('/cart/items', methods=['POST'])
+@api_login_required
+def add_to_cart():
+    """Add `quantity` (default 1) units of `item_id` to the cart."""
+    body = json_body()
+    item_id = body.get('item_id')
+    if not isinstance(item_id, int) or isinstance(item_id, bool):
+        abort(400, 'item_id must be an integer')
+    quantity = _quantity(body, default=1)
+    if quantity < 1:
+        abort(400, 'quantity must be at least 1')
+    line_quantity = add_cart_item(current_user.id, item_id, quantity)
+    if line_quantity is None:
+        abort(404, 'No such item')
+    db.session.commit()
+    invalidate_cart(current_user.id)
+    return api_response(
+        {
+            'item_id': item_id,
+            'quantity': line_quantity,
+            'cart_count': get_cart_item_count(current_user.id),
+        },
+        status=201,
+    )
+
+
+@api_v1.route('/cart/items/<int:cart_item_id>', methods=['PATCH', 'DELETE'])
+@api_login_required
+def update_cart_item(cart_item_id):
+    """Set a cart line's quantity, or remove the line with DELETE or a quantity of 0."""
+    quantity = 0 if request.method == 'DELETE' else _quantity(json_body())
+    if set_cart_quantity(current_user.id, cart_item_id, quantity) is None:
+        abort(404)
+    db.session.commit()
+    invalidate_cart(current_user.id)
+    if not quantity:
+        return Response(status=204)
+    return api_response(
+        {
+            'id': cart_item_id,
+            'quantity': quantity,
+            'cart_count': get_cart_item_count(current_user.id),
+        }
+    )
+
+
+def _serialize_order(order, fields) -> dict:
+    return {name: ORDER_FIELDS[name](order) for name in fields}
+
+
+def _order_query(fields):
+    query = Order.query.filter_by(user_id=current_user.id)
+    if 'items' in fields:
+        query = query.options(selectinload(Order.line_items))
+    return query
+
+
+@api_v1.route('/orders')
+@api_login_required
+@read_replica
+def list_orders():
+    """List the user's orders, newest first, with `?limit=`, `?after=` and `?fields=`.
+
+    Line items are only loaded when the `items` field is selected.
+    """
+    fields = selected_fields(ORDER_FIELDS)
+    limit = clamp_per_page(
+        request.args.get('limit', type=int),
+        current_app.config['ORDERS_PER_PAGE'],
+        current_app.config['MAX_ITEMS_PER_PAGE'],
+    )
+    page = keyset_paginate(
+        _order_query(fields),
+        Order.timestamp,
+        Order.id,
+        cursor=request.args.get('after'),
+        per_page=limit,
+        descending=True,
+    )
+    return api_response(
+        {
+            'data': [_serialize_order(order, fields) for order in page.items],
+            'next_cursor': page.next_cursor,
+        }
+    )
+
+
+@api_v1.route('/orders/<int:order_id>')
+@api_login_required
+@read_replica
+def get_order(order_id):
+    fields = selected_fields(ORDER_FIELDS)
+    order = _order_query(fields).filter_by(id=order_id).first()
+    if order is None:
+        abort(404)
+    return api_response({'data': _serialize_order(order, fields)})
+
+
+def _session_payload() -> dict:
+    # Clients echo the token in an X-CSRFToken header on POST, PATCH and DELETE
+    return {
+        'user': {'id': current_user.id, 'username': current_user.username},
+        'csrf_token': generate_csrf(),
+    }
+
+
+@api_v1.route('/session', methods=['GET'])
+@api_login_required
+def get_session():
+    return api_response(_session_payload())
+
+
+@api_v1.route('/session', methods=['POST'])
+@csrf.exempt
+@limit_attempts('login')
+def create_session():
+    """Log in with a JSON `username` and `password`, starting a cookie session."""
+    body = json_body()
+    user = User.query.filter_by(username=str(body.get('username', ''))).first()
+    if user is None or not user.check_password(str(body.get('password', ''))):
+        abort(401, 'Invalid username or password')
+    # Persists a hash upgraded by check_password
+    db.session.commit()
+    login_user(user, remember=bool(body.get('remember')))
+    merge_session_cart(user.id)
+    return api_response(_session_payload(), status=201)
+
+
+@api_v1.route('/session', methods=['DELETE'])
+@api_login_required
+def delete_session():
+    invalidate_user(current_user)
+    logout_user()
+    return Response(status=204)
+
+
+app.register_blueprint(api_v1)
@@ -1,44 +1,70 @@
 import os
+from functools import cache, partial
 from flask import Flask, g
 from config import Config
+from caching import ResponseCache
+import db_pool
+import db_replicas
+import instrumentation
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate, upgrade
 from flask_login import LoginManager, current_user
 from flask_bootstrap import Bootstrap5
 from flask_wtf.csrf import CSRFProtect
+from werkzeug.local import LocalProxy
 
 PROD = True if os.environ.get('PROD', False) == 'True' else False
 
 app = Flask(__name__)
 app.config.from_object(Config)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_pool.engine_options(app.config)
+# Binds do not inherit SQLALCHEMY_ENGINE_OPTIONS, so replicas get their pools configured here
+app.config['SQLALCHEMY_BINDS'] = {
+    key: {'url': url, **db_pool.engine_options(app.config, url)}
+    for key, url in app.config['SQLALCHEMY_BINDS'].items()
+}
 
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': db_replicas.RoutingSession})
 migrate = Migrate(app, db)
 login = LoginManager(app)
 login.login_view = 'login'
 bootstrap = Bootstrap5(app)
 csrf = CSRFProtect(app)
+response_cache = ResponseCache(app)
+db_pool.init_app(app)
+db_replicas.init_app(app, db)
+instrumentation.init_app(app)
 
 
 @login.user_loader
 def load_user(user_id):
-    from models import User
+    from user_cache import load_user as load_cached_user
 
-    return User.query.get(int(user_id))
+    return load_cached_user(user_id)
 
 
 @app.before_request
 def before_request():
-    from models import CartItem
+    from cart import get_cart_item_count
+    from session_cart import session_cart_count
 
     if current_user.is_authenticated:
-        cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-        g.cart_item_count = sum(item.quantity for item in cart_items)
+        # Only evaluated if a template actually renders the cart badge.
+        g.cart_item_count = LocalProxy(
+            cache(partial(get_cart_item_count, current_user.id))
+        )
     else:
-        g.cart_item_count = 0
+        g.cart_item_count = session_cart_count()
 
 
 from routes import *
+import catalog  # registers the `flask catalog` commands
+import api  # registers the /api/v1 blueprint
 
 if __name__ == '__main__':
+    import outbox
+
+    # With the reloader, only the child process that serves requests sends email
+    if PROD or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        outbox.start_worker(app)
     app.run(debug=not PROD)
@@ -0,0 +1,337 @@
+"""Benchmark the hot StoneMarket routes against a synthetic SQLite database.
+
+Seeds a catalog, users and order history of configurable size into a fresh
+SQLite file, drives the routes through the Flask test client with Stripe
+stubbed out, and reports p50/p95/p99 latency, SQL statements per request and
+memory allocated per request. Results can be saved and later compared against
+to fail a build on regressions:
+
+    python benchmark.py --save baseline.json
+    python benchmark.py --baseline baseline.json --max-regression 0.25
+
+`--import-budget` also times a cold `import app` in fresh interpreters, which
+is what a new container or worker waits for before it can serve requests.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from contextlib import contextmanager
+from datetime import datetime, timedelta, UTC
+
+ROUTES = ['index', 'product_details', 'add_to_cart', 'cart', 'checkout', 'order_history']
+PASSWORD = 'benchmark'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=2000, help='catalog size')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--orders', type=int, default=5000, help='orders spread over the users')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests per route')
+    parser.add_argument('--clients', type=int, default=5, help='logged-in users taking turns')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='comma-separated routes to run')
+    parser.add_argument('--seed', type=int, default=42, help='random seed for data and request order')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results saved with --save')
+    parser.add_argument(
+        '--max-regression',
+        type=float,
+        default=0.2,
+        help='fail if a p95 or queries per request grows by more than this fraction',
+    )
+    parser.add_argument(
+        '--import-budget',
+        type=float,
+        help='fail if a cold `import app` takes longer than this many seconds (median of 5)',
+    )
+    return parser.parse_args(argv)
+
+
+def seed_database(args, db, models, search):
+    """Fill the empty database with a synthetic catalog, users and order history."""
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(args.seed)
+    db.session.execute(
+        insert(models.Category),
+        [{'name': f'Category {n}'} for n in range(1, args.categories + 1)],
+    )
+    words = ['granite', 'marble', 'slate', 'quartz', 'onyx', 'basalt', 'polished', 'rough']
+    items = [
+        {
+            'name': f'Stone {n}',
+            'description': f'A {" ".join(rng.sample(words, 3))} stone, number {n}',
+            'price_cents': rng.randint(100, 50000),
+            'image': 'https://example.com/stone.png',
+            # Enough stock that checkout never runs out during a run
+            'stock': 10**9,
+            'weight': round(rng.uniform(0.1, 50), 2),
+            'category_id': rng.randint(1, args.categories),
+        }
+        for n in range(1, args.items + 1)
+    ]
+    db.session.execute(insert(models.Item), items)
+
+    # Hashing is deliberately slow, so every user shares one hash
+    password_hash = generate_password_hash(PASSWORD)
+    db.session.execute(
+        insert(models.User),
+        [
+            {
+                'username': f'user{n}',
+                'email': f'user{n}@example.com',
+                'password_hash': password_hash,
+                'is_active': True,
+                'is_admin': False,
+            }
+            for n in range(1, args.users + 1)
+        ],
+    )
+
+    now = datetime.now(UTC)
+    orders, line_items = [], []
+    for order_id in range(1, args.orders + 1):
+        lines = rng.sample(range(1, args.items + 1), k=min(rng.randint(1, 4), args.items))
+        total = 0
+        for item_id in lines:
+            item = items[item_id - 1]
+            quantity = rng.randint(1, 3)
+            total += item['price_cents'] * quantity
+            line_items.append(
+                {
+                    'order_id': order_id,
+                    'item_id': item_id,
+                    'name': item['name'],
+                    'description': item['description'],
+                    'price_cents': item['price_cents'],
+                    'quantity': quantity,
+                    'image': item['image'],
+                }
+            )
+        orders.append(
+            {
+                'id': order_id,
+                'user_id': rng.randint(1, args.users),
+                'total_amount_cents': total,
+                'status': 'Pending',
+                'timestamp': now - timedelta(minutes=order_id),
+            }
+        )
+    db.session.execute(insert(models.Order), orders)
+    db.session.execute(insert(models.OrderItem), line_items)
+    db.session.commit()
+
+    search.get_search_backend().rebuild()
+    db.session.commit()
+
+
+def stub_stripe():
+    """Make checkout create fake Stripe sessions without touching the network."""
+    import stripe
+
+    counter = iter(range(1, sys.maxsize))
+    stripe.checkout.Session.create = lambda **kwargs: types.SimpleNamespace(
+        id=f'cs_bench_{next(counter)}'
+    )
+
+
+def make_request(client, route, args, rng):
+    if route == 'index':
+        sort = rng.choice(['newest', 'price_asc', 'price_desc', 'name'])
+        return client.get(f'/?sort={sort}')
+    if route == 'product_details':
+        return client.get(f'/product/{rng.randint(1, args.items)}')
+    if route == 'add_to_cart':
+        return client.post(f'/add_to_cart/{rng.randint(1, args.items)}')
+    if route == 'cart':
+        return client.get('/cart')
+    if route == 'checkout':
+        return client.post('/checkout')
+    if route == 'order_history':
+        return client.get('/order_history')
+    raise ValueError(f'Unknown route {route!r}')
+
+
+def measure_import(runs=5):
+    """Return the wall-clock seconds of a cold `import app` in fresh interpreters, sorted."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-c', 'import app'],
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)
+
+
+@contextmanager
+def track_statements(engines):
+    """Count the SQL statements run on every engine, replicas included, within the block.
+
+    Yields:
+        dict: A counter whose 'statements' entry grows with each statement.
+    """
+    from sqlalchemy import event
+
+    counter = {'statements': 0}
+
+    def count_statement(*_):
+        counter['statements'] += 1
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        yield counter
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', count_statement)
+
+
+def percentile(quantiles, p):
+    return quantiles[p - 1] if quantiles else 0.0
+
+
+def run_route(route, clients, args, counter):
+    rng = random.Random(f'{args.seed}:{route}')
+    for n in range(args.warmup):
+        make_request(clients[n % len(clients)], route, args, rng)
+
+    latencies, queries = [], []
+    for n in range(args.requests):
+        client = clients[n % len(clients)]
+        before = counter['statements']
+        started = time.perf_counter()
+        response = make_request(client, route, args, rng)
+        latencies.append(time.perf_counter() - started)
+        queries.append(counter['statements'] - before)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{route} returned {response.status_code}')
+
+    # Allocation tracking slows every call down, so it gets its own pass
+    tracemalloc.start()
+    sample = max(1, min(args.requests // 4, 50))
+    for n in range(sample):
+        make_request(clients[n % len(clients)], route, args, rng)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(quantiles, 50) * 1000, 3),
+        'p95_ms': round(percentile(quantiles, 95) * 1000, 3),
+        'p99_ms': round(percentile(quantiles, 99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'queries_per_request': round(statistics.fmean(queries), 2),
+        'max_queries': max(queries),
+        'peak_alloc_kb': round(peak / 1024, 1),
+        'retained_kb_per_request': round(current / 1024 / sample, 2),
+    }
+
+
+def print_table(results):
+    columns = [
+        ('p50_ms', 'p50 ms'),
+        ('p95_ms', 'p95 ms'),
+        ('p99_ms', 'p99 ms'),
+        ('queries_per_request', 'queries'),
+        ('peak_alloc_kb', 'peak KiB'),
+        ('retained_kb_per_request', 'KiB/req'),
+    ]
+    print(f'{"route":<16}' + ''.join(f'{label:>11}' for _, label in columns))
+    for route, stats in results.items():
+        print(f'{route:<16}' + ''.join(f'{stats[key]:>11}' for key, _ in columns))
+
+
+def compare(results, baseline, max_regression):
+    """Return a description of every metric that regressed beyond `max_regression`."""
+    regressions = []
+    for route, stats in results.items():
+        previous = baseline.get(route)
+        if previous is None:
+            continue
+        for key in ('p95_ms', 'queries_per_request'):
+            if previous[key] and stats[key] > previous[key] * (1 + max_regression):
+                regressions.append(f'{route}: {key} {previous[key]} -> {stats[key]}')
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    routes = [route.strip() for route in args.routes.split(',') if route.strip()]
+
+    db_dir = tempfile.mkdtemp(prefix='stonemarket-bench-')
+    # The app reads its configuration at import time
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(db_dir, 'bench.db')
+    os.environ['OUTBOX_WORKER'] = 'external'
+    # Every client logs in from the same address
+    os.environ['LOGIN_RATE_LIMIT'] = '0'
+
+    import_failed = False
+    if args.import_budget:
+        timings = measure_import()
+        median = statistics.median(timings)
+        print(
+            f'Cold import of app: median {median * 1000:.0f} ms, '
+            f'max {timings[-1] * 1000:.0f} ms (budget {args.import_budget * 1000:.0f} ms)'
+        )
+        import_failed = median > args.import_budget
+
+    from flask_migrate import upgrade
+    from app import app, db
+    import models
+    import search
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    stub_stripe()
+
+    with app.app_context():
+        upgrade()
+        started = time.perf_counter()
+        seed_database(args, db, models, search)
+        print(
+            f'Seeded {args.items} items, {args.users} users and {args.orders} orders '
+            f'in {time.perf_counter() - started:.1f}s'
+        )
+        engines = list(db.engines.values())
+
+    clients = []
+    for n in range(1, min(args.clients, args.users) + 1):
+        client = app.test_client()
+        client.post('/login', data={'username': f'user{n}', 'password': PASSWORD})
+        clients.append(client)
+
+    with track_statements(engines) as counter:
+        results = {route: run_route(route, clients, args, counter) for route in routes}
+    print_table(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print('Regressions:\n  ' + '\n  '.join(regressions))
+            return 1
+    if import_failed:
+        print('Cold import exceeded its budget')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,395 @@
+import hashlib
+import itertools
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Hashable
+from flask import Response, make_response, request, session
+from flask_login import current_user
+
+_MISSING = object()
+
+# Generation counters unused for this long are dropped; see `ResponseCache.generation`
+DEFAULT_COUNTER_TTL = 86400.0
+
+
+class TTLCache:
+    """
+    A thread-safe, size-bounded LRU cache whose entries expire after a fixed TTL.
+
+    Attributes:
+        maxsize (int): The maximum number of entries kept before evicting the least recently used.
+        ttl (float): The number of seconds an entry stays valid.
+        hits (int): The number of lookups answered from the cache.
+        misses (int): The number of lookups that found no valid entry.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Return the cached value for `key`, computing and storing it on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Return the hit/miss counters and current size of the cache."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+        }
+
+
+class MemoryBackend:
+    """Response cache storage in this process's memory."""
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+        max_counters: int = 100000,
+        counter_ttl: float = DEFAULT_COUNTER_TTL,
+    ) -> None:
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._counters = TTLCache(maxsize=max_counters, ttl=counter_ttl)
+        # Shared by every counter, so a dropped counter never gets an old value back
+        self._sequence = itertools.count(1)
+
+    def get(self, key: str) -> Any:
+        return self._cache.get(key)
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self._cache.set(key, value, ttl=ttl)
+
+    def incr(self, key: str) -> int:
+        value = next(self._sequence)
+        self._counters.set(key, value)
+        return value
+
+    def counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+class FileSystemBackend:
+    """Response cache storage shared by every process on the host through a directory.
+
+    Files last written more than `counter_ttl` seconds ago, expired pages and
+    unused counters alike, are deleted by a sweep run at most every
+    `sweep_interval` seconds per process.
+    """
+
+    sweep_interval = 3600.0
+
+    def __init__(self, directory: str, counter_ttl: float = DEFAULT_COUNTER_TTL) -> None:
+        self.directory = directory
+        self.counter_ttl = counter_ttl
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._swept_at = time.monotonic()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key: str) -> Any:
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires_at, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        if expires_at < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((time.time() + ttl, value), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self._maybe_sweep()
+
+    def _maybe_sweep(self) -> None:
+        if time.monotonic() - self._swept_at < self.sweep_interval:
+            return
+        self._swept_at = time.monotonic()
+        self.sweep()
+
+    def sweep(self) -> int:
+        """Delete the files last written more than `counter_ttl` seconds ago."""
+        cutoff = time.time() - self.counter_ttl
+        removed = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    # Rewritten or removed by another process meanwhile
+                    pass
+        return removed
+
+    def incr(self, key: str) -> int:
+        # Counters only need to change, not to be exact, so a random token is
+        # written instead of a read-modify-write that could race between processes.
+        value = int.from_bytes(os.urandom(4), 'big')
+        path = self._path('counter:' + key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(value))
+        os.replace(tmp_path, path)
+        self._maybe_sweep()
+        return value
+
+    def counter(self, key: str) -> int:
+        try:
+            with open(self._path('counter:' + key)) as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class RedisBackend:
+    """Response cache storage in Redis or any server speaking its protocol."""
+
+    def __init__(
+        self, url: str, prefix: str = 'stonemarket:', counter_ttl: float = DEFAULT_COUNTER_TTL
+    ) -> None:
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError(
+                "RESPONSE_CACHE_BACKEND='redis' requires the 'redis' package"
+            ) from e
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.counter_ttl = counter_ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Any:
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self.client.set(
+            self.prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=int(ttl)
+        )
+
+    def incr(self, key: str) -> int:
+        # A random token rather than INCR: a counter that expired and came back
+        # would otherwise count up through the values it had before.
+        value = int.from_bytes(os.urandom(4), 'big')
+        self.client.set(self.prefix + 'counter:' + key, value, ex=int(self.counter_ttl))
+        return value
+
+    def counter(self, key: str) -> int:
+        return int(self.client.get(self.prefix + 'counter:' + key) or 0)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class ResponseCache:
+    """
+    Caches whole rendered pages for anonymous visitors.
+
+    Entries are grouped into namespaces (e.g. 'catalog'). Every namespace has a
+    generation counter that is part of each key, so `invalidate` drops all of a
+    namespace's pages at once by bumping the counter. Responses carry an ETag so
+    browsers can revalidate with `If-None-Match` and get a 304.
+
+    Configured through `RESPONSE_CACHE_BACKEND` ('memory', 'filesystem', 'redis'
+    or 'null'), `RESPONSE_CACHE_TTL`, `RESPONSE_CACHE_MAX_AGE`,
+    `RESPONSE_CACHE_MAX_ENTRIES`, `RESPONSE_CACHE_COUNTER_TTL`,
+    `RESPONSE_CACHE_MAX_COUNTERS`, `RESPONSE_CACHE_DIR` and `RESPONSE_CACHE_REDIS_URL`.
+    """
+
+    def __init__(self, app=None) -> None:
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        kind = app.config['RESPONSE_CACHE_BACKEND']
+        counter_ttl = app.config['RESPONSE_CACHE_COUNTER_TTL']
+        if kind == 'memory':
+            self.backend = MemoryBackend(
+                maxsize=app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+                ttl=app.config['RESPONSE_CACHE_TTL'],
+                max_counters=app.config['RESPONSE_CACHE_MAX_COUNTERS'],
+                counter_ttl=counter_ttl,
+            )
+        elif kind == 'filesystem':
+            self.backend = FileSystemBackend(
+                app.config['RESPONSE_CACHE_DIR']
+                or os.path.join(app.instance_path, 'response_cache'),
+                counter_ttl=counter_ttl,
+            )
+        elif kind == 'redis':
+            self.backend = RedisBackend(
+                app.config['RESPONSE_CACHE_REDIS_URL'], counter_ttl=counter_ttl
+            )
+        elif kind == 'null':
+            self.backend = None
+        else:
+            raise ValueError(f'Unknown RESPONSE_CACHE_BACKEND {kind!r}')
+        self.ttl = app.config['RESPONSE_CACHE_TTL']
+        self.max_age = app.config['RESPONSE_CACHE_MAX_AGE']
+        app.extensions['response_cache'] = self
+
+    def invalidate(self, namespace: str) -> None:
+        """Drop every cached page in `namespace`, e.g. after the catalog changed."""
+        if self.backend is not None:
+            self.backend.incr('generation:' + namespace)
+
+    def generation(self, namespace: str) -> int:
+        """Return the namespace's generation counter, which changes on every `invalidate`.
+
+        Other caches can include it in their keys to be invalidated along with the
+        namespace, across processes when the backend is shared.
+
+        Counters are dropped `RESPONSE_CACHE_COUNTER_TTL` seconds after their
+        last `invalidate`, so per-user namespaces do not pile up; the memory
+        backend also drops its least recently used ones beyond
+        `RESPONSE_CACHE_MAX_COUNTERS`. A dropped counter reads 0 again but
+        `invalidate` never hands out an earlier value, so as long as the
+        counter TTL exceeds the TTL of every cache keyed on a generation, no
+        stale entry is served again.
+        """
+        if self.backend is None:
+            return 0
+        return self.backend.counter('generation:' + namespace)
+
+    def _key(self, namespace: str) -> str:
+        generation = self.generation(namespace)
+        args = '&'.join(
+            f'{name}={value}' for name, value in sorted(request.args.items(multi=True))
+        )
+        return f'{namespace}:{generation}:{request.path}?{args}'
+
+    @staticmethod
+    def _cacheable_request() -> bool:
+        # Logged-in pages show the cart badge and admin controls, and pages
+        # about to show flashed messages or the badge of an anonymous cart
+        # (session_cart.SESSION_KEY) are specific to one visitor.
+        return (
+            request.method == 'GET'
+            and not current_user.is_authenticated
+            and '_flashes' not in session
+            and 'cart' not in session
+        )
+
+    def _finalize(self, response: Response, shared: bool = True) -> Response:
+        # A response that is about to set a session cookie must never be
+        # stored by shared caches, or the cookie would be handed to others.
+        if shared:
+            response.cache_control.public = True
+        else:
+            response.cache_control.private = True
+        response.cache_control.max_age = self.max_age
+        response.vary.add('Cookie')
+        return response.make_conditional(request)
+
+    def cached(self, namespace: str, timeout: float = None):
+        """Decorate a view so its anonymous GET responses are served from the cache."""
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.backend is None or not self._cacheable_request():
+                    return view(*args, **kwargs)
+
+                key = self._key(namespace)
+                entry = self.backend.get(key)
+                if entry is not None:
+                    body, mimetype, etag = entry
+                    response = Response(body, mimetype=mimetype)
+                    # Weak on both paths: the API compresses bodies after this
+                    response.set_etag(etag, weak=True)
+                    response.headers['X-Cache'] = 'HIT'
+                    return self._finalize(response)
+
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+                body = response.get_data()
+                etag = hashlib.md5(body).hexdigest()
+                self.backend.set(
+                    key,
+                    (body, response.mimetype, etag),
+                    self.ttl if timeout is None else timeout,
+                )
+                response.set_etag(etag, weak=True)
+                response.headers['X-Cache'] = 'MISS'
+                return self._finalize(response, shared=not session.modified)
+
+            return wrapper
+
+        return decorator
+
+    def stats(self) -> dict:
+        return self.backend.stats() if self.backend is not None else {}
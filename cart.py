@@ -0,0 +1,224 @@
+from decimal import Decimal
+from typing import Dict, List, Optional
+from flask import current_app
+from sqlalchemy import Integer, case, delete, func, literal, select, update
+from sqlalchemy.orm import joinedload
+from app import db, response_cache
+from caching import TTLCache
+from db_utils import dialect_insert
+from models import CartItem, Item
+from money import from_cents
+
+
+def _cart_count_cache() -> TTLCache:
+    cache = current_app.extensions.get('cart_counts')
+    if cache is None:
+        cache = current_app.extensions['cart_counts'] = TTLCache(
+            maxsize=current_app.config['CART_COUNT_CACHE_SIZE'],
+            ttl=current_app.config['CART_COUNT_CACHE_TTL'],
+        )
+    return cache
+
+
+def load_cart(user_id: int) -> List[CartItem]:
+    """Return a user's cart items with their `Item` loaded in the same query."""
+    return (
+        CartItem.query.options(joinedload(CartItem.item))
+        .filter_by(user_id=user_id)
+        .order_by(CartItem.id)
+        .all()
+    )
+
+
+def cart_total(user_id: int) -> Decimal:
+    """Return the value of a user's cart, summed in cents by the database."""
+    return from_cents(cart_total_cents(user_id))
+
+
+def cart_total_cents(user_id: int) -> int:
+    """Return the value of a user's cart in cents computed by the database."""
+    return db.session.scalar(
+        select(func.coalesce(func.sum(Item.price_cents * CartItem.quantity), 0))
+        .select_from(CartItem)
+        .join(Item, CartItem.item_id == Item.id)
+        .where(CartItem.user_id == user_id)
+    )
+
+
+def add_cart_item(user_id: int, item_id: int, quantity: int = 1) -> Optional[int]:
+    """Add units of an item to a user's cart, returning the line's new quantity.
+
+    On SQLite and Postgres this is a single `INSERT ... SELECT ... ON CONFLICT DO
+    UPDATE` against the unique (user_id, item_id) index: the SELECT from `items`
+    doubles as the existence check and concurrent adds cannot lose an increment.
+    The caller commits.
+
+    Returns:
+        int: The new quantity, or None if the item does not exist.
+    """
+    stmt = dialect_insert(CartItem.__table__)
+    if stmt is None:
+        if db.session.get(Item, item_id) is None:
+            return None
+        cart_item = CartItem.query.filter_by(user_id=user_id, item_id=item_id).first()
+        if cart_item is None:
+            cart_item = CartItem(user_id=user_id, item_id=item_id, quantity=0)
+            db.session.add(cart_item)
+        cart_item.quantity += quantity
+        db.session.flush()
+        return cart_item.quantity
+
+    stmt = stmt.from_select(
+        ['user_id', 'item_id', 'quantity'],
+        select(literal(user_id, Integer), Item.id, literal(quantity, Integer)).where(
+            Item.id == item_id
+        ),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'item_id'],
+        set_={'quantity': CartItem.__table__.c.quantity + stmt.excluded.quantity},
+    ).returning(CartItem.__table__.c.quantity)
+    return db.session.scalar(stmt)
+
+
+def merge_cart_items(user_id: int, quantities: Dict[int, int]) -> None:
+    """Add several items to a user's cart, e.g. the cart they filled before logging in.
+
+    On SQLite and Postgres all lines go in with one `INSERT ... SELECT ... ON
+    CONFLICT DO UPDATE`, which adds to lines the user already has and skips
+    items that no longer exist. The caller commits.
+
+    Args:
+        user_id (int): The user whose cart the items are added to.
+        quantities (dict): Units to add, by item id.
+    """
+    if not quantities:
+        return
+    stmt = dialect_insert(CartItem.__table__)
+    if stmt is None:
+        for item_id, quantity in quantities.items():
+            add_cart_item(user_id, item_id, quantity)
+        return
+
+    stmt = stmt.from_select(
+        ['user_id', 'item_id', 'quantity'],
+        select(
+            literal(user_id, Integer), Item.id, case(quantities, value=Item.id)
+        ).where(Item.id.in_(quantities)),
+    )
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=['user_id', 'item_id'],
+            set_={'quantity': CartItem.__table__.c.quantity + stmt.excluded.quantity},
+        )
+    )
+
+
+def change_cart_quantity(user_id: int, cart_item_id: int, delta: int) -> Optional[int]:
+    """Atomically add `delta` (possibly negative) to a cart line of a user.
+
+    A line that drops to zero is removed. The caller commits.
+
+    Returns:
+        int: The new quantity (0 if the line was removed), or None if the user has no such line.
+    """
+    owned = (CartItem.id == cart_item_id, CartItem.user_id == user_id)
+    stmt = update(CartItem).where(*owned).values(quantity=CartItem.quantity + delta)
+    if db.session.get_bind().dialect.update_returning:
+        quantity = db.session.scalar(
+            stmt.returning(CartItem.quantity).execution_options(synchronize_session=False)
+        )
+    else:
+        db.session.execute(stmt.execution_options(synchronize_session=False))
+        quantity = db.session.scalar(select(CartItem.quantity).where(*owned))
+    if quantity is None:
+        return None
+    if quantity <= 0:
+        # Only delete if no concurrent add raised it again in the meantime
+        db.session.execute(
+            delete(CartItem)
+            .where(*owned, CartItem.quantity <= 0)
+            .execution_options(synchronize_session=False)
+        )
+        return 0
+    return quantity
+
+
+def set_cart_quantity(user_id: int, cart_item_id: int, quantity: int) -> Optional[int]:
+    """Set the quantity of a cart line of a user, removing the line at zero. The caller commits.
+
+    Returns:
+        int: The new quantity, or None if the user has no such line.
+    """
+    owned = (CartItem.id == cart_item_id, CartItem.user_id == user_id)
+    if quantity <= 0:
+        stmt = delete(CartItem).where(*owned)
+    else:
+        stmt = update(CartItem).where(*owned).values(quantity=quantity)
+    result = db.session.execute(stmt.execution_options(synchronize_session=False))
+    if not result.rowcount:
+        return None
+    return max(quantity, 0)
+
+
+def remove_cart_items(user_id: int, quantities: Dict[int, int]) -> None:
+    """Take units of several items out of a user's cart, e.g. the units just ordered.
+
+    Lines the user added since are kept, and lines that drop to zero are removed.
+    The caller commits.
+
+    Args:
+        user_id (int): The user whose cart the units are taken from.
+        quantities (dict): Units to remove, by item id.
+    """
+    if not quantities:
+        return
+    owned = (CartItem.user_id == user_id, CartItem.item_id.in_(quantities))
+    db.session.execute(
+        update(CartItem)
+        .where(*owned)
+        .values(quantity=CartItem.quantity - case(quantities, value=CartItem.item_id))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        delete(CartItem)
+        .where(*owned, CartItem.quantity <= 0)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def count_cart_items(user_id: int) -> int:
+    """Return the total quantity in a user's cart with a single aggregate query."""
+    return db.session.scalar(
+        select(func.coalesce(func.sum(CartItem.quantity), 0)).where(
+            CartItem.user_id == user_id
+        )
+    )
+
+
+def _cart_namespace(user_id: int) -> str:
+    return f'cart:{user_id}'
+
+
+def get_cart_item_count(user_id: int) -> int:
+    """Return the cart badge count for a user, served from the per-user cache when fresh.
+
+    Entries are keyed on the user's 'cart:<id>' generation of the response
+    cache, so `invalidate_cart` in one process reaches the others when the
+    response cache backend is shared; otherwise `CART_COUNT_CACHE_TTL` bounds
+    staleness.
+    """
+    key = (user_id, response_cache.generation(_cart_namespace(user_id)))
+    return _cart_count_cache().get_or_set(key, lambda: count_cart_items(user_id))
+
+
+def invalidate_cart(user_id: int) -> None:
+    """Forget the cached cart count of a user after their cart changed."""
+    namespace = _cart_namespace(user_id)
+    _cart_count_cache().delete((user_id, response_cache.generation(namespace)))
+    response_cache.invalidate(namespace)
+
+
+def cart_count_stats() -> dict:
+    """Return the hit/miss counters of this process's cart count cache."""
+    return _cart_count_cache().stats()
@@ -0,0 +1,293 @@
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import Dict, Iterator, List, Tuple
+import click
+from sqlalchemy import case, select
+from app import app, db, response_cache
+import search
+from category_cache import invalidate_categories
+from db_utils import dialect_insert, upsert
+from models import Category, Item
+from money import from_cents, to_cents
+
+EXPORT_FIELDS = ['name', 'description', 'price', 'image', 'stock', 'weight', 'category']
+MAX_REPORTED_ERRORS = 20
+
+
+class RowError(ValueError):
+    """Raised for an import row that does not describe a valid item."""
+
+
+def _read_rows(stream, fmt: str) -> Iterator[Tuple[int, dict]]:
+    """Yield (line number, row) pairs from a CSV or JSON Lines stream, one at a time."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_num, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_num, RowError(f'invalid JSON: {e.msg}')
+
+
+def _text(row: dict, field: str, max_length: int, required: bool = True) -> str:
+    value = str(row.get(field) or '').strip()
+    if required and not value:
+        raise RowError(f'{field} is required')
+    if len(value) > max_length:
+        raise RowError(f'{field} is longer than {max_length} characters')
+    return value
+
+
+def _number(row: dict, field: str, parse, default=None):
+    value = row.get(field)
+    if value in (None, ''):
+        if default is None:
+            raise RowError(f'{field} is required')
+        return default
+    try:
+        number = parse(str(value).strip())
+    except (ValueError, InvalidOperation):
+        raise RowError(f'{field} {value!r} is not a number')
+    # NaN and infinity parse, but cannot be compared, converted to cents or stored
+    if not Decimal(number).is_finite():
+        raise RowError(f'{field} must be a finite number')
+    if number < 0:
+        raise RowError(f'{field} must not be negative')
+    return number
+
+
+def validate_row(row: dict) -> dict:
+    """Turn an import row into `items` column values and its category name.
+
+    Raises:
+        RowError: If a field is missing, too long or not a valid number.
+    """
+    return {
+        'name': _text(row, 'name', 64),
+        'description': _text(row, 'description', 200),
+        'price_cents': to_cents(_number(row, 'price', Decimal)),
+        'image': _text(row, 'image', 200),
+        'stock': _number(row, 'stock', int, default=0),
+        'weight': _number(row, 'weight', float, default=0.0),
+        'category': _text(row, 'category', 64),
+    }
+
+
+class CategoryResolver:
+    """Maps category names to ids, loading them once and creating missing ones in batches."""
+
+    def __init__(self, create: bool) -> None:
+        self.create = create
+        self.ids = dict(db.session.execute(select(Category.name, Category.id)).all())
+        self.created = set()
+
+    def resolve(self, names) -> Dict[str, int]:
+        missing = {name for name in names if name not in self.ids}
+        if missing and self.create:
+            stmt = dialect_insert(Category.__table__)
+            rows = [{'name': name} for name in sorted(missing)]
+            if stmt is not None:
+                db.session.execute(stmt.on_conflict_do_nothing(index_elements=['name']), rows)
+            else:
+                db.session.execute(Category.__table__.insert(), rows)
+            self.ids.update(
+                db.session.execute(
+                    select(Category.name, Category.id).where(Category.name.in_(missing))
+                ).all()
+            )
+            self.created.update(missing)
+        return self.ids
+
+    def rollback(self) -> None:
+        """Forget the categories created since the last commit, after rolling it back."""
+        for name in self.created:
+            self.ids.pop(name, None)
+        self.created.clear()
+
+    def commit(self) -> None:
+        self.created.clear()
+
+
+def _chunks(iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def import_items(stream, fmt: str, chunk_size: int, create_categories: bool, dry_run: bool):
+    """Validate and upsert items from a stream, committing one chunk at a time.
+
+    Items are matched on their unique name. Existing items get every imported
+    column overwritten, and their Stripe Price is dropped if the price changed,
+    as are their thumbnails if the image changed.
+
+    Returns:
+        tuple: (rows read, rows written, list of (line number, error) pairs).
+    """
+    categories = CategoryResolver(create=create_categories)
+    read = written = 0
+    errors: List[Tuple[int, str]] = []
+
+    for chunk in _chunks(_read_rows(stream, fmt), chunk_size):
+        read += len(chunk)
+        valid = {}
+        for line_num, row in chunk:
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                if not isinstance(row, dict):
+                    raise RowError('expected an object')
+                # A name repeated within the chunk keeps its last row, since one
+                # ON CONFLICT statement cannot update the same row twice
+                values = validate_row(row)
+                valid[values['name']] = (line_num, values)
+            except RowError as e:
+                errors.append((line_num, str(e)))
+
+        category_ids = categories.resolve({values['category'] for _, values in valid.values()})
+        rows = []
+        for line_num, values in valid.values():
+            category_id = category_ids.get(values.pop('category'))
+            if category_id is None:
+                errors.append((line_num, 'unknown category'))
+                continue
+            rows.append({**values, 'category_id': category_id})
+
+        upsert(
+            Item.__table__,
+            rows,
+            key=['name'],
+            set_=lambda incoming: {
+                'stripe_price_id': case(
+                    (Item.price_cents == incoming['price_cents'], Item.stripe_price_id),
+                    else_=None,
+                ),
+                # Thumbnails of a replaced image are re-rendered by `flask images ingest`
+                'image_digest': case(
+                    (Item.image == incoming['image'], Item.image_digest), else_=None
+                ),
+                'image_width': case(
+                    (Item.image == incoming['image'], Item.image_width), else_=None
+                ),
+            },
+        )
+        written += len(rows)
+        if dry_run:
+            db.session.rollback()
+            categories.rollback()
+        else:
+            db.session.commit()
+            categories.commit()
+
+    return read, written, errors
+
+
+def export_items(stream, fmt: str, chunk_size: int) -> int:
+    """Write every item to a stream in id order, reading `chunk_size` rows at a time."""
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+    exported = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(
+                Item.id,
+                Item.name,
+                Item.description,
+                Item.price_cents,
+                Item.image,
+                Item.stock,
+                Item.weight,
+                Category.name.label('category'),
+            )
+            .outerjoin(Category, Item.category_id == Category.id)
+            .where(Item.id > last_id)
+            .order_by(Item.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        for row in rows:
+            record = {
+                'name': row.name,
+                'description': row.description,
+                'price': str(from_cents(row.price_cents)),
+                'image': row.image,
+                'stock': row.stock,
+                'weight': row.weight,
+                'category': row.category or '',
+            }
+            if writer is not None:
+                writer.writerow(record)
+            else:
+                stream.write(json.dumps(record) + '\n')
+        exported += len(rows)
+        last_id = rows[-1].id
+    return exported
+
+
+def _format_for(path: str, fmt: str) -> str:
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+@app.cli.group('catalog')
+def catalog_cli():
+    """Bulk catalog commands."""
+
+
+@catalog_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows per INSERT batch and commit.')
+@click.option('--create-categories/--no-create-categories', default=True, show_default=True)
+@click.option('--dry-run', is_flag=True, help='Validate and write, then roll every chunk back.')
+def import_command(path, fmt, chunk_size, create_categories, dry_run):
+    """Create or update items from a CSV or JSON Lines file, matched on name.
+
+    Columns: name, description, price (in dollars), image, stock, weight, category.
+    """
+    started = time.perf_counter()
+    with open(path, encoding='utf-8', newline='') as stream:
+        read, written, errors = import_items(
+            stream, _format_for(path, fmt), chunk_size, create_categories, dry_run
+        )
+    elapsed = time.perf_counter() - started
+
+    if written and not dry_run:
+        search.get_search_backend().rebuild()
+        db.session.commit()
+        invalidate_categories()
+        response_cache.invalidate('catalog')
+
+    for line_num, message in errors[:MAX_REPORTED_ERRORS]:
+        click.echo(f'line {line_num}: {message}', err=True)
+    if len(errors) > MAX_REPORTED_ERRORS:
+        click.echo(f'... and {len(errors) - MAX_REPORTED_ERRORS} more errors', err=True)
+    click.echo(
+        f'{"Validated" if dry_run else "Imported"} {written} of {read} row(s) in {elapsed:.2f}s '
+        f'({read / elapsed if elapsed else 0:.0f} rows/s), {len(errors)} rejected.'
+    )
+
+
+@catalog_cli.command('export')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows read per query.')
+def export_command(path, fmt, chunk_size):
+    """Write every item to a CSV or JSON Lines file that `flask catalog import` accepts."""
+    started = time.perf_counter()
+    with open(path, 'w', encoding='utf-8', newline='') as stream:
+        exported = export_items(stream, _format_for(path, fmt), chunk_size)
+    elapsed = time.perf_counter() - started
+    click.echo(f'Exported {exported} item(s) in {elapsed:.2f}s.')
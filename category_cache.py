@@ -0,0 +1,56 @@
+from typing import List, NamedTuple, Tuple
+from flask import current_app
+from app import db, response_cache
+from caching import TTLCache
+from models import Category
+
+
+class CategoryEntry(NamedTuple):
+    """A read-only snapshot of a category that is safe to share between requests."""
+
+    id: int
+    name: str
+
+
+def _category_cache() -> TTLCache:
+    cache = current_app.extensions.get('categories')
+    if cache is None:
+        cache = current_app.extensions['categories'] = TTLCache(
+            maxsize=4, ttl=current_app.config['CATEGORY_CACHE_TTL']
+        )
+    return cache
+
+
+def _load_categories() -> Tuple[CategoryEntry, ...]:
+    return tuple(
+        CategoryEntry(*row)
+        for row in db.session.execute(
+            db.select(Category.id, Category.name).order_by(Category.id)
+        )
+    )
+
+
+def all_categories() -> Tuple[CategoryEntry, ...]:
+    """Return every category, loaded once per process and version.
+
+    The cache is keyed on the 'categories' generation of the response cache, so
+    `invalidate_categories` in one process reaches the others when the response
+    cache backend is shared; otherwise `CATEGORY_CACHE_TTL` bounds staleness.
+    """
+    generation = response_cache.generation('categories')
+    return _category_cache().get_or_set(generation, _load_categories)
+
+
+def category_choices() -> List[Tuple[int, str]]:
+    """Return the categories as (id, name) choices for a SelectField."""
+    return [(category.id, category.name) for category in all_categories()]
+
+
+def invalidate_categories() -> None:
+    """Drop the cached categories after one was added, renamed or deleted."""
+    response_cache.invalidate('categories')
+    _category_cache().clear()
+
+
+def category_cache_stats() -> dict:
+    return _category_cache().stats()
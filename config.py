@@ -5,6 +5,96 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///ecommerce.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection pool of the SQLAlchemy engine, per web worker process. Size it so
+    # workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays below the server's max_connections.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 5)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 10)
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT') or 30)
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)
+    DB_POOL_PRE_PING = (os.environ.get('DB_POOL_PRE_PING') or 'True') == 'True'
+    # Milliseconds before Postgres cancels a statement; 0 disables the limit.
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT') or 0)
+    # Seconds of connection wait in one request that get logged as a warning; 0 disables it.
+    DB_POOL_SLOW_WAIT = float(os.environ.get('DB_POOL_SLOW_WAIT') or 0.1)
+    DB_POOL_SERVER_TIMING = os.environ.get('DB_POOL_SERVER_TIMING') == 'True'
+    # Read replicas as a comma-separated list of database URLs. Each becomes a
+    # `replica_<n>` bind that catalog and order history reads are spread over.
+    DB_REPLICA_URLS = [
+        url.strip() for url in (os.environ.get('DB_REPLICA_URLS') or '').split(',') if url.strip()
+    ]
+    SQLALCHEMY_BINDS = {f'replica_{n}': url for n, url in enumerate(DB_REPLICA_URLS)}
+    # Seconds of replication lag after which a replica is skipped, and how often it is checked.
+    DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG') or 5)
+    DB_REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_LAG_CHECK_INTERVAL') or 5)
+    # Seconds a visitor reads from the primary after writing, so they see their own
+    # cart and orders; keep it above DB_REPLICA_MAX_LAG.
+    DB_REPLICA_STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY_SECONDS') or 10)
+    # Opt-in per-request metrics served at /metrics in the Prometheus text format.
+    INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED') == 'True'
+    # Bearer token /metrics requires; it answers 404 while this is unset.
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD') or 0.5)
+    # Fraction of requests profiled with cProfile, optionally limited to a
+    # comma-separated list of endpoints; dumps go to PROFILE_DIR.
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE') or 0)
+    PROFILE_ENDPOINTS = os.environ.get('PROFILE_ENDPOINTS') or ''
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    # Werkzeug hash method for new passwords, e.g. 'scrypt:32768:8:1' or
+    # 'pbkdf2:sha256:600000'; existing hashes are upgraded at the next login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+    # Login and registration attempts allowed per client address and period; 0 disables the limit.
+    LOGIN_RATE_LIMIT = int(os.environ.get('LOGIN_RATE_LIMIT') or 10)
+    LOGIN_RATE_PERIOD = float(os.environ.get('LOGIN_RATE_PERIOD') or 60)
+    # Seconds a loaded user stays cached per process; bounds how long a revoked
+    # session or admin flag can linger in other worker processes.
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL') or 30)
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 10000)
+    # Item thumbnails: widths in pixels rendered as WebP and JPEG under IMAGE_DIR
+    # (default: instance/images); `flask images ingest` renders IMAGE_WORKERS at once.
+    IMAGE_DIR = os.environ.get('IMAGE_DIR')
+    IMAGE_WIDTHS = os.environ.get('IMAGE_WIDTHS') or '320,640,1280'
+    IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY') or 80)
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS') or 2)
+    IMAGE_MAX_BYTES = int(os.environ.get('IMAGE_MAX_BYTES') or 10 * 1024 * 1024)
+    IMAGE_FETCH_TIMEOUT = float(os.environ.get('IMAGE_FETCH_TIMEOUT') or 10)
     STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
     STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY')
-    ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL')
\ No newline at end of file
+    # Signing secret of the /stripe/webhook endpoint; without it orders are
+    # finalized from the checkout success redirect instead.
+    STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
+    ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL')
+    # JSON API responses smaller than this many bytes are sent uncompressed.
+    API_COMPRESS_MIN_SIZE = int(os.environ.get('API_COMPRESS_MIN_SIZE') or 1024)
+    ITEMS_PER_PAGE = int(os.environ.get('ITEMS_PER_PAGE') or 24)
+    MAX_ITEMS_PER_PAGE = int(os.environ.get('MAX_ITEMS_PER_PAGE') or 96)
+    ORDERS_PER_PAGE = int(os.environ.get('ORDERS_PER_PAGE') or 20)
+    # Seconds stock stays reserved for a checkout; Stripe sessions need at least 1800.
+    CHECKOUT_RESERVATION_TTL = int(os.environ.get('CHECKOUT_RESERVATION_TTL') or 1800)
+    # Distinct items an anonymous visitor's cart may hold; it lives in the session
+    # cookie, which browsers cap at about 4 KB.
+    SESSION_CART_MAX_LINES = int(os.environ.get('SESSION_CART_MAX_LINES') or 50)
+    CART_COUNT_CACHE_TTL = float(os.environ.get('CART_COUNT_CACHE_TTL') or 60)
+    CART_COUNT_CACHE_SIZE = int(os.environ.get('CART_COUNT_CACHE_SIZE') or 10000)
+    CATEGORY_CACHE_TTL = float(os.environ.get('CATEGORY_CACHE_TTL') or 300)
+    # Seconds the in-memory search index, used when the database has no full-text
+    # search, may miss items changed by another worker without a shared response cache.
+    SEARCH_INDEX_TTL = float(os.environ.get('SEARCH_INDEX_TTL') or 300)
+    # 'thread' drains the outbox from a background thread in each web worker;
+    # 'external' leaves it to a separate `flask outbox run` process.
+    OUTBOX_WORKER = os.environ.get('OUTBOX_WORKER') or 'thread'
+    OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL') or 5)
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE') or 20)
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS') or 8)
+    OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE') or 10)
+    OUTBOX_BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX') or 3600)
+    OUTBOX_LEASE = float(os.environ.get('OUTBOX_LEASE') or 300)
+    # Full-page cache for anonymous catalog views: 'memory', 'filesystem', 'redis' or 'null'.
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND') or 'memory'
+    RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL') or 60)
+    RESPONSE_CACHE_MAX_AGE = int(os.environ.get('RESPONSE_CACHE_MAX_AGE') or 30)
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES') or 2048)
+    # Seconds a generation counter is kept after its last invalidation; longer than any cache TTL.
+    RESPONSE_CACHE_COUNTER_TTL = float(os.environ.get('RESPONSE_CACHE_COUNTER_TTL') or 86400)
+    RESPONSE_CACHE_MAX_COUNTERS = int(os.environ.get('RESPONSE_CACHE_MAX_COUNTERS') or 100000)
+    RESPONSE_CACHE_DIR = os.environ.get('RESPONSE_CACHE_DIR')
+    RESPONSE_CACHE_REDIS_URL = os.environ.get('RESPONSE_CACHE_REDIS_URL')
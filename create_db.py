@@ -1,5 +1,25 @@
-from app import app, db
+"""Upgrade the database to the latest migration before the web server starts.
+
+Safe to run from every replica at once: the upgrade runs under
+`db_utils.migration_lock`, so one process migrates while the others wait and
+then find the database already current.
+"""
+import logging
+import os
+import time
+
+# Long migrations must not be cancelled by the statement timeout meant for web requests
+os.environ['DB_STATEMENT_TIMEOUT'] = '0'
+
 from flask_migrate import upgrade
+from app import app, db
+from db_utils import migration_lock
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s [%(name)s] %(message)s')
 
 with app.app_context():
-    upgrade()
+    started = time.perf_counter()
+    with migration_lock(db.engine):
+        upgrade()
+    # Alembic's logging configuration silences other loggers by now
+    print(f'Database is up to date ({time.perf_counter() - started:.2f}s)')
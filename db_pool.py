@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from flask import g, has_app_context, request
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    A QueuePool that records how long callers wait to check out a connection.
+
+    The wait of every checkout is also added to `g.db_pool_wait` and
+    `g.db_pool_checkouts`, so it can be reported per request.
+
+    Attributes:
+        checkouts (int): The number of connections handed out by this pool.
+        total_wait (float): The seconds spent waiting for those checkouts.
+        max_wait (float): The longest single wait in seconds.
+        timeouts (int): The number of checkouts that gave up after `pool_timeout`.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self._stats_lock = threading.Lock()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            self._record_wait(time.perf_counter() - started)
+
+    def _record_wait(self, waited: float) -> None:
+        with self._stats_lock:
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        if has_app_context():
+            g.db_pool_wait = g.get('db_pool_wait', 0.0) + waited
+            g.db_pool_checkouts = g.get('db_pool_checkouts', 0) + 1
+
+    def stats(self) -> dict:
+        """Return the pool's current occupancy and its checkout wait counters."""
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'idle': self.checkedin(),
+            'overflow': self.overflow(),
+            'max_overflow': self._max_overflow,
+            'timeout': self.timeout(),
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'avg_wait_ms': round(self.total_wait / self.checkouts * 1000, 3)
+            if self.checkouts
+            else 0.0,
+            'max_wait_ms': round(self.max_wait * 1000, 3),
+        }
+
+
+def engine_options(config, url: str = None) -> dict:
+    """Build `SQLALCHEMY_ENGINE_OPTIONS` from the `DB_POOL_*` and `DB_STATEMENT_TIMEOUT` settings.
+
+    `url` defaults to `SQLALCHEMY_DATABASE_URI`. In-memory SQLite databases
+    live in a single connection, so they keep Flask-SQLAlchemy's defaults.
+    """
+    url = make_url(url or config['SQLALCHEMY_DATABASE_URI'])
+    backend = url.get_backend_name()
+    if backend == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    statement_timeout = config['DB_STATEMENT_TIMEOUT']
+    if statement_timeout and backend == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
+
+def pool_stats(engine) -> dict:
+    """Return the stats of an engine's pool, or just its status if it is not instrumented."""
+    pool = engine.pool
+    if isinstance(pool, InstrumentedQueuePool):
+        return pool.stats()
+    return {'status': pool.status()}
+
+
+def init_app(app) -> None:
+    """Report each request's pool waits through `Server-Timing` and the slow-wait log."""
+    slow_wait = app.config['DB_POOL_SLOW_WAIT']
+    server_timing = app.config['DB_POOL_SERVER_TIMING']
+
+    @app.after_request
+    def report_pool_wait(response):
+        checkouts = g.get('db_pool_checkouts', 0)
+        if not checkouts:
+            return response
+        waited = g.get('db_pool_wait', 0.0)
+        if slow_wait and waited >= slow_wait:
+            logger.warning(
+                'Waited %.3fs for %d database connection(s) on %s',
+                waited,
+                checkouts,
+                request.path,
+            )
+        if server_timing:
+            response.headers.add(
+                'Server-Timing',
+                f'db-pool;dur={waited * 1000:.3f};desc="{checkouts} checkout(s)"',
+            )
+        return response
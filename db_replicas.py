@@ -0,0 +1,221 @@
+import itertools
+import logging
+import math
+import threading
+import time
+from functools import wraps
+from typing import List, Optional
+from flask import current_app, g, has_app_context, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc, text
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from db_pool import pool_stats
+
+logger = logging.getLogger(__name__)
+
+# `SQLALCHEMY_BINDS` entries whose key starts with this are read replicas of the primary
+REPLICA_PREFIX = 'replica_'
+# Session key holding the time until which the visitor reads from the primary
+STICKY_KEY = '_db_primary_until'
+
+# Seconds a replica is behind its primary. SQLite files have no replication, so
+# a copy of the primary used as a stand-in replica counts as current.
+LAG_QUERIES = {
+    'postgresql': (
+        'SELECT COALESCE(CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+        'THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END, 0)'
+    ),
+}
+
+
+class Replica:
+    """
+    A read replica and its last measured replication lag.
+
+    Attributes:
+        name (str): The replica's `SQLALCHEMY_BINDS` key.
+        engine (Engine): The replica's engine.
+        lag (float): Seconds the replica was behind at the last check; infinite if it failed.
+        reads (int): The number of requests routed to this replica.
+    """
+
+    def __init__(self, name: str, engine) -> None:
+        self.name = name
+        self.engine = engine
+        self.lag = 0.0
+        self.reads = 0
+        self._checked_at = -math.inf
+        self._lock = threading.Lock()
+
+    def current_lag(self, interval: float) -> float:
+        """Return the replica's lag, measuring it again if the last check is `interval` seconds old."""
+        if time.monotonic() - self._checked_at >= interval:
+            with self._lock:
+                if time.monotonic() - self._checked_at >= interval:
+                    self.lag = self._measure_lag()
+                    self._checked_at = time.monotonic()
+        return self.lag
+
+    def _measure_lag(self) -> float:
+        query = LAG_QUERIES.get(self.engine.dialect.name)
+        if query is None:
+            return 0.0
+        try:
+            with self.engine.connect() as conn:
+                return float(conn.execute(text(query)).scalar() or 0)
+        except exc.SQLAlchemyError:
+            logger.warning('Could not check the lag of replica %s', self.name, exc_info=True)
+            return math.inf
+
+
+class ReplicaSet:
+    """
+    The replicas of a process, handed out round-robin to read-only requests.
+
+    Attributes:
+        replicas (list): The configured replicas.
+        max_lag (float): Replicas further behind than this many seconds are skipped.
+        check_interval (float): Seconds between lag checks of a replica.
+        sticky_reads (int): Requests sent to the primary after the visitor's own write.
+        lagging_reads (int): Requests sent to the primary because every replica lagged.
+    """
+
+    def __init__(self, replicas: List[Replica], max_lag: float, check_interval: float) -> None:
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.sticky_reads = 0
+        self.lagging_reads = 0
+        self._next = itertools.count()
+
+    def choose(self) -> Optional[Replica]:
+        """Return the next replica within `max_lag`, or None if every replica lags."""
+        start = next(self._next)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.current_lag(self.check_interval) <= self.max_lag:
+                replica.reads += 1
+                return replica
+        self.lagging_reads += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            'sticky_reads': self.sticky_reads,
+            'lagging_reads': self.lagging_reads,
+            'replicas': {
+                replica.name: {
+                    'lag': replica.lag,
+                    'reads': replica.reads,
+                    'pool': pool_stats(replica.engine),
+                }
+                for replica in self.replicas
+            },
+        }
+
+
+def is_write(statement) -> bool:
+    """Return True unless `statement` only reads.
+
+    Raw SQL (e.g. the FTS queries of search.py) counts as a read only if it is
+    a plain SELECT, since its text is all there is to go by.
+    """
+    if isinstance(statement, UpdateBase):
+        return True
+    if isinstance(statement, TextClause):
+        words = statement.text.split(None, 1)
+        return not words or words[0].upper() != 'SELECT'
+    return False
+
+
+class RoutingSession(Session):
+    """A session that sends the reads of a request routed by `read_replica` to its replica.
+
+    Flushes and INSERT, UPDATE and DELETE statements always go to the primary,
+    as does every statement after the request's first write.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not is_write(clause):
+            replica = g.get('db_replica') if has_app_context() else None
+            if replica is not None and not g.get('db_wrote'):
+                return replica.engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _mark_write() -> None:
+    if has_request_context():
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _track_statement(orm_execute_state) -> None:
+    # Not `is_select`, which is False for a text('SELECT ...') as well
+    if is_write(orm_execute_state.statement):
+        _mark_write()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _track_flush(session, flush_context) -> None:
+    _mark_write()
+
+
+def replica_set() -> Optional[ReplicaSet]:
+    return current_app.extensions.get('db_replicas')
+
+
+def choose_replica() -> Optional[Replica]:
+    """Return the replica the current request should read from, or None for the primary.
+
+    Visitors who wrote within the last `DB_REPLICA_STICKY_SECONDS` read from
+    the primary, so they see their own cart and orders before replicas catch up.
+    """
+    replicas = replica_set()
+    if replicas is None:
+        return None
+    if session.get(STICKY_KEY, 0) > time.time():
+        replicas.sticky_reads += 1
+        return None
+    return replicas.choose()
+
+
+def read_replica(view):
+    """Decorate a view so its queries on GET and HEAD requests are served by a replica."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            g.db_replica = choose_replica()
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def replica_stats() -> dict:
+    replicas = replica_set()
+    return replicas.stats() if replicas is not None else {}
+
+
+def init_app(app, db) -> None:
+    """Set up the replicas among `SQLALCHEMY_BINDS` and read-your-writes stickiness."""
+    with app.app_context():
+        replicas = [
+            Replica(name, engine)
+            for name, engine in sorted(db.engines.items(), key=lambda entry: str(entry[0]))
+            if name is not None and name.startswith(REPLICA_PREFIX)
+        ]
+    if not replicas:
+        return
+    app.extensions['db_replicas'] = ReplicaSet(
+        replicas,
+        max_lag=app.config['DB_REPLICA_MAX_LAG'],
+        check_interval=app.config['DB_REPLICA_LAG_CHECK_INTERVAL'],
+    )
+    sticky_seconds = app.config['DB_REPLICA_STICKY_SECONDS']
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('db_wrote'):
+            session[STICKY_KEY] = time.time() + sticky_seconds
+        return response
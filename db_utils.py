@@ -0,0 +1,126 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, Mapping, Optional
+from sqlalchemy import Table, select, text, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Key of the Postgres advisory lock held while migrations run ('STONEMIG' as an int64)
+MIGRATION_LOCK_ID = int.from_bytes(b'STONEMIG', 'big') >> 1
+
+
+def dialect_insert(table: Table):
+    """Return an INSERT for `table` that supports ON CONFLICT on SQLite and Postgres.
+
+    Returns None on other databases, where callers need their own fallback.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table)
+    if dialect == 'sqlite':
+        return sqlite.insert(table)
+    return None
+
+
+def upsert(
+    table: Table,
+    rows: List[dict],
+    key: Iterable[str],
+    update_columns: Optional[Iterable[str]] = None,
+    set_: Optional[Callable[[Mapping], dict]] = None,
+) -> None:
+    """Insert `rows` into `table`, updating the rows whose `key` already exists.
+
+    Uses a single executemany `INSERT ... ON CONFLICT DO UPDATE` where the
+    database supports it, and otherwise looks up the existing keys and splits
+    the rows into an INSERT and an UPDATE batch. `rows` must not repeat a key.
+
+    Args:
+        table (Table): The table to write to, e.g. `Item.__table__`.
+        rows (list): The rows, as dicts with the same keys.
+        key (Iterable[str]): The columns of the unique constraint rows conflict on.
+        update_columns (Iterable[str]): The columns copied from a conflicting row.
+            Defaults to every column in the rows except the key.
+        set_ (callable): Builds extra SET expressions for a conflicting row from a
+            mapping of its incoming values, e.g. to reset a column when another changes.
+    """
+    if not rows:
+        return
+    key = list(key)
+    if update_columns is None:
+        update_columns = [column for column in rows[0] if column not in key]
+
+    stmt = dialect_insert(table)
+    if stmt is not None:
+        values = {column: stmt.excluded[column] for column in update_columns}
+        if set_ is not None:
+            values.update(set_(stmt.excluded))
+        db.session.execute(
+            stmt.on_conflict_do_update(index_elements=key, set_=values), rows
+        )
+        return
+
+    key_columns = [table.c[column] for column in key]
+    existing = {
+        tuple(row)
+        for row in db.session.execute(
+            select(*key_columns).where(
+                tuple_(*key_columns).in_([tuple(r[c] for c in key) for r in rows])
+            )
+        )
+    }
+    inserts = [r for r in rows if tuple(r[c] for c in key) not in existing]
+    updates = [r for r in rows if tuple(r[c] for c in key) in existing]
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+    for row in updates:
+        db.session.execute(
+            table.update()
+            .where(*(table.c[c] == row[c] for c in key))
+            .values(
+                {
+                    **{c: row[c] for c in update_columns},
+                    **(set_(row) if set_ is not None else {}),
+                }
+            )
+        )
+
+
+@contextmanager
+def migration_lock(engine: Engine):
+    """Hold a lock that keeps other processes from migrating the same database.
+
+    Uses a session-level advisory lock on Postgres and an exclusive lock on a
+    file next to the database on SQLite, so replicas that start at once wait for
+    the first one and then find nothing left to upgrade. Other databases run
+    unlocked.
+    """
+    started = time.perf_counter()
+    dialect = engine.dialect.name
+    if dialect == 'postgresql':
+        # Autocommit, so the lock's connection is not left idle in a transaction
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text('SELECT pg_advisory_lock(:id)'), {'id': MIGRATION_LOCK_ID})
+            logger.info('Acquired the migration lock in %.2fs', time.perf_counter() - started)
+            try:
+                yield
+            finally:
+                conn.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': MIGRATION_LOCK_ID})
+    elif dialect == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+        import fcntl
+
+        with open(os.path.abspath(engine.url.database) + '.migrate-lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            logger.info('Acquired the migration lock in %.2fs', time.perf_counter() - started)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        logger.warning('No migration lock for %s; run migrations from one process only', dialect)
+        yield
@@ -1,15 +1,26 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField
 from wtforms import (
     StringField,
     PasswordField,
     BooleanField,
     SubmitField,
     FloatField,
+    DecimalField,
     IntegerField,
     SelectField,
 )
-from wtforms.validators import DataRequired, ValidationError, Email, EqualTo
-from models import User, Category
+from wtforms.validators import (
+    DataRequired,
+    InputRequired,
+    NumberRange,
+    ValidationError,
+    Email,
+    EqualTo,
+)
+from models import User
+from category_cache import category_choices
+from images import UPLOAD_EXTENSIONS
 
 
 class LoginForm(FlaskForm):
@@ -42,43 +53,45 @@ class RegistrationForm(FlaskForm):
 class EditItemForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired()])
     description = StringField('Description', validators=[DataRequired()])
-    price = FloatField('Price', validators=[DataRequired()])
-    image = StringField('Image URL', validators=[DataRequired()])
-    stock = SelectField(
-        'Stock',
-        choices=[('in_stock', 'In Stock'), ('out_of_stock', 'Out of Stock')],
-        validators=[DataRequired()],
+    price = DecimalField('Price', places=2, validators=[DataRequired()])
+    image = StringField('Image URL')
+    image_file = FileField(
+        'Upload Image', validators=[FileAllowed(UPLOAD_EXTENSIONS, 'Images only!')]
     )
+    stock = IntegerField('Stock', validators=[InputRequired(), NumberRange(min=0)])
     weight = FloatField('Weight', validators=[DataRequired()])
     category = SelectField('Category', coerce=int, validators=[DataRequired()])
     submit = SubmitField('Update')
 
     def __init__(self, *args, **kwargs):
         super(EditItemForm, self).__init__(*args, **kwargs)
-        self.category.choices = [
-            (category.id, category.name) for category in Category.query.all()
-        ]
+        self.category.choices = category_choices()
+
+    def validate_image(self, image):
+        if not image.data and not self.image_file.data:
+            raise ValidationError('Enter an image URL or upload an image.')
 
 
 class AddItemForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired()])
     description = StringField('Description', validators=[DataRequired()])
-    price = FloatField('Price', validators=[DataRequired()])
-    image = StringField('Image URL', validators=[DataRequired()])
-    stock = SelectField(
-        'Stock',
-        choices=[('in_stock', 'In Stock'), ('out_of_stock', 'Out of Stock')],
-        validators=[DataRequired()],
+    price = DecimalField('Price', places=2, validators=[DataRequired()])
+    image = StringField('Image URL')
+    image_file = FileField(
+        'Upload Image', validators=[FileAllowed(UPLOAD_EXTENSIONS, 'Images only!')]
     )
+    stock = IntegerField('Stock', validators=[InputRequired(), NumberRange(min=0)])
     weight = FloatField('Weight', validators=[DataRequired()])
     category = SelectField('Category', coerce=int, validators=[DataRequired()])
     submit = SubmitField('Add Item')
 
     def __init__(self, *args, **kwargs):
         super(AddItemForm, self).__init__(*args, **kwargs)
-        self.category.choices = [
-            (category.id, category.name) for category in Category.query.all()
-        ]
+        self.category.choices = category_choices()
+
+    def validate_image(self, image):
+        if not image.data and not self.image_file.data:
+            raise ValidationError('Enter an image URL or upload an image.')
 
 
 class AddCategoryForm(FlaskForm):
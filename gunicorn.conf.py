@@ -0,0 +1,23 @@
+"""Gunicorn settings, read automatically by `gunicorn app:app` from this directory.
+
+With `preload_app` the master imports the application once and forks workers
+from it, so workers start instantly and share the imported code's memory.
+Nothing may open a database connection or start a thread at import time for
+this to be safe; `post_fork` drops any pooled connections a worker inherited
+and starts the worker's own outbox thread.
+"""
+import os
+
+preload_app = (os.environ.get('GUNICORN_PRELOAD') or 'True') == 'True'
+
+
+def post_fork(server, worker):
+    from app import app, db
+    import outbox
+
+    with app.app_context():
+        # Keep the parent's connections open for the parent; the worker opens its own
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    # Drain what is already queued without waiting for the first request
+    outbox.start_worker(app)
@@ -0,0 +1,327 @@
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import List, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
+import click
+from flask import current_app, send_from_directory, url_for
+from app import app, db
+from instrumentation import external_call
+from models import Item
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp']
+# Content-Type prefixes of fetched responses worth decoding; untyped ones are tried too
+IMAGE_CONTENT_TYPES = ('image/', 'application/octet-stream')
+# Variants never change once written, since their names contain the digest of the original.
+IMAGE_MAX_AGE = 365 * 24 * 3600
+
+
+class ImageError(ValueError):
+    """Raised for an image that cannot be fetched, read or decoded."""
+
+
+class ItemImage(NamedTuple):
+    """The image columns of an item: the URL shown as a fallback and its variants, if any."""
+
+    url: str
+    digest: Optional[str]
+    width: Optional[int]
+
+
+def _widths(config) -> List[int]:
+    return sorted(int(width) for width in config['IMAGE_WIDTHS'].split(',') if width.strip())
+
+
+def variant_widths(largest: int, widths: List[int]) -> List[int]:
+    """Return the widths an original gets variants at: every configured width
+    below `largest`, and `largest` itself. Originals are never upscaled."""
+    return [width for width in widths if width < largest] + [largest]
+
+
+def variant_name(digest: str, width: int, fmt: str) -> str:
+    return f'{digest[:2]}/{digest}-{width}.{fmt}'
+
+
+def _existing_width(directory: str, digest: str) -> Optional[int]:
+    paths = glob.glob(os.path.join(directory, digest[:2], f'{digest}-*.jpg'))
+    if not paths:
+        return None
+    return max(int(path.rsplit('-', 1)[1].split('.')[0]) for path in paths)
+
+
+def _save(image, path: str, fmt: str, **options) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, fmt, **options)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def render_variants(
+    data: bytes, directory: str, widths: List[int], quality: int, force: bool = False
+) -> Tuple[str, int]:
+    """Write the WebP and JPEG variants of an original image to `directory`.
+
+    Files are named after the SHA-256 of the original, so an image that was
+    processed before is recognized without decoding it again, unless `force`
+    is set to render it at the current widths. Pillow releases the GIL while
+    decoding, resizing and encoding, so `flask images ingest` runs several at once.
+
+    Returns:
+        tuple: (digest, width of the largest variant).
+
+    Raises:
+        ImageError: If `data` is not an image Pillow can read.
+    """
+    try:
+        from PIL import Image, ImageOps, UnidentifiedImageError
+    except ImportError as e:
+        raise RuntimeError('Image processing requires the Pillow package') from e
+
+    digest = hashlib.sha256(data).hexdigest()
+    existing = None if force else _existing_width(directory, digest)
+    if existing is not None:
+        return digest, existing
+
+    try:
+        with Image.open(BytesIO(data)) as original:
+            # Lets JPEG decode at a fraction of its size when it is far larger than needed
+            original.draft('RGB', (widths[-1], widths[-1]))
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ImageError(f'not a supported image ({e})') from e
+
+    has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    largest = min(image.width, widths[-1])
+    os.makedirs(os.path.join(directory, digest[:2]), exist_ok=True)
+    for width in variant_widths(largest, widths):
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize(
+            (width, height), Image.Resampling.LANCZOS, reducing_gap=3.0
+        )
+        _save(
+            resized,
+            os.path.join(directory, variant_name(digest, width, 'webp')),
+            'WEBP',
+            quality=quality,
+        )
+        if has_alpha:
+            flattened = Image.new('RGB', resized.size, 'white')
+            flattened.paste(resized, mask=resized.getchannel('A'))
+            resized = flattened
+        # The JPEG is written last, so its presence marks a finished digest
+        _save(
+            resized,
+            os.path.join(directory, variant_name(digest, width, 'jpg')),
+            'JPEG',
+            quality=quality,
+            optimize=True,
+            progressive=True,
+        )
+    return digest, largest
+
+
+def fetch_image(source: str, max_bytes: int, timeout: float, allow_files: bool = False) -> bytes:
+    """Download an image from an http(s) URL, or read it from a local path if `allow_files`.
+
+    Responses declaring a type other than an image, or a length above
+    `max_bytes`, are refused before their body is read.
+
+    Raises:
+        ImageError: If the image cannot be fetched, is not an image or is larger than `max_bytes`.
+    """
+    # Imported here since web workers rarely fetch images and requests is slow to import
+    import requests
+
+    scheme = urlparse(source).scheme
+    if scheme not in ('http', 'https'):
+        if not allow_files:
+            raise ImageError('only http and https image URLs can be fetched')
+        path = source[len('file://'):] if scheme == 'file' else source
+        try:
+            with open(path, 'rb') as f:
+                data = f.read(max_bytes + 1)
+        except OSError as e:
+            raise ImageError(f'cannot read {path}: {e.strerror}') from e
+    else:
+        try:
+            with external_call('image_fetch'), requests.get(
+                source, timeout=timeout, stream=True
+            ) as response:
+                response.raise_for_status()
+                content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+                if content_type and not content_type.startswith(IMAGE_CONTENT_TYPES):
+                    raise ImageError(f'{source} is {content_type}, not an image')
+                length = response.headers.get('Content-Length', '')
+                if length.isdigit() and int(length) > max_bytes:
+                    raise ImageError(f'image is larger than {max_bytes} bytes')
+                data = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    data += chunk
+                    if len(data) > max_bytes:
+                        break
+                data = bytes(data)
+        except requests.RequestException as e:
+            raise ImageError(f'cannot fetch {source}: {e}') from e
+    if len(data) > max_bytes:
+        raise ImageError(f'image is larger than {max_bytes} bytes')
+    return data
+
+
+def _fetch_and_render(
+    source: str, config, directory: str, allow_files: bool = False, force: bool = False
+):
+    data = fetch_image(
+        source, config['IMAGE_MAX_BYTES'], config['IMAGE_FETCH_TIMEOUT'], allow_files
+    )
+    return render_variants(data, directory, _widths(config), config['IMAGE_QUALITY'], force)
+
+
+def _image_dir() -> str:
+    return current_app.config['IMAGE_DIR'] or os.path.join(current_app.instance_path, 'images')
+
+
+def process_upload(upload) -> ItemImage:
+    """Render the variants of an uploaded file in the request handling it.
+
+    Raises:
+        ImageError: If the upload is too large or not an image.
+    """
+    config = current_app.config
+    data = upload.read(config['IMAGE_MAX_BYTES'] + 1)
+    if len(data) > config['IMAGE_MAX_BYTES']:
+        raise ImageError(f'image is larger than {config["IMAGE_MAX_BYTES"]} bytes')
+    digest, width = render_variants(data, _image_dir(), _widths(config), config['IMAGE_QUALITY'])
+    # Emails and order snapshots copy `Item.image`, so it must work on its own
+    url = url_for('item_image', filename=variant_name(digest, width, 'jpg'), _external=True)
+    return ItemImage(url, digest, width)
+
+
+def process_url(url: str, current: Optional[Item] = None) -> ItemImage:
+    """Fetch an image URL and render its variants in the request handling it.
+
+    An unchanged URL keeps `current`'s variants. If the image cannot be
+    fetched, the URL is kept without variants and served as-is.
+    """
+    if current is not None and current.image == url and current.image_digest:
+        return ItemImage(url, current.image_digest, current.image_width)
+    try:
+        digest, width = _fetch_and_render(url, current_app.config, _image_dir())
+    except ImageError:
+        logger.warning('Could not make thumbnails of %s', url, exc_info=True)
+        return ItemImage(url, None, None)
+    return ItemImage(url, digest, width)
+
+
+def image_srcset(item, fmt: str) -> str:
+    """Return the `srcset` of an item's variants in one format."""
+    return ', '.join(
+        f'{url_for("item_image", filename=variant_name(item.image_digest, width, fmt))} {width}w'
+        for width in variant_widths(item.image_width, _widths(current_app.config))
+    )
+
+
+def image_src(item, width: int = 640, external: bool = False) -> str:
+    """Return the URL of an item's smallest JPEG variant at least `width` wide."""
+    if not item.image_digest:
+        return item.image
+    widths = variant_widths(item.image_width, _widths(current_app.config))
+    best = next((w for w in widths if w >= width), widths[-1])
+    return url_for(
+        'item_image', filename=variant_name(item.image_digest, best, 'jpg'), _external=external
+    )
+
+
+def image_variants(item, external: bool = False) -> List[dict]:
+    """Return the width and WebP and JPEG URLs of each of an item's variants."""
+    if not item.image_digest:
+        return []
+    return [
+        {
+            'width': width,
+            **{
+                fmt: url_for(
+                    'item_image',
+                    filename=variant_name(item.image_digest, width, fmt),
+                    _external=external,
+                )
+                for fmt in ('webp', 'jpg')
+            },
+        }
+        for width in variant_widths(item.image_width, _widths(current_app.config))
+    ]
+
+
+def serve_image(filename):
+    response = send_from_directory(_image_dir(), filename, max_age=IMAGE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+app.add_url_rule('/images/<path:filename>', 'item_image', serve_image)
+app.add_template_global(image_srcset)
+app.add_template_global(image_src)
+
+
+@app.cli.group('images')
+def images_cli():
+    """Item image commands."""
+
+
+@images_cli.command('ingest')
+@click.option('--all', 'everything', is_flag=True, help='Re-render every item, e.g. after changing IMAGE_WIDTHS.')
+@click.option('--batch-size', default=50, show_default=True, help='Items fetched concurrently per commit.')
+def ingest_command(everything, batch_size):
+    """Render thumbnails for items whose image has none yet.
+
+    Item images may be http(s) URLs or, here only, local file paths.
+    """
+    started = time.perf_counter()
+    directory = _image_dir()
+    config = dict(current_app.config)
+    processed = failed = 0
+    last_id = 0
+    with ThreadPoolExecutor(
+        max_workers=config['IMAGE_WORKERS'], thread_name_prefix='images'
+    ) as pool:
+        while True:
+            query = Item.query.filter(Item.id > last_id)
+            if not everything:
+                query = query.filter(Item.image_digest.is_(None))
+            items = query.order_by(Item.id).limit(batch_size).all()
+            if not items:
+                break
+            futures = [
+                (
+                    item,
+                    pool.submit(
+                        _fetch_and_render, item.image, config, directory, True, everything
+                    ),
+                )
+                for item in items
+            ]
+            for item, future in futures:
+                try:
+                    item.image_digest, item.image_width = future.result()
+                    processed += 1
+                except ImageError as e:
+                    click.echo(f'item {item.id}: {e}', err=True)
+                    failed += 1
+            db.session.commit()
+            last_id = items[-1].id
+    click.echo(
+        f'Processed {processed} image(s) in {time.perf_counter() - started:.2f}s, {failed} failed.'
+    )
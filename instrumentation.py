@@ -0,0 +1,336 @@
+import cProfile
+import hmac
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, UTC
+from flask import (
+    Response,
+    abort,
+    before_render_template,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the request and external call latency histograms.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_profile_lock = threading.Lock()
+
+
+class Histogram:
+    """A Prometheus-style cumulative histogram of observed values."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """
+    Per-process request, SQL, template and external call metrics.
+
+    Everything is keyed by Flask endpoint so that slow routes stand out, and
+    rendered in the Prometheus text exposition format by `render`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.sql_statements = {}
+        self.sql_seconds = {}
+        self.sql_slowest = {}
+        self.template_seconds = {}
+        self.external_seconds = {}
+        self.external_calls = {}
+
+    def observe_request(self, endpoint, method, status, duration, stats) -> None:
+        with self._lock:
+            key = (endpoint, method, str(status))
+            self.requests.setdefault(key, Histogram()).observe(duration)
+            self.sql_statements[endpoint] = (
+                self.sql_statements.get(endpoint, 0) + stats['sql_count']
+            )
+            self.sql_seconds[endpoint] = (
+                self.sql_seconds.get(endpoint, 0.0) + stats['sql_time']
+            )
+            self.sql_slowest[endpoint] = max(
+                self.sql_slowest.get(endpoint, 0.0), stats['sql_slowest']
+            )
+            self.template_seconds[endpoint] = (
+                self.template_seconds.get(endpoint, 0.0) + stats['template_time']
+            )
+
+    def observe_external(self, service: str, duration: float, failed: bool) -> None:
+        with self._lock:
+            self.external_seconds.setdefault(service, Histogram()).observe(duration)
+            key = (service, 'error' if failed else 'ok')
+            self.external_calls[key] = self.external_calls.get(key, 0) + 1
+
+    def render(self) -> str:
+        lines = []
+
+        def header(name, kind, description):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def histogram(name, labels, hist):
+            for bound, count in zip(hist.buckets, hist.counts):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+            lines.append(f'{name}_sum{{{labels}}} {hist.sum:.6f}')
+            lines.append(f'{name}_count{{{labels}}} {hist.count}')
+
+        def per_endpoint(name, kind, description, values, fmt='{:.6f}'):
+            header(name, kind, description)
+            for endpoint, value in sorted(values.items()):
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {fmt.format(value)}')
+
+        with self._lock:
+            header(
+                'stonemarket_request_duration_seconds',
+                'histogram',
+                'Time spent handling requests.',
+            )
+            for (endpoint, method, status), hist in sorted(self.requests.items()):
+                histogram(
+                    'stonemarket_request_duration_seconds',
+                    f'endpoint="{endpoint}",method="{method}",status="{status}"',
+                    hist,
+                )
+            per_endpoint(
+                'stonemarket_sql_statements_total',
+                'counter',
+                'SQL statements executed while handling requests.',
+                self.sql_statements,
+                fmt='{}',
+            )
+            per_endpoint(
+                'stonemarket_sql_seconds_total',
+                'counter',
+                'Time spent executing SQL while handling requests.',
+                self.sql_seconds,
+            )
+            per_endpoint(
+                'stonemarket_sql_slowest_statement_seconds',
+                'gauge',
+                'The slowest single SQL statement seen for the endpoint.',
+                self.sql_slowest,
+            )
+            per_endpoint(
+                'stonemarket_template_seconds_total',
+                'counter',
+                'Time spent rendering templates while handling requests.',
+                self.template_seconds,
+            )
+            header(
+                'stonemarket_external_call_duration_seconds',
+                'histogram',
+                'Time spent in calls to Stripe, SMTP and Twilio.',
+            )
+            for service, hist in sorted(self.external_seconds.items()):
+                histogram(
+                    'stonemarket_external_call_duration_seconds',
+                    f'service="{service}"',
+                    hist,
+                )
+            header(
+                'stonemarket_external_calls_total',
+                'counter',
+                'Calls to external services by outcome.',
+            )
+            for (service, outcome), count in sorted(self.external_calls.items()):
+                lines.append(
+                    f'stonemarket_external_calls_total{{service="{service}",outcome="{outcome}"}} {count}'
+                )
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+_enabled = False
+
+
+def _request_stats():
+    """Return the current request's counters, or None outside an instrumented request."""
+    if not _enabled or not has_request_context():
+        return None
+    return g.get('instrumentation')
+
+
+@contextmanager
+def external_call(service: str):
+    """Time a call to an external service such as 'stripe' or 'smtp'.
+
+    Cheap enough to leave in place when instrumentation is disabled; calls made
+    outside a request (e.g. by the outbox worker) are still counted.
+    """
+    if not _enabled:
+        yield
+        return
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        metrics.observe_external(service, duration, failed)
+        stats = _request_stats()
+        if stats is not None:
+            stats['external_time'] += duration
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._instrumentation_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_instrumentation_started', None)
+    stats = _request_stats()
+    if stats is None or started is None:
+        return
+    duration = time.perf_counter() - started
+    stats['sql_count'] += 1
+    stats['sql_time'] += duration
+    if duration > stats['sql_slowest']:
+        stats['sql_slowest'] = duration
+        stats['sql_slowest_statement'] = statement
+
+
+def _before_render(sender, template, context, **extra):
+    stats = _request_stats()
+    if stats is not None:
+        stats['template_started'].append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    stats = _request_stats()
+    if stats is not None and stats['template_started']:
+        stats['template_time'] += time.perf_counter() - stats['template_started'].pop()
+
+
+def init_app(app) -> None:
+    """Record per-request metrics, serve them at `/metrics` and sample profiles.
+
+    Does nothing unless `INSTRUMENTATION_ENABLED` is set, so the SQL and template
+    hooks cost nothing in a default deployment. `/metrics` answers 404 unless
+    `METRICS_TOKEN` is set, and then requires it as a bearer token.
+    """
+    global _enabled
+    if not app.config['INSTRUMENTATION_ENABLED']:
+        return
+    _enabled = True
+
+    slow_query = app.config['SLOW_QUERY_THRESHOLD']
+    sample_rate = app.config['PROFILE_SAMPLE_RATE']
+    profile_endpoints = set(filter(None, app.config['PROFILE_ENDPOINTS'].split(',')))
+    profile_dir = app.config['PROFILE_DIR'] or os.path.join(app.instance_path, 'profiles')
+    metrics_token = app.config['METRICS_TOKEN']
+
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    @app.before_request
+    def start_instrumentation():
+        g.instrumentation = {
+            'started': time.perf_counter(),
+            'sql_count': 0,
+            'sql_time': 0.0,
+            'sql_slowest': 0.0,
+            'sql_slowest_statement': None,
+            'template_time': 0.0,
+            'template_started': [],
+            'external_time': 0.0,
+            'profiler': None,
+        }
+        if (
+            sample_rate
+            and (not profile_endpoints or request.endpoint in profile_endpoints)
+            and random.random() < sample_rate
+            # cProfile hooks the whole interpreter, so profile one request at a time
+            and _profile_lock.acquire(blocking=False)
+        ):
+            profiler = g.instrumentation['profiler'] = cProfile.Profile()
+            profiler.enable()
+
+    @app.after_request
+    def record_instrumentation(response):
+        stats = g.get('instrumentation')
+        if stats is None:
+            return response
+        duration = time.perf_counter() - stats['started']
+        endpoint = request.endpoint or 'unknown'
+        metrics.observe_request(
+            endpoint, request.method, response.status_code, duration, stats
+        )
+        if slow_query and stats['sql_slowest'] >= slow_query:
+            logger.warning(
+                'Slow SQL on %s (%.3fs): %s',
+                endpoint,
+                stats['sql_slowest'],
+                stats['sql_slowest_statement'],
+            )
+        response.headers.add(
+            'Server-Timing',
+            f'sql;dur={stats["sql_time"] * 1000:.3f};desc="{stats["sql_count"]} statement(s)"',
+        )
+        response.headers.add(
+            'Server-Timing', f'tpl;dur={stats["template_time"] * 1000:.3f}'
+        )
+        response.headers.add(
+            'Server-Timing', f'ext;dur={stats["external_time"] * 1000:.3f}'
+        )
+        response.headers.add('Server-Timing', f'total;dur={duration * 1000:.3f}')
+        return response
+
+    @app.teardown_request
+    def dump_profile(exc):
+        stats = g.get('instrumentation')
+        profiler = stats and stats['profiler']
+        if not profiler:
+            return
+        try:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            timestamp = datetime.now(UTC).strftime('%Y%m%dT%H%M%S%f')
+            profiler.dump_stats(
+                os.path.join(profile_dir, f'{request.endpoint or "unknown"}-{timestamp}.prof')
+            )
+        finally:
+            stats['profiler'] = None
+            _profile_lock.release()
+
+    def metrics_view():
+        # Endpoint names and timings are not for the public, so without a
+        # token configured the endpoint does not exist
+        if not metrics_token:
+            abort(404)
+        authorization = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(authorization.encode(), f'Bearer {metrics_token}'.encode()):
+            abort(403)
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,255 @@
+import secrets
+from datetime import datetime, timedelta, UTC
+from typing import Dict, List, Set
+import click
+from flask import current_app
+from sqlalchemy import and_, case, delete, insert, or_, select, update
+from sqlalchemy.orm import joinedload
+from app import app, db
+from models import Item, StockReservation
+
+# Marks the checkout session id of reservations whose Stripe session is being created
+PROVISIONAL_PREFIX = 'reserving:'
+
+
+class InsufficientStock(Exception):
+    """Raised when an item does not have enough units on hand to cover a cart line."""
+
+    def __init__(self, item_name: str) -> None:
+        super().__init__(f'Sorry, there is not enough stock left of {item_name}.')
+        self.item_name = item_name
+
+
+def line_quantities(lines) -> Dict[int, int]:
+    """Sum the quantities of cart lines, reservations or order lines by item id."""
+    quantities = {}
+    for line in lines:
+        quantities[line.item_id] = quantities.get(line.item_id, 0) + line.quantity
+    return quantities
+
+
+def decrement_stock(quantities: Dict[int, int]) -> Set[int]:
+    """Take units of several items off the shelf, each if, and only if, enough are left.
+
+    This is a single conditional UPDATE, so concurrent checkouts can never drive
+    stock below zero and no row is locked longer than the statement itself.
+    Items short of stock are left as they are.
+
+    Args:
+        quantities (dict): Units to take, by item id.
+
+    Returns:
+        set: The ids of the items whose units could not be taken.
+    """
+    if not quantities:
+        return set()
+    amount = case(quantities, value=Item.id)
+    stmt = (
+        update(Item)
+        .where(Item.id.in_(quantities), Item.stock >= amount)
+        .values(stock=Item.stock - amount)
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.get_bind().dialect.update_returning:
+        return set(quantities) - set(db.session.scalars(stmt.returning(Item.id)))
+    # Without RETURNING only the number of items taken is known
+    if db.session.execute(stmt).rowcount == len(quantities):
+        return set()
+    return set(quantities)
+
+
+def _lock_items(condition) -> None:
+    """Lock the items matching `condition` in id order, ahead of any UPDATE of their stock.
+
+    Transactions that change the stock of several items all take their row
+    locks in the same order this way, so none can hold an item another is
+    waiting for while waiting for one it holds. SQLite locks the whole
+    database on the first write instead, so this is only done on Postgres.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(
+            select(Item.id).where(condition).order_by(Item.id).with_for_update()
+        )
+
+
+def _reserved_items(condition):
+    return Item.id.in_(select(StockReservation.item_id).where(condition))
+
+
+def _restock(quantities: Dict[int, int]) -> None:
+    if quantities:
+        db.session.execute(
+            update(Item)
+            .where(Item.id.in_(quantities))
+            .values(stock=Item.stock + case(quantities, value=Item.id))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def _take_reservations(condition) -> list:
+    """Delete the reservations matching `condition`, returning their `item_id` and `quantity`.
+
+    Whoever deletes a row gets its units, so concurrent releases and orders never
+    count a reservation twice.
+    """
+    stmt = delete(StockReservation).where(condition)
+    if db.session.get_bind().dialect.delete_returning:
+        return db.session.execute(
+            stmt.returning(StockReservation.item_id, StockReservation.quantity)
+            .execution_options(synchronize_session=False)
+        ).all()
+    rows = db.session.execute(
+        select(StockReservation.item_id, StockReservation.quantity)
+        .where(condition)
+        .with_for_update()
+    ).all()
+    db.session.execute(stmt.execution_options(synchronize_session=False))
+    return rows
+
+
+def _release(condition, other_item_ids=()) -> int:
+    """Give back the units of the reservations matching `condition`.
+
+    The items they restock are locked along with `other_item_ids`, the items
+    the caller updates next in the same transaction.
+    """
+    _lock_items(or_(_reserved_items(condition), Item.id.in_(other_item_ids)))
+    rows = _take_reservations(condition)
+    _restock(line_quantities(rows))
+    return len(rows)
+
+
+def release_session_reservations(checkout_session_id: str) -> int:
+    """Give back the units reserved for a Stripe checkout session. The caller commits."""
+    return _release(StockReservation.checkout_session_id == checkout_session_id)
+
+
+def release_expired_reservations() -> int:
+    """Give back the units of every expired reservation. The caller commits.
+
+    Checkout does not sweep; run `flask inventory release-expired` periodically.
+    """
+    return _release(StockReservation.expires_at <= datetime.now(UTC))
+
+
+def reserve_cart(user_id: int, cart_items) -> str:
+    """Reserve stock for every line of a cart, all or nothing.
+
+    The user's expired reservations are released first. Those of checkout
+    sessions that may still be open stay, so paying on an earlier payment page
+    still finds its stock; Stripe's expiry webhook gives them back otherwise.
+    The stock of all lines is taken with one conditional UPDATE and the
+    reservations are written with one executemany INSERT. Every item involved,
+    including those being restocked, is locked in id order before either
+    UPDATE. The caller commits on success and must roll back if
+    `InsufficientStock` is raised.
+
+    Args:
+        user_id (int): The user checking out.
+        cart_items (list): The user's cart items, with `item` loaded.
+
+    Returns:
+        str: A provisional checkout session id the reservations are filed under,
+            until `assign_checkout_session` replaces it with Stripe's.
+    """
+    now = datetime.now(UTC)
+    quantities = line_quantities(cart_items)
+    _release(
+        and_(StockReservation.user_id == user_id, StockReservation.expires_at <= now),
+        other_item_ids=quantities,
+    )
+    short = decrement_stock(quantities)
+    if short:
+        raise InsufficientStock(
+            next(cart_item.item.name for cart_item in cart_items if cart_item.item_id in short)
+        )
+
+    checkout_session_id = PROVISIONAL_PREFIX + secrets.token_hex(16)
+    expires_at = now + timedelta(
+        seconds=current_app.config['CHECKOUT_RESERVATION_TTL']
+    )
+    db.session.execute(
+        insert(StockReservation),
+        [
+            {
+                'user_id': user_id,
+                'item_id': item_id,
+                'quantity': quantity,
+                'checkout_session_id': checkout_session_id,
+                'expires_at': expires_at,
+            }
+            for item_id, quantity in sorted(quantities.items())
+        ],
+    )
+    return checkout_session_id
+
+
+def assign_checkout_session(provisional_id: str, checkout_session_id: str) -> None:
+    """File the reservations made by `reserve_cart` under the Stripe session paying for them.
+
+    The caller commits.
+    """
+    db.session.execute(
+        update(StockReservation)
+        .where(StockReservation.checkout_session_id == provisional_id)
+        .values(checkout_session_id=checkout_session_id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def session_reservations(checkout_session_id: str) -> List[StockReservation]:
+    """Return the reservations of a Stripe checkout session with their items loaded."""
+    return (
+        StockReservation.query.options(joinedload(StockReservation.item))
+        .filter_by(checkout_session_id=checkout_session_id)
+        .order_by(StockReservation.id)
+        .all()
+    )
+
+
+def consume_reservations(checkout_session_id: str, lines) -> bool:
+    """Turn a checkout session's reservations into the sold stock of its order.
+
+    Only the reservations of this session are used, so other checkouts of the
+    same user keep theirs. Units of lines whose reservation has already expired
+    and been released are taken from the shelf again with a conditional
+    decrement, and reserved units no line uses go back on the shelf. The caller
+    commits.
+
+    Args:
+        checkout_session_id (str): The paid Stripe checkout session.
+        lines (list): The order's lines, with `item_id` and `quantity`.
+
+    Returns:
+        bool: False if some line could no longer be covered by stock on hand.
+    """
+    needed = line_quantities(lines)
+    condition = StockReservation.checkout_session_id == checkout_session_id
+    _lock_items(or_(_reserved_items(condition), Item.id.in_(needed)))
+    reserved = line_quantities(_take_reservations(condition))
+    missing = {
+        item_id: quantity - reserved.get(item_id, 0)
+        for item_id, quantity in needed.items()
+        if quantity > reserved.get(item_id, 0)
+    }
+    unused = {
+        item_id: quantity - needed.get(item_id, 0)
+        for item_id, quantity in reserved.items()
+        if quantity > needed.get(item_id, 0)
+    }
+    short = decrement_stock(missing)
+    _restock(unused)
+    return not short
+
+
+@app.cli.group('inventory')
+def inventory_cli():
+    """Stock and reservation commands."""
+
+
+@inventory_cli.command('release-expired')
+def release_expired_command():
+    """Return the stock held by expired checkout reservations."""
+    released = release_expired_reservations()
+    db.session.commit()
+    click.echo(f'Released {released} expired reservation(s).')
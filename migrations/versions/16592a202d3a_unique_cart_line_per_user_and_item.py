@@ -0,0 +1,40 @@
+"""Allow one cart line per user and item
+
+Revision ID: 16592a202d3a
+Revises: abc54eb3a8f7
+Create Date: 2026-10-18 17:12:40.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '16592a202d3a'
+down_revision = 'abc54eb3a8f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Fold duplicate lines into the oldest one before the index can be created
+    op.execute(
+        'UPDATE cart_items SET quantity = ('
+        ' SELECT SUM(c.quantity) FROM cart_items c'
+        ' WHERE c.user_id = cart_items.user_id AND c.item_id = cart_items.item_id'
+        ') WHERE id IN ('
+        ' SELECT MIN(id) FROM cart_items GROUP BY user_id, item_id HAVING COUNT(*) > 1'
+        ')'
+    )
+    op.execute(
+        'DELETE FROM cart_items WHERE id NOT IN ('
+        ' SELECT MIN(id) FROM cart_items GROUP BY user_id, item_id'
+        ')'
+    )
+    with op.batch_alter_table('cart_items', schema=None) as batch_op:
+        batch_op.create_index('ix_cart_items_user_id_item_id', ['user_id', 'item_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('cart_items', schema=None) as batch_op:
+        batch_op.drop_index('ix_cart_items_user_id_item_id')
@@ -0,0 +1,145 @@
+"""Normalize order line items into order_items
+
+Revision ID: 1e1bc87d2fc6
+Revises: 5c20de85bb05
+Create Date: 2026-10-18 13:02:44.718352
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1e1bc87d2fc6'
+down_revision = '5c20de85bb05'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+orders_table = sa.table(
+    'orders',
+    sa.column('id', sa.Integer),
+    sa.column('items', sa.String),
+    sa.column('serialized_items', sa.String),
+)
+order_items_table = sa.table(
+    'order_items',
+    sa.column('id', sa.Integer),
+    sa.column('order_id', sa.Integer),
+    sa.column('item_id', sa.Integer),
+    sa.column('name', sa.String),
+    sa.column('description', sa.String),
+    sa.column('price', sa.Float),
+    sa.column('quantity', sa.Integer),
+    sa.column('image', sa.String),
+)
+
+
+def _parse_item_ids(value):
+    item_ids = []
+    for part in (value or '').split(';'):
+        try:
+            item_ids.append(int(part))
+        except ValueError:
+            item_ids.append(None)
+    return item_ids
+
+
+def upgrade():
+    op.create_table('order_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=True),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('description', sa.String(length=200), nullable=False),
+    sa.Column('price', sa.Float(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('image', sa.String(length=200), nullable=False),
+    sa.ForeignKeyConstraint(['item_id'], ['items.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_order_items_item_id'), ['item_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_order_items_order_id'), ['order_id'], unique=False)
+
+    # Backfill line items from the JSON blob. Order.items holds the item ids
+    # in the same order as the serialized entries.
+    bind = op.get_bind()
+    existing_item_ids = {row[0] for row in bind.execute(sa.text('SELECT id FROM items'))}
+    last_id = 0
+    while True:
+        orders = bind.execute(
+            sa.select(orders_table.c.id, orders_table.c['items'], orders_table.c.serialized_items)
+            .where(orders_table.c.id > last_id)
+            .order_by(orders_table.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not orders:
+            break
+        rows = []
+        for order_id, item_ids, serialized_items in orders:
+            entries = json.loads(serialized_items or '[]')
+            item_ids = _parse_item_ids(item_ids)
+            for position, entry in enumerate(entries):
+                item_id = item_ids[position] if position < len(item_ids) else None
+                rows.append({
+                    'order_id': order_id,
+                    'item_id': item_id if item_id in existing_item_ids else None,
+                    'name': entry.get('name', ''),
+                    'description': entry.get('description', ''),
+                    'price': entry.get('price', 0.0),
+                    'quantity': entry.get('quantity', 1),
+                    'image': entry.get('image', ''),
+                })
+        if rows:
+            op.bulk_insert(order_items_table, rows)
+        last_id = orders[-1][0]
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('serialized_items')
+        batch_op.drop_column('items')
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('items', sa.VARCHAR(length=200), nullable=False, server_default=''))
+        batch_op.add_column(sa.Column('serialized_items', sa.VARCHAR(), nullable=False, server_default='[]'))
+
+    bind = op.get_bind()
+    line_items = {}
+    for row in bind.execute(
+        sa.select(order_items_table).order_by(order_items_table.c.order_id, order_items_table.c.id)
+    ):
+        line_items.setdefault(row.order_id, []).append(row)
+    for order_id, rows in line_items.items():
+        bind.execute(
+            orders_table.update()
+            .where(orders_table.c.id == order_id)
+            .values(
+                items=';'.join(str(row.item_id or '') for row in rows)[:200],
+                serialized_items=json.dumps([
+                    {
+                        'name': row.name,
+                        'description': row.description,
+                        'price': row.price,
+                        'quantity': row.quantity,
+                        'image': row.image,
+                    }
+                    for row in rows
+                ]),
+            )
+        )
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.alter_column('items', server_default=None)
+        batch_op.alter_column('serialized_items', server_default=None)
+
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_order_items_order_id'))
+        batch_op.drop_index(batch_op.f('ix_order_items_item_id'))
+
+    op.drop_table('order_items')
@@ -0,0 +1,30 @@
+"""Link orders to their Stripe checkout sessions
+
+Revision ID: 23658970d1d6
+Revises: ea6db69f6016
+Create Date: 2026-10-18 15:07:12.640318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '23658970d1d6'
+down_revision = 'ea6db69f6016'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('checkout_session_id', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('payment_status', sa.String(length=20), nullable=True))
+        batch_op.create_index(batch_op.f('ix_orders_checkout_session_id'), ['checkout_session_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_orders_checkout_session_id'))
+        batch_op.drop_column('payment_status')
+        batch_op.drop_column('checkout_session_id')
@@ -0,0 +1,28 @@
+"""Add items.image_digest and items.image_width for thumbnails
+
+Revision ID: 434c808932b7
+Revises: ff3d6bc7b39e
+Create Date: 2026-10-18 18:21:37.640112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '434c808932b7'
+down_revision = 'ff3d6bc7b39e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('items', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_digest', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('image_width', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('items', schema=None) as batch_op:
+        batch_op.drop_column('image_width')
+        batch_op.drop_column('image_digest')
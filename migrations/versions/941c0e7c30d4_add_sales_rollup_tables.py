@@ -0,0 +1,47 @@
+"""Add sales rollup tables
+
+Revision ID: 941c0e7c30d4
+Revises: 434c808932b7
+Create Date: 2026-10-18 21:04:12.518337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '941c0e7c30d4'
+down_revision = '434c808932b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled from existing orders by `flask analytics backfill`
+    op.create_table('daily_sales',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('orders', sa.Integer(), nullable=False),
+    sa.Column('revenue_cents', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('day')
+    )
+    op.create_table('daily_item_sales',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('item_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('revenue_cents', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'item_id')
+    )
+    op.create_table('daily_category_sales',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('category_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('revenue_cents', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'category_id')
+    )
+
+
+def downgrade():
+    op.drop_table('daily_category_sales')
+    op.drop_table('daily_item_sales')
+    op.drop_table('daily_sales')
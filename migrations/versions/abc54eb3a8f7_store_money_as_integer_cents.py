@@ -0,0 +1,69 @@
+"""Store money as integer cents and link items to Stripe prices
+
+Revision ID: abc54eb3a8f7
+Revises: 23658970d1d6
+Create Date: 2026-10-18 15:48:31.204775
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'abc54eb3a8f7'
+down_revision = '23658970d1d6'
+branch_labels = None
+depends_on = None
+
+# (table, dollars column, cents column)
+MONEY_COLUMNS = [
+    ('items', 'price', 'price_cents'),
+    ('order_items', 'price', 'price_cents'),
+    ('orders', 'total_amount', 'total_amount_cents'),
+]
+
+
+def upgrade():
+    for table, dollars, cents in MONEY_COLUMNS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column(cents, sa.Integer(), nullable=True))
+        op.execute(f'UPDATE {table} SET {cents} = CAST(ROUND({dollars} * 100) AS INTEGER)')
+
+    with op.batch_alter_table('items', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_items_price'))
+        batch_op.drop_column('price')
+        batch_op.alter_column('price_cents', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_index(batch_op.f('ix_items_price_cents'), ['price_cents'], unique=False)
+        batch_op.add_column(sa.Column('stripe_product_id', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('stripe_price_id', sa.String(length=255), nullable=True))
+
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.drop_column('price')
+        batch_op.alter_column('price_cents', existing_type=sa.Integer(), nullable=False)
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('total_amount')
+        batch_op.alter_column('total_amount_cents', existing_type=sa.Integer(), nullable=False)
+
+
+def downgrade():
+    for table, dollars, cents in MONEY_COLUMNS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column(dollars, sa.Float(), nullable=True))
+        op.execute(f'UPDATE {table} SET {dollars} = {cents} / 100.0')
+
+    with op.batch_alter_table('items', schema=None) as batch_op:
+        batch_op.drop_column('stripe_price_id')
+        batch_op.drop_column('stripe_product_id')
+        batch_op.drop_index(batch_op.f('ix_items_price_cents'))
+        batch_op.drop_column('price_cents')
+        batch_op.alter_column('price', existing_type=sa.Float(), nullable=False)
+        batch_op.create_index(batch_op.f('ix_items_price'), ['price'], unique=False)
+
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.drop_column('price_cents')
+        batch_op.alter_column('price', existing_type=sa.Float(), nullable=False)
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('total_amount_cents')
+        batch_op.alter_column('total_amount', existing_type=sa.Float(), nullable=False)
@@ -0,0 +1,52 @@
+"""Add product search index
+
+Revision ID: b46cd9fee43d
+Revises: 97a484ea7279
+Create Date: 2026-10-18 10:03:17.228410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b46cd9fee43d'
+down_revision = '97a484ea7279'
+branch_labels = None
+depends_on = None
+
+# Must stay identical to search.PG_SEARCH_VECTOR for the index to be used.
+PG_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        try:
+            op.execute(
+                "CREATE VIRTUAL TABLE items_fts USING fts5("
+                "name, description, tokenize='porter unicode61')"
+            )
+        except sa.exc.OperationalError:
+            # SQLite was built without FTS5; the app falls back to its
+            # in-process index.
+            return
+        op.execute(
+            "INSERT INTO items_fts (rowid, name, description) "
+            "SELECT id, name, description FROM items"
+        )
+    elif bind.dialect.name == 'postgresql':
+        op.execute(
+            f"CREATE INDEX ix_items_search ON items USING GIN (({PG_SEARCH_VECTOR}))"
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS items_fts")
+    elif bind.dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_items_search")
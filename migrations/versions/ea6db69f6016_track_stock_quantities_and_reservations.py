@@ -0,0 +1,87 @@
+"""Track stock quantities and reservations
+
+Revision ID: ea6db69f6016
+Revises: b3edf18109bd
+Create Date: 2026-10-18 14:31:56.082114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ea6db69f6016'
+down_revision = 'b3edf18109bd'
+branch_labels = None
+depends_on = None
+
+# Items flagged 'in_stock' had no recorded quantity; they start with this many
+# units until an admin enters the real count.
+IN_STOCK_BACKFILL_QUANTITY = 100
+
+
+def upgrade():
+    with op.batch_alter_table('items', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stock_quantity', sa.Integer(), nullable=True))
+
+    op.execute(
+        sa.text(
+            "UPDATE items SET stock_quantity = "
+            "CASE WHEN stock = 'in_stock' THEN :quantity ELSE 0 END"
+        ).bindparams(quantity=IN_STOCK_BACKFILL_QUANTITY)
+    )
+
+    with op.batch_alter_table('items', schema=None) as batch_op:
+        batch_op.drop_column('stock')
+        batch_op.alter_column('stock_quantity',
+               new_column_name='stock',
+               existing_type=sa.Integer(),
+               nullable=False)
+
+    op.create_table('stock_reservations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('checkout_session_id', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['item_id'], ['items.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stock_reservations', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stock_reservations_checkout_session_id'), ['checkout_session_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_stock_reservations_expires_at'), ['expires_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_stock_reservations_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    # Give reserved units back before the reservations disappear.
+    op.execute(
+        "UPDATE items SET stock = stock + ("
+        "SELECT coalesce(sum(quantity), 0) FROM stock_reservations "
+        "WHERE stock_reservations.item_id = items.id)"
+    )
+
+    with op.batch_alter_table('stock_reservations', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stock_reservations_user_id'))
+        batch_op.drop_index(batch_op.f('ix_stock_reservations_expires_at'))
+        batch_op.drop_index(batch_op.f('ix_stock_reservations_checkout_session_id'))
+
+    op.drop_table('stock_reservations')
+
+    with op.batch_alter_table('items', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stock_status', sa.String(length=20), nullable=True))
+
+    op.execute(
+        "UPDATE items SET stock_status = "
+        "CASE WHEN stock > 0 THEN 'in_stock' ELSE 'out_of_stock' END"
+    )
+
+    with op.batch_alter_table('items', schema=None) as batch_op:
+        batch_op.drop_column('stock')
+        batch_op.alter_column('stock_status',
+               new_column_name='stock',
+               existing_type=sa.String(length=20),
+               nullable=False)
@@ -0,0 +1,26 @@
+"""Add users.session_version
+
+Revision ID: ff3d6bc7b39e
+Revises: 16592a202d3a
+Create Date: 2026-10-18 17:46:05.183920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ff3d6bc7b39e'
+down_revision = '16592a202d3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('session_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('session_version')
@@ -1,11 +1,21 @@
-import json
 from datetime import datetime, UTC
+from decimal import Decimal
+from functools import cache
 from typing import List
+from flask import current_app
 from flask_login import UserMixin
-from sqlalchemy import Integer, String, Float, Boolean, DateTime, ForeignKey
+from sqlalchemy import Integer, BigInteger, String, Text, Float, Boolean, Date, DateTime, ForeignKey, Index, event, inspect
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
+from money import from_cents, to_cents
+
+
+@cache
+def _hash_prefix(method: str) -> str:
+    # Werkzeug fills in default parameters (e.g. 'scrypt' -> 'scrypt:32768:8:1'),
+    # so hash once per process to learn what hashes made with `method` start with.
+    return generate_password_hash('', method=method).split('$', 1)[0]
 
 
 class User(UserMixin, db.Model):
@@ -19,6 +29,10 @@ class User(UserMixin, db.Model):
         password_hash (str): The hashed password of the user.
         is_active (bool): Indicates whether the user is active or not.
         last_login (DateTime): The date and time of the user's last login (optional).
+        is_admin (bool): Indicates whether the user can manage the catalog.
+        session_version (int): Part of every session id of the user; bumping it signs out all
+            of the user's sessions and retires their cached identity (in other workers only
+            when the response cache backend is shared, see `user_cache.load_user`).
     """
 
     __tablename__ = "users"
@@ -29,6 +43,7 @@ class User(UserMixin, db.Model):
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
     last_login: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
     is_admin: Mapped[bool] = mapped_column(Boolean, default=False)
+    session_version: Mapped[int] = mapped_column(Integer, default=0, server_default='0')
 
     # Relationships
     orders: Mapped[List["Order"]] = relationship("Order", back_populates="user")
@@ -36,16 +51,42 @@ class User(UserMixin, db.Model):
         "CartItem", back_populates="user", cascade="all, delete-orphan"
     )
 
+    def get_id(self) -> str:
+        return f"{self.id}:{self.session_version or 0}"
+
     def set_password(self, password: str) -> None:
-        self.password_hash = generate_password_hash(password)
+        if self.password_hash is not None:
+            # A new password signs out every existing session
+            self.session_version = (self.session_version or 0) + 1
+        self.password_hash = generate_password_hash(
+            password, method=current_app.config['PASSWORD_HASH_METHOD']
+        )
 
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
+        """
+        Check a password against the stored hash.
+
+        A correct password stored with other parameters than `PASSWORD_HASH_METHOD`
+        is rehashed with the current ones, so changing the setting migrates users
+        as they log in. The caller commits.
+        """
+        if not check_password_hash(self.password_hash, password):
+            return False
+        method = current_app.config['PASSWORD_HASH_METHOD']
+        if self.password_hash.split('$', 1)[0] != _hash_prefix(method):
+            self.password_hash = generate_password_hash(password, method=method)
+        return True
 
     def __repr__(self) -> str:
         return f"<User {self.username}>"
 
 
+@event.listens_for(User, 'before_update')
+def _revoke_sessions_on_admin_change(mapper, connection, user: User) -> None:
+    if inspect(user).attrs.is_admin.history.has_changes():
+        user.session_version = (user.session_version or 0) + 1
+
+
 class Item(db.Model):
     """
     Represents an item for sale.
@@ -54,28 +95,50 @@ class Item(db.Model):
         id (int): The unique identifier for the item.
         name (str): The name of the item.
         description (str): The description of the item.
-        price (float): The price of the item.
-        image (str): The URL of the item's image.
-        stock (int): The quantity of the item in stock.
+        price_cents (int): The price of the item in cents; `price` exposes it in dollars.
+        image (str): The URL of the item's image, shown where it has no thumbnails.
+        image_digest (str): The SHA-256 of the original image its thumbnails are named after.
+        image_width (int): The width in pixels of the item's largest thumbnail.
+        stock (int): The quantity on hand, excluding units reserved by open checkouts.
         weight (float): The weight of the item.
         category_id (int): The identifier of the category the item belongs to.
+        stripe_product_id (str): The Stripe Product the item is sold as.
+        stripe_price_id (str): The Stripe Price matching `price_cents`, or None until synced.
     """
 
     __tablename__ = "items"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(64), unique=True, index=True)
     description: Mapped[str] = mapped_column(String(200))
-    price: Mapped[float] = mapped_column(Float)
+    price_cents: Mapped[int] = mapped_column(Integer, index=True)
     image: Mapped[str] = mapped_column(String(200))
-    stock: Mapped[str] = mapped_column(String(20), default='in_stock')
+    image_digest: Mapped[str] = mapped_column(String(64), nullable=True)
+    image_width: Mapped[int] = mapped_column(Integer, nullable=True)
+    stock: Mapped[int] = mapped_column(Integer, default=0)
     weight: Mapped[float] = mapped_column(Float, default=0.0)
-    category_id: Mapped[int] = mapped_column(Integer, ForeignKey('categories.id'))
+    category_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey('categories.id'), index=True
+    )
+    stripe_product_id: Mapped[str] = mapped_column(String(255), nullable=True)
+    stripe_price_id: Mapped[str] = mapped_column(String(255), nullable=True)
 
     category: Mapped["Category"] = relationship("Category", back_populates="items")
 
     def __repr__(self) -> str:
         return f"<Item {self.name}>"
 
+    @property
+    def price(self) -> Decimal:
+        return from_cents(self.price_cents)
+
+    @price.setter
+    def price(self, value) -> None:
+        cents = to_cents(value)
+        if cents != self.price_cents:
+            # Stripe Prices are immutable, so a changed price needs a new one
+            self.stripe_price_id = None
+        self.price_cents = cents
+
 
 class Order(db.Model):
     """
@@ -84,41 +147,99 @@ class Order(db.Model):
     Attributes:
         id (int): The unique identifier for the order.
         user_id (int): The identifier of the user who placed the order.
-        total_amount (float): The total amount of the order.
-        items (str): A string representation of the items in the order.
+        total_amount_cents (int): The total amount of the order in cents; `total_amount` exposes it in dollars.
         status (str): The status of the order (e.g., 'Pending', 'Completed').
         timestamp (DateTime): The date and time the order was placed.
+        checkout_session_id (str): The Stripe Checkout Session the order was paid through.
+        payment_status (str): The payment status reported by Stripe (e.g., 'paid').
     """
 
     __tablename__ = "orders"
+    __table_args__ = (Index('ix_orders_user_id_timestamp', 'user_id', 'timestamp'),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'))
-    total_amount: Mapped[float] = mapped_column(Float)
-    items: Mapped[str] = mapped_column(String(200))  # This will store item IDs
-    serialized_items: Mapped[str] = mapped_column(String, nullable=False)
+    total_amount_cents: Mapped[int] = mapped_column(Integer)
     status: Mapped[str] = mapped_column(String(20), default='Pending')
     timestamp: Mapped[DateTime] = mapped_column(
         DateTime, default=lambda: datetime.now(UTC)
     )
+    checkout_session_id: Mapped[str] = mapped_column(
+        String(255), unique=True, index=True, nullable=True
+    )
+    payment_status: Mapped[str] = mapped_column(String(20), nullable=True)
 
     # Relationships
     user: Mapped["User"] = relationship("User", back_populates="orders")
+    line_items: Mapped[List["OrderItem"]] = relationship(
+        "OrderItem",
+        back_populates="order",
+        cascade="all, delete-orphan",
+        order_by="OrderItem.id",
+    )
 
     def __repr__(self) -> str:
         return f"<Order {self.id} for user {self.user_id}>"
 
-    def serialize_items(self, cart_items):
-        serialized_data = [
-            {
-                'name': item.item.name,
-                'description': item.item.description,
-                'price': item.item.price,
-                'quantity': item.quantity,
-                'image': item.item.image,
-            }
-            for item in cart_items
-        ]
-        self.serialized_items = json.dumps(serialized_data)
+    @property
+    def total_amount(self) -> Decimal:
+        return from_cents(self.total_amount_cents)
+
+    def add_line_items(self, lines) -> None:
+        """Snapshot the given lines into order line items.
+
+        Lines are cart items, stock reservations or anything else with `item_id`,
+        a loaded `item` and `quantity`.
+        """
+        for line in lines:
+            self.line_items.append(
+                OrderItem(
+                    item_id=line.item_id,
+                    name=line.item.name,
+                    description=line.item.description,
+                    price_cents=line.item.price_cents,
+                    quantity=line.quantity,
+                    image=line.item.image,
+                )
+            )
+
+
+class OrderItem(db.Model):
+    """
+    Represents a line item of an order, snapshotted from the cart at purchase time.
+
+    Attributes:
+        id (int): The unique identifier for the line item.
+        order_id (int): The identifier of the order the line item belongs to.
+        item_id (int): The identifier of the purchased item (None if it was since deleted).
+        name (str): The name of the item at purchase time.
+        description (str): The description of the item at purchase time.
+        price_cents (int): The unit price paid in cents; `price` exposes it in dollars.
+        quantity (int): The quantity purchased.
+        image (str): The URL of the item's image at purchase time.
+    """
+
+    __tablename__ = "order_items"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    order_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey('orders.id'), index=True
+    )
+    item_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey('items.id', ondelete='SET NULL'), nullable=True, index=True
+    )
+    name: Mapped[str] = mapped_column(String(64))
+    description: Mapped[str] = mapped_column(String(200))
+    price_cents: Mapped[int] = mapped_column(Integer)
+    quantity: Mapped[int] = mapped_column(Integer)
+    image: Mapped[str] = mapped_column(String(200))
+
+    order: Mapped["Order"] = relationship("Order", back_populates="line_items")
+
+    def __repr__(self) -> str:
+        return f"<OrderItem {self.name} x{self.quantity} for order {self.order_id}>"
+
+    @property
+    def price(self) -> Decimal:
+        return from_cents(self.price_cents)
 
 
 class CartItem(db.Model):
@@ -132,6 +253,9 @@ class CartItem(db.Model):
     """
 
     __tablename__ = "cart_items"
+    __table_args__ = (
+        Index('ix_cart_items_user_id_item_id', 'user_id', 'item_id', unique=True),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'))
     item_id: Mapped[int] = mapped_column(Integer, ForeignKey('items.id'))
@@ -144,6 +268,42 @@ class CartItem(db.Model):
         return f"<CartItem {self.id} for user {self.user_id}>"
 
 
+class StockReservation(db.Model):
+    """
+    Represents units of an item held for a user while they pay.
+
+    The reserved quantity is already subtracted from `Item.stock`; it is given back
+    if the reservation expires before the order is finalized.
+
+    Attributes:
+        id (int): The unique identifier for the reservation.
+        user_id (int): The identifier of the user holding the reservation.
+        item_id (int): The identifier of the reserved item.
+        quantity (int): The number of units reserved.
+        checkout_session_id (str): The Stripe checkout session paying for it (optional).
+        created_at (DateTime): The date and time the reservation was made.
+        expires_at (DateTime): The date and time the units are released again.
+    """
+
+    __tablename__ = "stock_reservations"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), index=True)
+    item_id: Mapped[int] = mapped_column(Integer, ForeignKey('items.id'))
+    quantity: Mapped[int] = mapped_column(Integer)
+    checkout_session_id: Mapped[str] = mapped_column(
+        String(255), nullable=True, index=True
+    )
+    created_at: Mapped[DateTime] = mapped_column(
+        DateTime, default=lambda: datetime.now(UTC)
+    )
+    expires_at: Mapped[DateTime] = mapped_column(DateTime, index=True)
+
+    item: Mapped["Item"] = relationship("Item")
+
+    def __repr__(self) -> str:
+        return f"<StockReservation {self.quantity} x item {self.item_id} for user {self.user_id}>"
+
+
 class Category(db.Model):
     """
     Represents a category of items.
@@ -161,3 +321,114 @@ class Category(db.Model):
 
     def __repr__(self) -> str:
         return f"<Category {self.name}>"
+
+
+class OutboxMessage(db.Model):
+    """
+    Represents a notification waiting to be delivered by the outbox worker.
+
+    Attributes:
+        id (int): The unique identifier for the message.
+        channel (str): The delivery channel (currently only 'email').
+        recipient (str): The address the message is sent to.
+        subject (str): The subject of the message.
+        body (str): The rendered body of the message.
+        html (bool): Whether the body is HTML.
+        status (str): 'pending', 'sending', 'sent' or 'failed'.
+        attempts (int): The number of delivery attempts made so far.
+        last_error (str): The error raised by the last failed attempt (optional).
+        next_attempt_at (DateTime): When the message is next due; doubles as the claim lease.
+        created_at (DateTime): The date and time the message was enqueued.
+        sent_at (DateTime): The date and time the message was delivered (optional).
+    """
+
+    __tablename__ = "outbox_messages"
+    __table_args__ = (
+        Index('ix_outbox_messages_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    channel: Mapped[str] = mapped_column(String(20), default='email')
+    recipient: Mapped[str] = mapped_column(String(120))
+    subject: Mapped[str] = mapped_column(String(200))
+    body: Mapped[str] = mapped_column(Text)
+    html: Mapped[bool] = mapped_column(Boolean, default=False)
+    status: Mapped[str] = mapped_column(String(20), default='pending')
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_error: Mapped[str] = mapped_column(String(500), nullable=True)
+    next_attempt_at: Mapped[DateTime] = mapped_column(
+        DateTime, default=lambda: datetime.now(UTC)
+    )
+    created_at: Mapped[DateTime] = mapped_column(
+        DateTime, default=lambda: datetime.now(UTC)
+    )
+    sent_at: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f"<OutboxMessage {self.id} to {self.recipient} ({self.status})>"
+
+
+class DailySales(db.Model):
+    """
+    Represents the orders of one day, rolled up for the sales dashboard.
+
+    Rollups are kept up to date as orders are finalized and can be rebuilt
+    from the orders with `flask analytics backfill`.
+
+    Attributes:
+        day (Date): The UTC date the orders were placed on.
+        orders (int): The number of orders.
+        revenue_cents (int): The sum of the orders' totals in cents.
+    """
+
+    __tablename__ = "daily_sales"
+    day: Mapped[Date] = mapped_column(Date, primary_key=True)
+    orders: Mapped[int] = mapped_column(Integer, default=0)
+    revenue_cents: Mapped[int] = mapped_column(BigInteger, default=0)
+
+    def __repr__(self) -> str:
+        return f"<DailySales {self.day}: {self.orders} orders>"
+
+
+class DailyItemSales(db.Model):
+    """
+    Represents the sales of one item on one day, rolled up for the sales dashboard.
+
+    Attributes:
+        day (Date): The UTC date the orders were placed on.
+        item_id (int): The identifier of the item (0 for items deleted before they were rolled up).
+        name (str): The name the item was last sold under.
+        units (int): The number of units sold.
+        revenue_cents (int): The value of the units sold in cents.
+    """
+
+    __tablename__ = "daily_item_sales"
+    day: Mapped[Date] = mapped_column(Date, primary_key=True)
+    item_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    name: Mapped[str] = mapped_column(String(64))
+    units: Mapped[int] = mapped_column(Integer, default=0)
+    revenue_cents: Mapped[int] = mapped_column(BigInteger, default=0)
+
+    def __repr__(self) -> str:
+        return f"<DailyItemSales {self.day}: {self.units} x item {self.item_id}>"
+
+
+class DailyCategorySales(db.Model):
+    """
+    Represents the sales of one category on one day, rolled up for the sales dashboard.
+
+    Attributes:
+        day (Date): The UTC date the orders were placed on.
+        category_id (int): The identifier of the category the items were in when
+            rolled up (0 for items without one or deleted before then).
+        units (int): The number of units sold.
+        revenue_cents (int): The value of the units sold in cents.
+    """
+
+    __tablename__ = "daily_category_sales"
+    day: Mapped[Date] = mapped_column(Date, primary_key=True)
+    category_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    units: Mapped[int] = mapped_column(Integer, default=0)
+    revenue_cents: Mapped[int] = mapped_column(BigInteger, default=0)
+
+    def __repr__(self) -> str:
+        return f"<DailyCategorySales {self.day}: category {self.category_id}>"
@@ -0,0 +1,20 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+# Currency of every amount stored in the database and charged through Stripe.
+CURRENCY = 'usd'
+
+
+def to_cents(amount) -> int:
+    """Convert an amount in dollars (Decimal, str, int or float) to integer cents.
+
+    Floats go through their shortest repr first, so 19.99 becomes 1999 rather than
+    1998 as `int(19.99 * 100)` would give.
+    """
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return int((amount * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents: int) -> Decimal:
+    """Convert integer cents to an exact dollar amount with two decimal places."""
+    return Decimal(int(cents or 0)).scaleb(-2)
@@ -1,21 +1,190 @@
 import os
+import queue
 import smtplib
+import threading
+import time
+from contextlib import contextmanager
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from typing import TYPE_CHECKING, Iterable, List, NamedTuple, Optional
 from dotenv import load_dotenv
-from twilio.rest import Client
+from instrumentation import external_call
+
+if TYPE_CHECKING:
+    from twilio.rest import Client
+
+
+class EmailMessage(NamedTuple):
+    """An email to be sent with `NotificationManager.send_many`."""
+
+    subject: str
+    body: str
+    recipient_email: str
+    html: bool = False
+
+
+class SMTPConnectionPool:
+    """A small pool of authenticated SMTP connections that are reused across sends.
+
+    Connections are health-checked with NOOP before reuse and dropped after sitting
+    idle for longer than `max_idle`, since servers close idle sessions on their own.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        user: Optional[str],
+        password: Optional[str],
+        starttls: bool = True,
+        max_size: int = 4,
+        max_idle: float = 60.0,
+        timeout: float = 30.0,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=max_size)
+
+    def _connect(self) -> smtplib.SMTP:
+        connection = smtplib.SMTP(self.host, port=self.port, timeout=self.timeout)
+        if self.starttls:
+            connection.starttls()
+        if self.password:
+            connection.login(user=self.user, password=self.password)
+        return connection
+
+    @staticmethod
+    def _close(connection: smtplib.SMTP) -> None:
+        try:
+            connection.quit()
+        except smtplib.SMTPException:
+            connection.close()
+        except OSError:
+            connection.close()
+
+    @staticmethod
+    def _is_healthy(connection: smtplib.SMTP) -> bool:
+        try:
+            return connection.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def acquire(self) -> smtplib.SMTP:
+        """Return a healthy idle connection, or open a new one."""
+        while True:
+            try:
+                released_at, connection = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - released_at <= self.max_idle and self._is_healthy(
+                connection
+            ):
+                return connection
+            self._close(connection)
+
+    def release(self, connection: smtplib.SMTP) -> None:
+        """Return a connection to the pool, closing it if the pool is full."""
+        try:
+            self._idle.put_nowait((time.monotonic(), connection))
+        except queue.Full:
+            self._close(connection)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; it is discarded instead of returned if the block fails."""
+        connection = self.acquire()
+        try:
+            yield connection
+        except smtplib.SMTPServerDisconnected:
+            connection.close()
+            raise
+        except smtplib.SMTPException:
+            # The server refused this message but the session is still usable.
+            # Checked before OSError, which SMTPException subclasses.
+            self.release(connection)
+            raise
+        except OSError:
+            connection.close()
+            raise
+        except Exception:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                _, connection = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(connection)
 
 
 class NotificationManager:
-    """This class is responsible for sending notifications."""
+    """This class is responsible for sending notifications.
+
+    Use `NotificationManager.instance()` to share one manager, and with it the SMTP
+    pool and the Twilio HTTP session, across the whole process.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
 
     def __init__(self) -> None:
         load_dotenv()
         self.account_sid = os.getenv("TWILIO_ACCOUNT_SID")
         self.auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-        self.client = Client(self.account_sid, self.auth_token)
         self.email_user = os.getenv("MY_EMAIL")
         self.email_pass = os.getenv("MAIL_APP_PASS")
+        self.smtp_host = os.getenv("SMTP_HOST", "smtp.gmail.com")
+        self.smtp_port = int(os.getenv("SMTP_PORT", 587))
+        self.smtp_starttls = os.getenv("SMTP_STARTTLS", "True") == "True"
+        self.smtp_pool = SMTPConnectionPool(
+            self.smtp_host,
+            self.smtp_port,
+            self.email_user,
+            self.email_pass,
+            starttls=self.smtp_starttls,
+            max_size=int(os.getenv("SMTP_POOL_SIZE", 4)),
+            max_idle=float(os.getenv("SMTP_POOL_MAX_IDLE", 60)),
+        )
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls) -> "NotificationManager":
+        """Return the process-wide notification manager, creating it on first use."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    @property
+    def client(self) -> "Client":
+        """The Twilio client, created on first use with a keep-alive HTTP session.
+
+        The SDK is imported here rather than at module load, since most
+        processes only ever send email.
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from twilio.http.http_client import TwilioHttpClient
+                    from twilio.rest import Client
+
+                    self._client = Client(
+                        self.account_sid,
+                        self.auth_token,
+                        http_client=TwilioHttpClient(pool_connections=True, max_retries=3),
+                    )
+        return self._client
 
     def send_sms(self, message: str, to_phone: str):
         """Send an SMS with the given message.
@@ -24,13 +193,27 @@ class NotificationManager:
             message (str): The message to send.
             to_phone (str): The recipient's phone number.
         """
-        message = self.client.messages.create(
-            body=message,
-            from_=os.getenv("TWILIO_PHONE_NUMBER"),
-            to=to_phone,
-        )
+        with external_call('twilio'):
+            message = self.client.messages.create(
+                body=message,
+                from_=os.getenv("TWILIO_PHONE_NUMBER"),
+                to=to_phone,
+            )
         print(message.sid)
 
+    def _build_email(
+        self, subject: str, body: str, recipient_email: str, html: bool = False
+    ) -> MIMEMultipart:
+        msg = MIMEMultipart()
+        msg['From'] = self.email_user
+        msg['To'] = recipient_email
+        msg['Subject'] = subject
+        if html:
+            msg.attach(MIMEText(body, 'html'))
+        else:
+            msg.attach(MIMEText(body, 'plain'))
+        return msg
+
     def send_email(
         self, subject: str, body: str, recipient_email: str, html: bool = False
     ):
@@ -42,16 +225,53 @@ class NotificationManager:
             recipient_email (str): The recipient's email address.
             html (bool): If True, send the email as HTML. Default is False.
         """
-        msg = MIMEMultipart()
-        msg['From'] = self.email_user
-        msg['To'] = recipient_email
-        msg['Subject'] = subject
-        if html:
-            msg.attach(MIMEText(body, 'html'))
-        else:
-            msg.attach(MIMEText(body, 'plain'))
-
-        with smtplib.SMTP("smtp.gmail.com", port=587) as connection:
-            connection.starttls()
-            connection.login(user=self.email_user, password=self.email_pass)
+        msg = self._build_email(subject, body, recipient_email, html)
+        with external_call('smtp'), self.smtp_pool.connection() as connection:
             connection.send_message(msg)
+
+    def send_many(self, messages: Iterable[EmailMessage]) -> List[Optional[Exception]]:
+        """Send several emails over a single authenticated SMTP connection.
+
+        A dropped connection is replaced once and the interrupted message retried,
+        so one bad session does not fail the rest of the batch.
+
+        Args:
+            messages (Iterable[EmailMessage]): The emails to send.
+
+        Returns:
+            list: One entry per message, None if it was sent or the exception raised.
+        """
+        results = []
+        connection = None
+        try:
+            for message in messages:
+                msg = self._build_email(*message)
+                for attempt in range(2):
+                    try:
+                        with external_call('smtp'):
+                            if connection is None:
+                                connection = self.smtp_pool.acquire()
+                            connection.send_message(msg)
+                        results.append(None)
+                        break
+                    except smtplib.SMTPServerDisconnected as e:
+                        if connection is not None:
+                            connection.close()
+                            connection = None
+                        if attempt == 1:
+                            results.append(e)
+                    except smtplib.SMTPException as e:
+                        # A refused recipient or message leaves the session usable;
+                        # SMTPException subclasses OSError, so it is handled first
+                        results.append(e)
+                        break
+                    except OSError as e:
+                        if connection is not None:
+                            connection.close()
+                            connection = None
+                        if attempt == 1:
+                            results.append(e)
+        finally:
+            if connection is not None:
+                self.smtp_pool.release(connection)
+        return results
@@ -0,0 +1,144 @@
+import logging
+from typing import NamedTuple
+from flask import render_template
+from sqlalchemy.exc import IntegrityError
+from app import db
+import analytics
+import inventory
+import outbox
+import stripe_catalog
+from cart import invalidate_cart, remove_cart_items
+from models import Item, Order, StockReservation, User
+
+logger = logging.getLogger(__name__)
+
+# Stripe events that mean a checkout session's money has arrived.
+PAID_EVENTS = ('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+
+
+class CheckoutLine(NamedTuple):
+    """A line of a paid checkout session whose reservation is gone, rebuilt from Stripe."""
+
+    item_id: int
+    item: Item
+    quantity: int
+
+
+def _checkout_lines(checkout_session_id: str) -> list:
+    """Return the lines a checkout session paid for, each with `item` and `quantity`.
+
+    They are the session's own stock reservations. Once those have expired and
+    been released, they are rebuilt from the session's Stripe line items; items
+    deleted since are left out.
+    """
+    reservations = inventory.session_reservations(checkout_session_id)
+    if reservations:
+        return reservations
+    quantities = stripe_catalog.checkout_session_quantities(checkout_session_id)
+    items = {item.id: item for item in Item.query.filter(Item.id.in_(quantities))}
+    return [
+        CheckoutLine(item_id, items[item_id], quantity)
+        for item_id, quantity in quantities.items()
+        if item_id in items
+    ]
+
+
+def _checkout_user_id(checkout_session):
+    """Return the id of the user who started a checkout session, or None."""
+    reference = checkout_session.get('client_reference_id')
+    if reference and reference.isdigit():
+        return int(reference)
+    # Sessions created before client_reference_id was set are still tied to
+    # their user through the stock they reserved.
+    reservation = StockReservation.query.filter_by(
+        checkout_session_id=checkout_session['id']
+    ).first()
+    return reservation.user_id if reservation else None
+
+
+def finalize_checkout(checkout_session):
+    """Create the order for a paid Stripe checkout session, exactly once.
+
+    The order is keyed on the session id, which is unique in `orders`, so replays
+    of the same webhook, a webhook racing the success page, or concurrent
+    deliveries all end up with the one order. Whoever loses the insert rolls back
+    its cart and stock changes and gets the winner's order.
+
+    Args:
+        checkout_session: The Stripe Checkout Session, as a StripeObject or the
+            plain dict from a recorded webhook payload.
+
+    Returns:
+        Order: The order for the session, or None if it is not paid or its user is unknown.
+    """
+    session_id = checkout_session['id']
+    order = Order.query.filter_by(checkout_session_id=session_id).first()
+    if order is not None:
+        return order
+    if checkout_session.get('payment_status') not in ('paid', 'no_payment_required'):
+        return None
+
+    user = db.session.get(User, _checkout_user_id(checkout_session) or 0)
+    if user is None:
+        logger.warning('Checkout session %s has no matching user', session_id)
+        return None
+
+    lines = _checkout_lines(session_id)
+    # Stripe reports the amount actually charged, already in cents
+    total_amount_cents = checkout_session.get('amount_total')
+    if total_amount_cents is None:
+        total_amount_cents = sum(line.item.price_cents * line.quantity for line in lines)
+
+    try:
+        # Turn the stock held for this session into sold stock
+        fulfilled = inventory.consume_reservations(session_id, lines)
+
+        order = Order(
+            user_id=user.id,
+            total_amount_cents=total_amount_cents,
+            status='Pending' if fulfilled else 'Backordered',
+            checkout_session_id=session_id,
+            payment_status=checkout_session.get('payment_status'),
+        )
+        order.add_line_items(lines)
+        db.session.add(order)
+        db.session.flush()
+        analytics.record_order(order)
+
+        # Take the ordered units out of the cart, keeping anything added since
+        remove_cart_items(user.id, inventory.line_quantities(lines))
+
+        # Queue the email notification in the same transaction as the order;
+        # the outbox worker delivers it outside of this request
+        subject = "Order Confirmation"
+        html_body = render_template(
+            'email/order_confirmation.html',
+            user=user,
+            order=order,
+            items=order.line_items,
+        )
+        outbox.enqueue_email(subject, html_body, user.email, html=True)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return Order.query.filter_by(checkout_session_id=session_id).first()
+
+    invalidate_cart(user.id)
+    outbox.wake()
+    return order
+
+
+def handle_stripe_event(event) -> None:
+    """Apply a verified Stripe webhook event to the local database.
+
+    Args:
+        event: The event returned by `stripe.Webhook.construct_event`, or an
+            equivalent dict loaded from a recorded payload.
+    """
+    event_type = event['type']
+    checkout_session = event['data']['object']
+    if event_type in PAID_EVENTS:
+        finalize_checkout(checkout_session)
+    elif event_type in ('checkout.session.expired', 'checkout.session.async_payment_failed'):
+        inventory.release_session_reservations(checkout_session['id'])
+        db.session.commit()
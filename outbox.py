@@ -0,0 +1,227 @@
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta, UTC
+import click
+from flask import current_app
+from sqlalchemy import and_, update
+from app import app, db
+from models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def enqueue_email(subject: str, body: str, recipient_email: str, html: bool = False):
+    """Queue an email for delivery by the outbox worker.
+
+    The message is added to the current session, so it is persisted atomically with
+    whatever the caller commits next. Call `wake()` after committing.
+
+    Args:
+        subject (str): The subject of the email.
+        body (str): The body of the email.
+        recipient_email (str): The recipient's email address.
+        html (bool): If True, send the email as HTML. Default is False.
+
+    Returns:
+        OutboxMessage: The queued message.
+    """
+    message = OutboxMessage(
+        channel='email',
+        recipient=recipient_email,
+        subject=subject,
+        body=body,
+        html=html,
+        status='pending',
+        attempts=0,
+        next_attempt_at=datetime.now(UTC),
+    )
+    db.session.add(message)
+    return message
+
+
+def backoff_delay(attempts: int) -> float:
+    """Return the number of seconds to wait before retry number `attempts`, with jitter."""
+    base = current_app.config['OUTBOX_BACKOFF_BASE']
+    delay = min(base * 2 ** (attempts - 1), current_app.config['OUTBOX_BACKOFF_MAX'])
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _claim_due_messages(limit: int):
+    """Atomically lease up to `limit` due messages to this worker.
+
+    A message is due when it is pending and its retry time has passed, or when a
+    previous worker's lease on it expired without the message being marked sent.
+    """
+    now = datetime.now(UTC)
+    lease_until = now + timedelta(seconds=current_app.config['OUTBOX_LEASE'])
+    candidates = (
+        OutboxMessage.query.filter(
+            OutboxMessage.status.in_(('pending', 'sending')),
+            OutboxMessage.next_attempt_at <= now,
+        )
+        .order_by(OutboxMessage.next_attempt_at)
+        .limit(limit)
+        .all()
+    )
+    claimed = []
+    for message in candidates:
+        result = db.session.execute(
+            update(OutboxMessage)
+            .where(
+                and_(
+                    OutboxMessage.id == message.id,
+                    OutboxMessage.status.in_(('pending', 'sending')),
+                    OutboxMessage.next_attempt_at <= now,
+                )
+            )
+            .values(status='sending', next_attempt_at=lease_until)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            claimed.append(message.id)
+    db.session.commit()
+    return OutboxMessage.query.filter(OutboxMessage.id.in_(claimed)).all() if claimed else []
+
+
+def _record_result(message: OutboxMessage, error, max_attempts: int) -> bool:
+    message.attempts += 1
+    if error is None:
+        message.status = 'sent'
+        message.sent_at = datetime.now(UTC)
+        message.last_error = None
+        return True
+
+    message.last_error = str(error)[:500]
+    if message.attempts >= max_attempts:
+        message.status = 'failed'
+        logger.error('Outbox message %s failed permanently: %s', message.id, error)
+    else:
+        message.status = 'pending'
+        message.next_attempt_at = datetime.now(UTC) + timedelta(
+            seconds=backoff_delay(message.attempts)
+        )
+        logger.warning('Outbox message %s failed, will retry: %s', message.id, error)
+    return False
+
+
+def drain(limit: int = None) -> int:
+    """Deliver every message that is currently due.
+
+    Each claimed batch is sent over one pooled SMTP connection. Must be called
+    inside an application context.
+
+    Args:
+        limit (int): The maximum number of messages to claim per batch.
+
+    Returns:
+        int: The number of messages delivered successfully.
+    """
+    from notification_manager import EmailMessage, NotificationManager
+
+    limit = limit or current_app.config['OUTBOX_BATCH_SIZE']
+    max_attempts = current_app.config['OUTBOX_MAX_ATTEMPTS']
+    manager = NotificationManager.instance()
+    sent = 0
+
+    while True:
+        messages = _claim_due_messages(limit)
+        if not messages:
+            return sent
+        results = manager.send_many(
+            EmailMessage(m.subject, m.body, m.recipient, m.html) for m in messages
+        )
+        for message, error in zip(messages, results):
+            sent += _record_result(message, error, max_attempts)
+        db.session.commit()
+
+
+class OutboxWorker(threading.Thread):
+    """Background thread that drains the outbox whenever it is woken or polled."""
+
+    def __init__(self, flask_app) -> None:
+        super().__init__(name='outbox-worker', daemon=True)
+        self.app = flask_app
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+
+    def run(self) -> None:
+        interval = self.app.config['OUTBOX_POLL_INTERVAL']
+        while not self.stopping.is_set():
+            try:
+                with self.app.app_context():
+                    drain()
+            except Exception:
+                logger.exception('Outbox worker iteration failed')
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.wakeup.set()
+
+
+def start_worker(flask_app):
+    """Start the in-process worker if `OUTBOX_WORKER` is 'thread' and it is not running.
+
+    Called from gunicorn's `post_fork` and by the development server in
+    `app.py`, so messages queued before a restart are delivered right away.
+    Nothing starts it implicitly: never call it in a process that forks
+    afterwards, such as a preloading master, or one that only runs a command.
+
+    Returns:
+        OutboxWorker: The running worker, or None when the outbox is drained externally.
+    """
+    global _worker
+
+    if flask_app.config['OUTBOX_WORKER'] != 'thread':
+        return None
+    worker = _worker
+    if worker is not None and worker.is_alive():
+        return worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = OutboxWorker(flask_app)
+            _worker.start()
+        return _worker
+
+
+def wake() -> None:
+    """Signal the in-process worker that new messages were committed.
+
+    Does nothing in a process without a running worker, e.g. when `OUTBOX_WORKER`
+    is 'external' and `flask outbox run` drains the outbox from a separate
+    process; the messages are delivered on its next poll.
+    """
+    worker = _worker
+    if worker is not None and worker.is_alive():
+        worker.wakeup.set()
+
+
+@app.cli.group('outbox')
+def outbox_cli():
+    """Notification outbox commands."""
+
+
+@outbox_cli.command('drain')
+def drain_command():
+    """Deliver every due message once and exit."""
+    click.echo(f'Delivered {drain()} message(s).')
+
+
+@outbox_cli.command('run')
+def run_command():
+    """Drain the outbox continuously in this process."""
+    interval = current_app.config['OUTBOX_POLL_INTERVAL']
+    click.echo(f'Outbox worker polling every {interval}s. Press Ctrl+C to stop.')
+    while True:
+        try:
+            drain()
+        except Exception:
+            logger.exception('Outbox worker iteration failed')
+            db.session.rollback()
+        time.sleep(interval)
@@ -0,0 +1,153 @@
+import base64
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+from sqlalchemy import and_, or_
+
+# Cursor integers must fit in a signed 64-bit column
+MAX_INT = 2 ** 63
+
+
+@dataclass
+class KeysetPage:
+    """
+    A single page of results produced by keyset (cursor) pagination.
+
+    Attributes:
+        items (list): The rows on this page.
+        next_cursor (str): Opaque cursor for the following page, or None on the last page.
+        per_page (int): The effective page size after capping.
+    """
+
+    items: List[Any]
+    next_cursor: Optional[str]
+    per_page: int
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+
+def _decode_value(obj: dict):
+    if set(obj) == {'$dt'}:
+        return datetime.fromisoformat(obj['$dt'])
+    return obj
+
+
+def encode_cursor(values: list) -> str:
+    """Encode the sort key values of the last row into an opaque URL-safe cursor."""
+    raw = json.dumps(values, separators=(',', ':'), default=_encode_value).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _valid_value(value, column) -> bool:
+    # Values must have the column's type, so a crafted cursor cannot make the
+    # database compare e.g. a timestamp with a string, or overflow a BIGINT
+    expected = column.type.python_type
+    if expected is int:
+        return type(value) is int and -MAX_INT <= value < MAX_INT
+    if expected is str:
+        return isinstance(value, str)
+    if expected is datetime:
+        return isinstance(value, datetime)
+    return False
+
+
+def decode_cursor(cursor: Optional[str], columns: Sequence) -> Optional[list]:
+    """Decode a cursor produced by `encode_cursor` for rows sorted by `columns`.
+
+    Returns None if the cursor is malformed, or if it does not hold exactly one
+    value of the right type (int, str or datetime) for each column, so callers
+    treat it as no cursor at all.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(
+            base64.urlsafe_b64decode(padded.encode()), object_hook=_decode_value
+        )
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(columns):
+        return None
+    if not all(_valid_value(value, column) for value, column in zip(values, columns)):
+        return None
+    return values
+
+
+def clamp_per_page(per_page: Optional[int], default: int, maximum: int) -> int:
+    """Return a page size within [1, maximum], falling back to `default`."""
+    if not per_page or per_page < 1:
+        return default
+    return min(per_page, maximum)
+
+
+def keyset_paginate(query, sort_column, id_column, cursor=None, per_page=20, descending=False):
+    """Paginate `query` by seeking past the last row instead of using OFFSET.
+
+    Rows are ordered by (sort_column, id_column) so the ordering is total and stable
+    even when sort values repeat. Each page costs one index range scan of
+    `per_page + 1` rows regardless of how deep into the result set it is.
+
+    Args:
+        query: A SQLAlchemy query to paginate.
+        sort_column: The column to order by (may be the same as `id_column`).
+        id_column: The unique tie-breaker column, usually the primary key.
+        cursor (str): The cursor returned with the previous page, if any.
+        per_page (int): The number of rows to return.
+        descending (bool): If True, order from the largest key to the smallest.
+
+    Returns:
+        KeysetPage: The requested page and the cursor for the next one.
+    """
+    same_column = sort_column is id_column
+    after = decode_cursor(cursor, [id_column] if same_column else [sort_column, id_column])
+
+    if after is not None:
+        if same_column:
+            last_id = after[0]
+            query = query.filter(id_column < last_id if descending else id_column > last_id)
+        else:
+            last_value, last_id = after
+            if descending:
+                query = query.filter(
+                    or_(
+                        sort_column < last_value,
+                        and_(sort_column == last_value, id_column < last_id),
+                    )
+                )
+            else:
+                query = query.filter(
+                    or_(
+                        sort_column > last_value,
+                        and_(sort_column == last_value, id_column > last_id),
+                    )
+                )
+
+    if same_column:
+        order_by = [id_column.desc() if descending else id_column.asc()]
+    elif descending:
+        order_by = [sort_column.desc(), id_column.desc()]
+    else:
+        order_by = [sort_column.asc(), id_column.asc()]
+
+    rows = query.order_by(*order_by).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        id_value = getattr(last, id_column.key)
+        if same_column:
+            next_cursor = encode_cursor([id_value])
+        else:
+            next_cursor = encode_cursor([getattr(last, sort_column.key), id_value])
+
+    return KeysetPage(items=rows, next_cursor=next_cursor, per_page=per_page)
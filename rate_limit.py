@@ -0,0 +1,86 @@
+import logging
+import threading
+import time
+from functools import wraps
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+from caching import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Counts hits per key in fixed windows, in this process's memory.
+
+    Attributes:
+        limit (int): The number of hits a key may make per window.
+        period (float): The length of a window in seconds.
+        rejected (int): The number of hits refused so far.
+    """
+
+    def __init__(self, limit: int, period: float, maxsize: int = 10000) -> None:
+        self.limit = limit
+        self.period = period
+        self.rejected = 0
+        self._windows = TTLCache(maxsize=maxsize, ttl=period)
+        self._lock = threading.Lock()
+
+    def hit(self, key: str) -> float:
+        """Count a hit for `key`.
+
+        Returns:
+            float: 0 if the hit is allowed, otherwise the seconds until the key's window ends.
+        """
+        now = time.monotonic()
+        with self._lock:
+            started, count = self._windows.get(key, (now, 0))
+            remaining = started + self.period - now
+            self._windows.set(key, (started, count + 1), ttl=remaining)
+            if count < self.limit:
+                return 0.0
+            self.rejected += 1
+            return remaining
+
+
+def _limiter(name: str) -> RateLimiter:
+    limiters = current_app.extensions.setdefault('rate_limits', {})
+    limiter = limiters.get(name)
+    if limiter is None:
+        limiter = limiters[name] = RateLimiter(
+            current_app.config['LOGIN_RATE_LIMIT'], current_app.config['LOGIN_RATE_PERIOD']
+        )
+    return limiter
+
+
+def limit_attempts(name: str):
+    """
+    Decorate a view so each client address gets `LOGIN_RATE_LIMIT` POSTs per
+    `LOGIN_RATE_PERIOD` seconds, and a 429 with Retry-After beyond that.
+
+    Meant for views that hash passwords, whose CPU cost would otherwise let a
+    credential-stuffing burst starve every other request. Behind a proxy, set up
+    `werkzeug.middleware.proxy_fix.ProxyFix` so `remote_addr` is the client's.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method == 'POST' and current_app.config['LOGIN_RATE_LIMIT']:
+                wait = _limiter(name).hit(request.remote_addr or 'unknown')
+                if wait:
+                    logger.info('Rate limited %s from %s', name, request.remote_addr)
+                    raise TooManyRequests(
+                        'Too many attempts. Please wait a minute and try again.',
+                        retry_after=max(1, round(wait)),
+                    )
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def rate_limit_stats() -> dict:
+    limiters = current_app.extensions.get('rate_limits', {})
+    return {name: {'rejected': limiter.rejected} for name, limiter in limiters.items()}
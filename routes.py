@@ -1,5 +1,5 @@
 from flask import render_template, flash, redirect, url_for, request, jsonify, abort
-from app import app, db
+from app import app, db, csrf, response_cache
 from models import User, Item, Order, CartItem, Category
 from forms import (
     LoginForm,
@@ -9,13 +9,44 @@ from forms import (
     AddCategoryForm,
 )
 from flask_login import current_user, login_user, logout_user, login_required
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 from urllib.parse import urlparse
 from decorators import admin_required
-from notification_manager import NotificationManager
-import stripe
-import json
-
-stripe.api_key = app.config['STRIPE_SECRET_KEY']
+from pagination import keyset_paginate, clamp_per_page
+from cart import (
+    load_cart,
+    cart_total,
+    add_cart_item,
+    change_cart_quantity,
+    get_cart_item_count,
+    invalidate_cart,
+    cart_count_stats,
+)
+from session_cart import (
+    CartFull,
+    add_session_item,
+    change_session_quantity,
+    load_session_cart,
+    merge_session_cart,
+    session_cart_count,
+    session_cart_total,
+    set_session_quantity,
+)
+from category_cache import all_categories, invalidate_categories, category_cache_stats
+from user_cache import invalidate_user, user_cache_stats
+from rate_limit import limit_attempts, rate_limit_stats
+from money import from_cents
+import search
+import analytics
+import inventory
+import orders
+import stripe_catalog
+import images
+import db_pool
+from db_replicas import read_replica, replica_stats
+from instrumentation import external_call
+import time
 
 
 @app.context_processor
@@ -23,27 +54,78 @@ def inject_stripe_key():
     return dict(stripe_public_key=app.config['STRIPE_PUBLIC_KEY'])
 
 
+# Sort options for the catalog listing: name -> (column, descending)
+CATALOG_SORTS = {
+    'newest': (Item.id, True),
+    'price_asc': (Item.price_cents, False),
+    'price_desc': (Item.price_cents, True),
+    'name': (Item.name, False),
+}
+
+
 @app.route('/')
 @app.route('/index')
+@response_cache.cached('catalog')
+@read_replica
 def index():
     category_id = request.args.get('category_id', type=int)
-    categories = Category.query.all()
+    sort = request.args.get('sort', 'newest')
+    if sort not in CATALOG_SORTS:
+        sort = 'newest'
+    per_page = clamp_per_page(
+        request.args.get('per_page', type=int),
+        app.config['ITEMS_PER_PAGE'],
+        app.config['MAX_ITEMS_PER_PAGE'],
+    )
+    categories = all_categories()
 
+    query = Item.query
     if category_id:
-        items = Item.query.filter_by(category_id=category_id).all()
-    else:
-        items = Item.query.all()
+        query = query.filter_by(category_id=category_id)
+
+    sort_column, descending = CATALOG_SORTS[sort]
+    page = keyset_paginate(
+        query,
+        sort_column,
+        Item.id,
+        cursor=request.args.get('after'),
+        per_page=per_page,
+        descending=descending,
+    )
 
     return render_template(
         'index.html',
         title='Home',
-        items=items,
+        items=page.items,
+        page=page,
         categories=categories,
         selected_category=category_id,
+        selected_sort=sort,
+    )
+
+
+@app.route('/search')
+@read_replica
+def search_products():
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['ITEMS_PER_PAGE']
+
+    items, total = search.search_items(query, page, per_page) if query else ([], 0)
+
+    return render_template(
+        'search.html',
+        title='Search',
+        query=query,
+        items=items,
+        total=total,
+        page=page,
+        has_next=page * per_page < total,
     )
 
 
 @app.route('/login', methods=['GET', 'POST'])
+@limit_attempts('login')
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -53,7 +135,10 @@ def login():
         if user is None or not user.check_password(form.password.data):
             flash('Invalid username or password', 'danger')
             return redirect(url_for('login'))
+        # Persists a hash upgraded by check_password
+        db.session.commit()
         login_user(user, remember=form.remember_me.data)
+        merge_session_cart(user.id)
         next_page = request.args.get('next')
         if not next_page or urlparse(next_page).netloc != '':
             next_page = url_for('index')
@@ -63,11 +148,14 @@ def login():
 
 @app.route('/logout')
 def logout():
+    if current_user.is_authenticated:
+        invalidate_user(current_user)
     logout_user()
     return redirect(url_for('index'))
 
 
 @app.route('/register', methods=['GET', 'POST'])
+@limit_attempts('register')
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -86,59 +174,105 @@ def register():
     return render_template('register.html', title='Register', form=form)
 
 
+def wants_json():
+    """Return True if the client prefers a JSON response, e.g. a fetch() from the page."""
+    best = request.accept_mimetypes.best_match(['text/html', 'application/json'])
+    return best == 'application/json'
+
+
+def same_origin():
+    """Return True only if the browser says the request was sent from this site.
+
+    Browsers send an Origin header with every POST, so a request with neither
+    Origin nor Referer did not come from one of our pages and is refused.
+    """
+    source = request.headers.get('Origin') or request.referrer
+    return bool(source) and urlparse(source).netloc == request.host
+
+
+def cart_count():
+    """Return the current visitor's cart badge count after a cart change."""
+    if current_user.is_authenticated:
+        return get_cart_item_count(current_user.id)
+    return session_cart_count()
+
+
+# Anonymous visitors get their catalog pages from the shared response cache,
+# which cannot carry a per-visitor CSRF token, so their adds are only checked
+# for a same-site origin; they can only ever touch their own cookie cart.
 @app.route('/add_to_cart/<int:item_id>', methods=['POST'])
-@login_required
+@csrf.exempt
 def add_to_cart(item_id):
-    item = Item.query.get_or_404(item_id)
-    cart_item = CartItem.query.filter_by(
-        user_id=current_user.id, item_id=item_id
-    ).first()
-    if cart_item:
-        cart_item.quantity += 1
+    if current_user.is_authenticated:
+        if app.config['WTF_CSRF_ENABLED']:
+            csrf.protect()
+        quantity = add_cart_item(current_user.id, item_id)
+        if quantity is not None:
+            db.session.commit()
+            invalidate_cart(current_user.id)
     else:
-        cart_item = CartItem(user_id=current_user.id, item_id=item_id, quantity=1)
-        db.session.add(cart_item)
-    db.session.commit()
-    flash(f'Added {item.name} to your cart.', 'success')
+        if not same_origin():
+            abort(403)
+        try:
+            quantity = add_session_item(item_id)
+        except CartFull:
+            message = 'Your cart is full. Log in to add more items.'
+            if wants_json():
+                abort(409, message)
+            flash(message, 'warning')
+            return redirect(url_for('cart'))
+    if quantity is None:
+        abort(404)
+    if wants_json():
+        return jsonify(item_id=item_id, quantity=quantity, cart_count=cart_count())
+    flash('Item added to your cart.', 'success')
     return redirect(url_for('index'))
 
 
+# Anonymous cart lines are identified by their item's id, logged-in ones by the CartItem's
 @app.route('/update_cart/<int:item_id>', methods=['POST'])
-@login_required
 def update_cart(item_id):
     action = request.form.get('action')
-    cart_item = CartItem.query.filter_by(
-        id=item_id, user_id=current_user.id
-    ).first_or_404()
-
-    if action == 'increase':
-        cart_item.quantity += 1
-    elif action == 'decrease' and cart_item.quantity > 1:
-        cart_item.quantity -= 1
-    elif action == 'decrease' and cart_item.quantity == 1:
-        db.session.delete(cart_item)
-
-    db.session.commit()
+    delta = {'increase': 1, 'decrease': -1}.get(action)
+    if delta is None:
+        abort(400)
+    if current_user.is_authenticated:
+        quantity = change_cart_quantity(current_user.id, item_id, delta)
+        if quantity is not None:
+            db.session.commit()
+            invalidate_cart(current_user.id)
+    else:
+        quantity = change_session_quantity(item_id, delta)
+    if quantity is None:
+        abort(404)
+    if wants_json():
+        return jsonify(cart_item_id=item_id, quantity=quantity, cart_count=cart_count())
     return redirect(url_for('cart'))
 
 
 @app.route('/delete_cart_item/<int:item_id>', methods=['POST'])
-@login_required
 def delete_cart_item(item_id):
-    cart_item = CartItem.query.filter_by(
-        id=item_id, user_id=current_user.id
-    ).first_or_404()
-    db.session.delete(cart_item)
-    db.session.commit()
+    if current_user.is_authenticated:
+        cart_item = CartItem.query.filter_by(
+            id=item_id, user_id=current_user.id
+        ).first_or_404()
+        db.session.delete(cart_item)
+        db.session.commit()
+        invalidate_cart(current_user.id)
+    elif set_session_quantity(item_id, 0) is None:
+        abort(404)
     flash('Item removed from cart.', 'success')
     return redirect(url_for('cart'))
 
 
 @app.route('/cart')
-@login_required
 def cart():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    total_amount = sum(item.item.price * item.quantity for item in cart_items)
+    if current_user.is_authenticated:
+        cart_items = load_cart(current_user.id)
+        total_amount = cart_total(current_user.id)
+    else:
+        cart_items = load_session_cart()
+        total_amount = session_cart_total(cart_items)
     return render_template(
         'cart.html',
         title='Shopping Cart',
@@ -151,40 +285,50 @@ def cart():
 @login_required
 def checkout():
     if request.method == 'POST':
+        user_id = current_user.id
+        cart_items = load_cart(user_id)
+        if not cart_items:
+            return jsonify(error='Your cart is empty.'), 400
+        # Built before the commit below expires the cart items and their items
+        line_items = [
+            stripe_catalog.checkout_line_item(cart_item.item, cart_item.quantity)
+            for cart_item in cart_items
+        ]
+
+        # Hold the stock in its own short transaction so no row stays locked
+        # while Stripe is being called
         try:
-            cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-            line_items = []
-
-            for cart_item in cart_items:
-                line_items.append(
-                    {
-                        'price_data': {
-                            'currency': 'usd',
-                            'product_data': {
-                                'name': cart_item.item.name,
-                            },
-                            'unit_amount': int(
-                                cart_item.item.price * 100
-                            ),  # Stripe expects amount in cents
-                        },
-                        'quantity': cart_item.quantity,
-                    }
-                )
+            provisional_id = inventory.reserve_cart(user_id, cart_items)
+            db.session.commit()
+        except inventory.InsufficientStock as e:
+            db.session.rollback()
+            return jsonify(error=str(e)), 409
 
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=line_items,
-                mode='payment',
-                success_url=url_for('order_confirmation', _external=True)
-                + '?session_id={CHECKOUT_SESSION_ID}',
-                cancel_url=url_for('cart', _external=True),
-            )
+        try:
+            stripe = stripe_catalog.get_stripe()
+            with external_call('stripe'):
+                session = stripe.checkout.Session.create(
+                    payment_method_types=['card'],
+                    line_items=line_items,
+                    mode='payment',
+                    success_url=url_for('order_confirmation', _external=True)
+                    + '?session_id={CHECKOUT_SESSION_ID}',
+                    cancel_url=url_for('cart', _external=True),
+                    client_reference_id=str(user_id),
+                    expires_at=int(time.time())
+                    + max(app.config['CHECKOUT_RESERVATION_TTL'], 1800),
+                )
+            inventory.assign_checkout_session(provisional_id, session.id)
+            db.session.commit()
             return jsonify({'id': session.id})
         except Exception as e:
+            db.session.rollback()
+            inventory.release_session_reservations(provisional_id)
+            db.session.commit()
             return jsonify(error=str(e)), 403
 
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    total_amount = sum(item.item.price * item.quantity for item in cart_items)
+    cart_items = load_cart(current_user.id)
+    total_amount = cart_total(current_user.id)
     return render_template(
         'checkout.html',
         title='Checkout',
@@ -200,121 +344,175 @@ def order_confirmation():
     if not session_id:
         return redirect(url_for('index'))
 
-    try:
-        checkout_session = stripe.checkout.Session.retrieve(session_id)
-        payment_intent = stripe.PaymentIntent.retrieve(checkout_session.payment_intent)
-        cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-        total_amount = sum(item.item.price * item.quantity for item in cart_items)
-
-        # Create a new order
-        order = Order(
-            user_id=current_user.id,
-            total_amount=total_amount,
-            items=";".join([str(item.item_id) for item in cart_items]),
-            status='Pending',
-        )
-        order.serialize_items(
-            cart_items
-        )  # Serialize items before adding the order to the session
-        db.session.add(order)
-        db.session.commit()
+    # Orders are created by the Stripe webhook; this page only reads them
+    order = Order.query.filter_by(
+        checkout_session_id=session_id, user_id=current_user.id
+    ).first()
 
-        # Clear the cart
-        for cart_item in cart_items:
-            db.session.delete(cart_item)
-        db.session.commit()
+    if order is None and not app.config['STRIPE_WEBHOOK_SECRET']:
+        # Without a webhook endpoint configured, finalize from the redirect
+        stripe = stripe_catalog.get_stripe()
+        try:
+            with external_call('stripe'):
+                checkout_session = stripe.checkout.Session.retrieve(session_id)
+        except stripe.StripeError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('index'))
+        if checkout_session.client_reference_id == str(current_user.id):
+            order = orders.finalize_checkout(checkout_session)
 
-        # Send email notification
-        notification_manager = NotificationManager()
-        subject = "Order Confirmation"
-        html_body = render_template(
-            'email/order_confirmation.html',
-            user=current_user,
-            order=order,
-            items=json.loads(order.serialized_items),
-        )
-        notification_manager.send_email(
-            subject, html_body, current_user.email, html=True
-        )
+    return render_template(
+        'order_confirmation.html',
+        title='Order Confirmation',
+        order=order,
+    )
 
-        return render_template(
-            'order_confirmation.html',
-            title='Order Confirmation',
-            order=order,
-            payment_intent=payment_intent,
+
+@app.route('/stripe/webhook', methods=['POST'])
+@csrf.exempt
+def stripe_webhook():
+    secret = app.config['STRIPE_WEBHOOK_SECRET']
+    if not secret:
+        abort(404)
+
+    stripe = stripe_catalog.get_stripe()
+    try:
+        event = stripe.Webhook.construct_event(
+            request.get_data(), request.headers.get('Stripe-Signature', ''), secret
         )
-    except Exception as e:
-        flash(str(e), 'danger')
-        return redirect(url_for('index'))
+    except (ValueError, stripe.SignatureVerificationError):
+        return jsonify(error='Invalid payload or signature.'), 400
+
+    orders.handle_stripe_event(event)
+    return jsonify(received=True)
 
 
 @app.route('/order_history')
 @login_required
+@read_replica
 def order_history():
-    orders = Order.query.filter_by(user_id=current_user.id).all()
-    order_details = []
-
-    for order in orders:
-        serialized_items = json.loads(order.serialized_items)
-        order_details.append({'order': order, 'order_items': serialized_items})
+    order_count, lifetime_spend_cents = (
+        db.session.query(
+            func.count(Order.id), func.coalesce(func.sum(Order.total_amount_cents), 0)
+        )
+        .filter(Order.user_id == current_user.id)
+        .one()
+    )
+    # Line items are only loaded for the orders on this page
+    page = keyset_paginate(
+        Order.query.options(selectinload(Order.line_items)).filter_by(
+            user_id=current_user.id
+        ),
+        Order.timestamp,
+        Order.id,
+        cursor=request.args.get('after'),
+        per_page=app.config['ORDERS_PER_PAGE'],
+        descending=True,
+    )
 
     return render_template(
-        'order_history.html', title='Order History', order_details=order_details
+        'order_history.html',
+        title='Order History',
+        orders=page.items,
+        page=page,
+        order_count=order_count,
+        lifetime_spend=from_cents(lifetime_spend_cents),
     )
 
 
 @app.route('/order/<int:order_id>')
 @login_required
+@read_replica
 def order_details(order_id):
-    order = Order.query.filter_by(id=order_id, user_id=current_user.id).first_or_404()
-    serialized_items = json.loads(order.serialized_items)  # Parse the serialized items
+    order = (
+        Order.query.options(selectinload(Order.line_items))
+        .filter_by(id=order_id, user_id=current_user.id)
+        .first_or_404()
+    )
     return render_template(
-        'order_details.html', title='Order Details', order=order, items=serialized_items
+        'order_details.html', title='Order Details', order=order, items=order.line_items
     )
 
 
+def item_image_from_form(form, current=None):
+    """Render thumbnails for an item form's uploaded image, or else its image URL.
+
+    Raises:
+        images.ImageError: If the uploaded file is not a usable image.
+    """
+    if form.image_file.data:
+        return images.process_upload(form.image_file.data)
+    return images.process_url(form.image.data, current=current)
+
+
 @app.route('/add_item', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def add_item():
     form = AddItemForm()
     if form.validate_on_submit():
+        try:
+            image = item_image_from_form(form)
+        except images.ImageError as e:
+            flash(f'Could not use the uploaded image: {e}', 'danger')
+            return render_template('add_item.html', title='Add Item', form=form)
         item = Item(
             name=form.name.data,
             description=form.description.data,
             price=form.price.data,
-            image=form.image.data,
+            image=image.url,
+            image_digest=image.digest,
+            image_width=image.width,
             stock=form.stock.data,
             weight=form.weight.data,
             category_id=form.category.data,
         )
         db.session.add(item)
+        db.session.flush()
+        search.index_item(item)
+        db.session.commit()
+        # Stripe is called after the item is saved so no transaction waits on it
+        stripe_catalog.sync_item(item)
         db.session.commit()
+        response_cache.invalidate('catalog')
         flash('Item has been added successfully!', 'success')
         return redirect(url_for('index'))
     return render_template('add_item.html', title='Add Item', form=form)
 
 
 @app.route('/product/<int:product_id>', methods=['GET', 'POST'])
+@response_cache.cached('catalog')
+@read_replica
 def product_details(product_id):
     product = Item.query.get_or_404(product_id)
-    form = EditItemForm(obj=product)
+    is_admin = current_user.is_authenticated and current_user.is_admin
+    # Only admins see the edit form, so nobody else pays for building it
+    form = EditItemForm(obj=product) if is_admin else None
 
-    if form.validate_on_submit():
-        if current_user.is_authenticated and current_user.is_admin:
-            product.name = form.name.data
-            product.description = form.description.data
-            product.price = form.price.data
-            product.image = form.image.data
-            product.stock = form.stock.data
-            product.weight = form.weight.data
-            product.category_id = form.category.data
-
-            db.session.commit()
-            flash('Product updated successfully!', 'success')
+    if request.method == 'POST' and not is_admin:
+        flash('You do not have permission to edit this product.', 'danger')
+    elif form is not None and form.validate_on_submit():
+        try:
+            image = item_image_from_form(form, current=product)
+        except images.ImageError as e:
+            flash(f'Could not use the uploaded image: {e}', 'danger')
             return redirect(url_for('product_details', product_id=product_id))
-        else:
-            flash('You do not have permission to edit this product.', 'danger')
+        renamed = product.name != form.name.data
+        product.name = form.name.data
+        product.description = form.description.data
+        product.price = form.price.data
+        product.image, product.image_digest, product.image_width = image
+        product.stock = form.stock.data
+        product.weight = form.weight.data
+        product.category_id = form.category.data
+
+        search.index_item(product)
+        db.session.commit()
+        stripe_catalog.sync_item(product, renamed=renamed)
+        db.session.commit()
+        response_cache.invalidate('catalog')
+        flash('Product updated successfully!', 'success')
+        return redirect(url_for('product_details', product_id=product_id))
 
     return render_template(
         'product_details.html', title='Product Details', product=product, form=form
@@ -326,8 +524,10 @@ def product_details(product_id):
 @admin_required
 def delete_product(product_id):
     product = Item.query.get_or_404(product_id)
+    search.remove_item(product.id)
     db.session.delete(product)
     db.session.commit()
+    response_cache.invalidate('catalog')
     flash('Product has been deleted successfully!', 'success')
     return redirect(url_for('index'))
 
@@ -337,12 +537,14 @@ def delete_product(product_id):
 @admin_required
 def manage_categories():
     form = AddCategoryForm()
-    categories = Category.query.all()
+    categories = all_categories()
 
     if form.validate_on_submit():
         category = Category(name=form.name.data)
         db.session.add(category)
         db.session.commit()
+        invalidate_categories()
+        response_cache.invalidate('catalog')
         flash('Category added successfully!', 'success')
         return redirect(url_for('manage_categories'))
 
@@ -367,10 +569,47 @@ def delete_category(category_id):
 
     db.session.delete(category)
     db.session.commit()
+    invalidate_categories()
+    response_cache.invalidate('catalog')
     flash('Category has been deleted successfully!', 'success')
     return redirect(url_for('manage_categories'))
 
 
+@app.route('/admin/analytics')
+@login_required
+@admin_required
+@read_replica
+def sales_analytics():
+    days = request.args.get('days', 30, type=int)
+    report = analytics.sales_report(days)
+    return render_template(
+        'sales_analytics.html',
+        title='Sales Analytics',
+        report=report,
+        days=len(report.days),
+    )
+
+
+@app.route('/admin/cache_stats')
+@login_required
+@admin_required
+def cache_stats():
+    return jsonify(
+        cart_counts=cart_count_stats(),
+        categories=category_cache_stats(),
+        users=user_cache_stats(),
+        response_cache=response_cache.stats(),
+        rate_limits=rate_limit_stats(),
+    )
+
+
+@app.route('/admin/pool_stats')
+@login_required
+@admin_required
+def pool_stats():
+    return jsonify({**db_pool.pool_stats(db.engine), 'replicas': replica_stats()})
+
+
 """TODO:
 4. Improved UI/UX.
 """
@@ -0,0 +1,327 @@
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import List, Tuple
+import click
+from flask import current_app
+from sqlalchemy import event, text
+from app import app, db, response_cache
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# `Session.info` key set when the transaction in progress changed indexed items
+INDEX_CHANGED = 'search_index_changed'
+
+# Shared by the GIN index created in the migration and by the search query;
+# Postgres only uses the index when both expressions are identical.
+PG_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+
+def tokenize(value: str) -> List[str]:
+    """Split free text into lowercase word tokens."""
+    return [token.lower() for token in TOKEN_RE.findall(value or '')]
+
+
+class SearchBackend:
+    """Interface implemented by every product search backend."""
+
+    name = 'base'
+
+    def index_item(self, item) -> None:
+        """Add or refresh `item` in the index. Called before the session commits."""
+
+    def remove_item(self, item_id: int) -> None:
+        """Drop the item with `item_id` from the index. Called before the session commits."""
+
+    def search(self, query: str, limit: int, offset: int = 0) -> Tuple[List[int], int]:
+        """Return the ranked item ids for `query` and the total number of matches."""
+        raise NotImplementedError
+
+    def rebuild(self) -> None:
+        """Rebuild the whole index from the `items` table."""
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """Search backed by the `items_fts` FTS5 virtual table, ranked with BM25."""
+
+    name = 'sqlite-fts5'
+
+    def index_item(self, item) -> None:
+        db.session.execute(
+            text('DELETE FROM items_fts WHERE rowid = :id'), {'id': item.id}
+        )
+        db.session.execute(
+            text(
+                'INSERT INTO items_fts (rowid, name, description) '
+                'VALUES (:id, :name, :description)'
+            ),
+            {'id': item.id, 'name': item.name, 'description': item.description},
+        )
+
+    def remove_item(self, item_id: int) -> None:
+        db.session.execute(
+            text('DELETE FROM items_fts WHERE rowid = :id'), {'id': item_id}
+        )
+
+    def rebuild(self) -> None:
+        db.session.execute(text('DELETE FROM items_fts'))
+        db.session.execute(
+            text(
+                'INSERT INTO items_fts (rowid, name, description) '
+                'SELECT id, name, description FROM items'
+            )
+        )
+
+    @staticmethod
+    def _match_expression(tokens: List[str]) -> str:
+        # Quote every token so user input can never be parsed as FTS syntax,
+        # and prefix-match the last one for search-as-you-type.
+        terms = [f'"{token}"' for token in tokens]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    def search(self, query: str, limit: int, offset: int = 0) -> Tuple[List[int], int]:
+        tokens = tokenize(query)
+        if not tokens:
+            return [], 0
+        params = {'match': self._match_expression(tokens), 'limit': limit, 'offset': offset}
+        rows = db.session.execute(
+            text(
+                'SELECT rowid FROM items_fts WHERE items_fts MATCH :match '
+                'ORDER BY bm25(items_fts, 10.0, 1.0) LIMIT :limit OFFSET :offset'
+            ),
+            params,
+        )
+        total = db.session.execute(
+            text('SELECT count(*) FROM items_fts WHERE items_fts MATCH :match'), params
+        ).scalar()
+        return [row[0] for row in rows], total
+
+
+class PostgresFTSBackend(SearchBackend):
+    """Search backed by a GIN index over a weighted `tsvector` expression.
+
+    The index is maintained by Postgres itself, so no sync work is required.
+    """
+
+    name = 'postgres-tsvector'
+
+    def search(self, query: str, limit: int, offset: int = 0) -> Tuple[List[int], int]:
+        tokens = tokenize(query)
+        if not tokens:
+            return [], 0
+        ts_query = ' & '.join(tokens[:-1] + [tokens[-1] + ':*'])
+        params = {'query': ts_query, 'limit': limit, 'offset': offset}
+        rows = db.session.execute(
+            text(
+                f'SELECT id FROM items, to_tsquery(\'english\', :query) AS q '
+                f'WHERE ({PG_SEARCH_VECTOR}) @@ q '
+                f'ORDER BY ts_rank({PG_SEARCH_VECTOR}, q) DESC, id '
+                f'LIMIT :limit OFFSET :offset'
+            ),
+            params,
+        )
+        total = db.session.execute(
+            text(
+                f'SELECT count(*) FROM items '
+                f'WHERE ({PG_SEARCH_VECTOR}) @@ to_tsquery(\'english\', :query)'
+            ),
+            params,
+        ).scalar()
+        return [row[0] for row in rows], total
+
+
+class InMemorySearchBackend(SearchBackend):
+    """Pure-Python inverted index ranked with BM25.
+
+    Used when the database offers no full-text support. The index is loaded
+    from the `items` table on first use and again after a committed item
+    change, which bumps the 'search' generation of the response cache. That
+    reaches other processes when the response cache backend is shared;
+    otherwise `ttl` seconds (`SEARCH_INDEX_TTL`) bound how long they may miss it.
+    """
+
+    name = 'in-memory'
+    namespace = 'search'
+    k1 = 1.2
+    b = 0.75
+    name_weight = 3
+
+    def __init__(self, ttl: float = 300.0) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._postings = defaultdict(dict)  # term -> {item_id: term frequency}
+        self._doc_terms = {}  # item_id -> {term: term frequency}
+        self._lengths = {}  # item_id -> weighted token count
+        self._total_length = 0
+        self._changes = 0  # local invalidations, which the null backend does not count
+        self._loaded = None  # (generation, changes) the index was loaded at
+        self._loaded_at = 0.0
+
+    def _terms(self, name: str, description: str) -> dict:
+        counts = defaultdict(int)
+        for token in tokenize(name):
+            counts[token] += self.name_weight
+        for token in tokenize(description):
+            counts[token] += 1
+        return counts
+
+    def _add(self, item_id: int, name: str, description: str) -> None:
+        terms = self._terms(name, description)
+        self._doc_terms[item_id] = terms
+        self._lengths[item_id] = sum(terms.values())
+        self._total_length += self._lengths[item_id]
+        for term, frequency in terms.items():
+            self._postings[term][item_id] = frequency
+
+    def _ensure_loaded(self) -> None:
+        with self._lock:
+            state = (response_cache.generation(self.namespace), self._changes)
+            if self._loaded == state and time.monotonic() - self._loaded_at < self.ttl:
+                return
+        from models import Item
+
+        rows = db.session.query(Item.id, Item.name, Item.description).all()
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._lengths.clear()
+            self._total_length = 0
+            for item_id, name, description in rows:
+                self._add(item_id, name, description)
+            # A change committed while loading leaves `_changes` ahead, so the
+            # next search loads again
+            self._loaded = state
+            self._loaded_at = time.monotonic()
+
+    def _mark_changed(self) -> None:
+        db.session.info[INDEX_CHANGED] = True
+
+    def index_item(self, item) -> None:
+        self._mark_changed()
+
+    def remove_item(self, item_id: int) -> None:
+        self._mark_changed()
+
+    def rebuild(self) -> None:
+        self._mark_changed()
+
+    def invalidate(self) -> None:
+        """Load the index again on the next search, in every process sharing the response cache."""
+        response_cache.invalidate(self.namespace)
+        with self._lock:
+            self._changes += 1
+
+    def search(self, query: str, limit: int, offset: int = 0) -> Tuple[List[int], int]:
+        tokens = tokenize(query)
+        if not tokens:
+            return [], 0
+        self._ensure_loaded()
+
+        with self._lock:
+            doc_count = len(self._doc_terms) or 1
+            avg_length = self._total_length / doc_count or 1
+            matches = None
+            scores = defaultdict(float)
+            for position, token in enumerate(tokens):
+                if position == len(tokens) - 1:
+                    terms = [term for term in self._postings if term.startswith(token)]
+                else:
+                    terms = [token] if token in self._postings else []
+                token_docs = set()
+                for term in terms:
+                    postings = self._postings[term]
+                    idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for item_id, frequency in postings.items():
+                        length = self._lengths[item_id]
+                        norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                        scores[item_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+                        token_docs.add(item_id)
+                matches = token_docs if matches is None else matches & token_docs
+
+        ranked = sorted(matches, key=lambda item_id: (-scores[item_id], item_id))
+        return ranked[offset:offset + limit], len(ranked)
+
+
+def _detect_backend() -> SearchBackend:
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        has_fts = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'")
+        ).first()
+        if has_fts:
+            return SQLiteFTSBackend()
+    elif dialect == 'postgresql':
+        return PostgresFTSBackend()
+    return InMemorySearchBackend(ttl=current_app.config['SEARCH_INDEX_TTL'])
+
+
+def get_search_backend() -> SearchBackend:
+    """Return the search backend for the current app, detecting it on first use."""
+    backend = current_app.extensions.get('search')
+    if backend is None:
+        backend = current_app.extensions['search'] = _detect_backend()
+    return backend
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_index(session) -> None:
+    if session.info.pop(INDEX_CHANGED, False):
+        get_search_backend().invalidate()
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_changed_index(session, previous_transaction) -> None:
+    if previous_transaction.parent is None:
+        session.info.pop(INDEX_CHANGED, None)
+
+
+def index_item(item) -> None:
+    """Refresh `item` in the search index as part of the current transaction."""
+    get_search_backend().index_item(item)
+
+
+def remove_item(item_id: int) -> None:
+    """Remove an item from the search index as part of the current transaction."""
+    get_search_backend().remove_item(item_id)
+
+
+def search_items(query: str, page: int, per_page: int):
+    """Run a ranked product search.
+
+    Args:
+        query (str): The user's free-text query.
+        page (int): The 1-based page number.
+        per_page (int): The number of results per page.
+
+    Returns:
+        tuple: The `Item` objects on the page, in rank order, and the total match count.
+    """
+    from models import Item
+
+    item_ids, total = get_search_backend().search(
+        query, limit=per_page, offset=(page - 1) * per_page
+    )
+    if not item_ids:
+        return [], total
+    items = {item.id: item for item in Item.query.filter(Item.id.in_(item_ids))}
+    return [items[item_id] for item_id in item_ids if item_id in items], total
+
+
+@app.cli.group('search')
+def search_cli():
+    """Product search index commands."""
+
+
+@search_cli.command('reindex')
+def reindex():
+    """Rebuild the product search index from the items table."""
+    backend = get_search_backend()
+    backend.rebuild()
+    db.session.commit()
+    click.echo(f'Rebuilt the {backend.name} search index.')
@@ -0,0 +1,132 @@
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional
+from flask import current_app, session
+from sqlalchemy import select
+from app import db
+from cart import invalidate_cart, merge_cart_items
+from models import Item
+from money import from_cents
+
+# Session key of the anonymous cart; `ResponseCache` skips visitors who have one
+SESSION_KEY = 'cart'
+
+
+class CartFull(Exception):
+    """Raised when an anonymous cart already holds `SESSION_CART_MAX_LINES` items."""
+
+
+class SessionCartLine(NamedTuple):
+    """A line of an anonymous cart, shaped like a `CartItem` for the cart templates.
+
+    Lines have no row of their own, so they are identified by their item's id.
+    """
+
+    id: int
+    item_id: int
+    item: Item
+    quantity: int
+
+
+def session_cart() -> Dict[int, int]:
+    """Return the anonymous visitor's cart as quantities by item id."""
+    return {int(item_id): quantity for item_id, quantity in session.get(SESSION_KEY, {}).items()}
+
+
+def _save(cart: Dict[int, int]) -> None:
+    if cart:
+        # JSON object keys are strings, and the cookie is signed, not encrypted
+        session[SESSION_KEY] = {str(item_id): quantity for item_id, quantity in cart.items()}
+    else:
+        session.pop(SESSION_KEY, None)
+
+
+def add_session_item(item_id: int, quantity: int = 1) -> Optional[int]:
+    """Add units of an item to the anonymous cart, returning the line's new quantity.
+
+    Only reads the database, to check that the item exists.
+
+    Returns:
+        int: The new quantity, or None if the item does not exist.
+
+    Raises:
+        CartFull: If the item is not in the cart and the cart has no room for another line.
+    """
+    cart = session_cart()
+    if item_id not in cart:
+        if len(cart) >= current_app.config['SESSION_CART_MAX_LINES']:
+            raise CartFull
+        if db.session.scalar(select(Item.id).where(Item.id == item_id)) is None:
+            return None
+    cart[item_id] = cart.get(item_id, 0) + quantity
+    _save(cart)
+    return cart[item_id]
+
+
+def set_session_quantity(item_id: int, quantity: int) -> Optional[int]:
+    """Set the quantity of a line of the anonymous cart, removing the line at zero.
+
+    Returns:
+        int: The new quantity, or None if the cart has no such line.
+    """
+    cart = session_cart()
+    if item_id not in cart:
+        return None
+    if quantity <= 0:
+        del cart[item_id]
+    else:
+        cart[item_id] = quantity
+    _save(cart)
+    return max(quantity, 0)
+
+
+def change_session_quantity(item_id: int, delta: int) -> Optional[int]:
+    """Add `delta` (possibly negative) to a line of the anonymous cart, removing it at zero.
+
+    Returns:
+        int: The new quantity, or None if the cart has no such line.
+    """
+    quantity = session_cart().get(item_id)
+    if quantity is None:
+        return None
+    return set_session_quantity(item_id, quantity + delta)
+
+
+def session_cart_count() -> int:
+    return sum(session_cart().values())
+
+
+def load_session_cart() -> List[SessionCartLine]:
+    """Return the anonymous cart's lines with their items, loaded in one query.
+
+    Items deleted since they were added are dropped from the cart.
+    """
+    cart = session_cart()
+    if not cart:
+        return []
+    items = {item.id: item for item in Item.query.filter(Item.id.in_(cart))}
+    if len(items) < len(cart):
+        cart = {item_id: quantity for item_id, quantity in cart.items() if item_id in items}
+        _save(cart)
+    return [
+        SessionCartLine(item_id, item_id, items[item_id], quantity)
+        for item_id, quantity in cart.items()
+    ]
+
+
+def session_cart_total(lines: List[SessionCartLine]) -> Decimal:
+    return from_cents(sum(line.item.price_cents * line.quantity for line in lines))
+
+
+def merge_session_cart(user_id: int) -> None:
+    """Move the anonymous cart into a user's `CartItem` rows after they logged in.
+
+    Quantities are added to the lines the user already has, with one upsert.
+    Commits.
+    """
+    cart = session_cart()
+    if not cart:
+        return
+    merge_cart_items(user_id, cart)
+    db.session.commit()
+    session.pop(SESSION_KEY, None)
+    invalidate_cart(user_id)
@@ -1,7 +1,8 @@
 #!/bin/bash
+set -e
 
-# Run the database migrations
+# Run the database migrations; safe when several replicas start at once
 python create_db.py
 
-# Start the Gunicorn server
+# Start the Gunicorn server (settings in gunicorn.conf.py)
 exec gunicorn app:app
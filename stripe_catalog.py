@@ -0,0 +1,129 @@
+import logging
+from typing import Dict
+import click
+from flask import current_app
+from app import app, db
+from instrumentation import external_call
+from models import Item
+from money import CURRENCY
+
+logger = logging.getLogger(__name__)
+
+
+def get_stripe():
+    """Return the Stripe SDK, importing and configuring it on first use.
+
+    Importing the SDK takes most of a second, so nothing imports it at module
+    load; processes that never call Stripe never pay for it.
+    """
+    import stripe
+
+    if stripe.api_key is None:
+        stripe.api_key = current_app.config['STRIPE_SECRET_KEY']
+    return stripe
+
+
+def sync_item(item: Item, renamed: bool = False) -> bool:
+    """Make sure an item has a Stripe Product and a Price matching `price_cents`.
+
+    Prices are immutable in Stripe, so a new one is created whenever the item's
+    price changed (the `Item.price` setter clears `stripe_price_id`). Stripe
+    errors are logged rather than raised: checkout falls back to inline
+    `price_data` for items without a Price. The caller commits.
+
+    Args:
+        item (Item): The item to sync, already flushed so it has an id.
+        renamed (bool): If True, the Product's name is updated to the item's.
+
+    Returns:
+        bool: True if the item has an up-to-date Stripe Price.
+    """
+    if not current_app.config['STRIPE_SECRET_KEY']:
+        return False
+    stripe = get_stripe()
+    try:
+        with external_call('stripe'):
+            if item.stripe_product_id is None:
+                product = stripe.Product.create(
+                    name=item.name, metadata={'item_id': str(item.id)}
+                )
+                item.stripe_product_id = product.id
+            elif renamed:
+                stripe.Product.modify(item.stripe_product_id, name=item.name)
+            if item.stripe_price_id is None:
+                price = stripe.Price.create(
+                    product=item.stripe_product_id,
+                    unit_amount=item.price_cents,
+                    currency=CURRENCY,
+                )
+                item.stripe_price_id = price.id
+    except stripe.StripeError:
+        logger.warning('Could not sync item %s to Stripe', item.id, exc_info=True)
+        return False
+    return True
+
+
+def checkout_line_item(item: Item, quantity: int) -> dict:
+    """Return the Checkout Session line item for `quantity` units of an item.
+
+    Like the Products made by `sync_item`, inline products carry the item's id
+    in their metadata, so `checkout_session_quantities` can map lines back.
+    """
+    if item.stripe_price_id:
+        return {'price': item.stripe_price_id, 'quantity': quantity}
+    return {
+        'price_data': {
+            'currency': CURRENCY,
+            'product_data': {'name': item.name, 'metadata': {'item_id': str(item.id)}},
+            'unit_amount': item.price_cents,
+        },
+        'quantity': quantity,
+    }
+
+
+def checkout_session_quantities(checkout_session_id: str) -> Dict[int, int]:
+    """Return the units a Stripe checkout session was paid for, by item id.
+
+    Lines whose product does not name an item (e.g. a Product created by hand
+    in the dashboard) are skipped. Stripe errors are raised.
+    """
+    stripe = get_stripe()
+    quantities = {}
+    with external_call('stripe'):
+        line_items = stripe.checkout.Session.list_line_items(
+            checkout_session_id, limit=100, expand=['data.price.product']
+        )
+        for line in line_items.auto_paging_iter():
+            item_id = (line['price']['product'].get('metadata') or {}).get('item_id', '')
+            if item_id.isdigit():
+                quantities[int(item_id)] = quantities.get(int(item_id), 0) + line['quantity']
+    return quantities
+
+
+@app.cli.group('stripe')
+def stripe_cli():
+    """Stripe catalog commands."""
+
+
+@stripe_cli.command('sync-prices')
+def sync_prices_command():
+    """Create Stripe Products and Prices for items that have none."""
+    synced = failed = 0
+    last_id = 0
+    while True:
+        items = (
+            Item.query.filter(Item.id > last_id, Item.stripe_price_id.is_(None))
+            .order_by(Item.id)
+            .limit(100)
+            .all()
+        )
+        if not items:
+            break
+        for item in items:
+            if sync_item(item):
+                synced += 1
+            else:
+                failed += 1
+        db.session.commit()
+        last_id = items[-1].id
+    click.echo(f'Synced {synced} item(s), {failed} failed.')
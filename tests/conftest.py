@@ -0,0 +1,116 @@
+import os
+import tempfile
+import pytest
+
+# The configuration is read when `app` is imported, so everything it needs is
+# set before the first test module imports it.
+_tmp = tempfile.mkdtemp(prefix='stonemarket-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmp, 'test.db')
+# The read replica is the same database under a second file name, so routed
+# reads see every test's data while tests can still tell the engines apart
+os.symlink(os.path.join(_tmp, 'test.db'), os.path.join(_tmp, 'replica.db'))
+os.environ['DB_REPLICA_URLS'] = 'sqlite:///' + os.path.join(_tmp, 'replica.db')
+os.environ['IMAGE_DIR'] = os.path.join(_tmp, 'images')
+os.environ['OUTBOX_WORKER'] = 'external'
+os.environ['LOGIN_RATE_LIMIT'] = '0'
+os.environ['RESPONSE_CACHE_BACKEND'] = 'null'
+os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+
+from flask_migrate import upgrade  # noqa: E402
+from app import app as flask_app, db  # noqa: E402
+from caching import TTLCache  # noqa: E402
+from models import Category, Item, User  # noqa: E402
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'migrations')
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        upgrade(directory=MIGRATIONS)
+    return flask_app
+
+
+@pytest.fixture(autouse=True)
+def clean_db(app):
+    """Give every test empty tables and caches."""
+    yield
+    with app.app_context():
+        db.session.remove()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+    for extension in app.extensions.values():
+        if isinstance(extension, TTLCache):
+            extension.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username='bob', password='pw', **kwargs):
+        with app.app_context():
+            user = User(username=username, email=f'{username}@example.com', **kwargs)
+            user.set_password(password)
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+
+    return make_user
+
+
+@pytest.fixture
+def make_items(app):
+    def make_items(count, stock=50):
+        with app.app_context():
+            category = Category.query.first() or Category(name='Marble')
+            items = [
+                Item(
+                    name=f'Stone {n}',
+                    description=f'Stone number {n}',
+                    price=10 + n,
+                    image='http://example.com/stone.png',
+                    stock=stock,
+                    weight=1.0,
+                    category=category,
+                )
+                for n in range(count)
+            ]
+            db.session.add_all(items)
+            db.session.commit()
+            return [item.id for item in items]
+
+    return make_items
+
+
+@pytest.fixture
+def login(client):
+    def login(username='bob', password='pw'):
+        response = client.post('/login', data={'username': username, 'password': password})
+        assert response.status_code == 302
+
+    return login
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    """Start a local SMTP stand-in and point a fresh `NotificationManager` at it."""
+    from notification_manager import NotificationManager
+    from smtp_stub import SMTPStub
+
+    server = SMTPStub().start()
+    monkeypatch.setenv('SMTP_HOST', '127.0.0.1')
+    monkeypatch.setenv('SMTP_PORT', str(server.port))
+    monkeypatch.setenv('SMTP_STARTTLS', 'False')
+    monkeypatch.setenv('MY_EMAIL', 'shop@example.com')
+    monkeypatch.setenv('MAIL_APP_PASS', '')
+    monkeypatch.setattr(NotificationManager, '_instance', None)
+    yield server
+    if NotificationManager._instance is not None:
+        NotificationManager._instance.smtp_pool.close_all()
+    server.stop()
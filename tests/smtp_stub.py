@@ -0,0 +1,82 @@
+import socketserver
+import threading
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    """A minimal local SMTP server that records messages and refuses chosen recipients.
+
+    Attributes:
+        refused (set): Recipient addresses answered with 550.
+        connections (int): The number of SMTP sessions opened so far.
+        messages (list): (recipients, raw message) pairs accepted so far.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, refused=()) -> None:
+        super().__init__(('127.0.0.1', 0), _SMTPSession)
+        self.refused = set(refused)
+        self.connections = 0
+        self.messages = []
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> 'SMTPStub':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _SMTPSession(socketserver.StreamRequestHandler):
+    def reply(self, line: str) -> None:
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self) -> None:
+        self.server.connections += 1
+        self.reply('220 stub ESMTP')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 stub')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>')
+                if address in self.server.refused:
+                    self.reply('550 No such user')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                if not recipients:
+                    self.reply('503 No valid recipients')
+                    continue
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while (line := self.rfile.readline()) not in (b'.\r\n', b''):
+                    data.append(line)
+                self.server.messages.append((recipients, b''.join(data)))
+                self.reply('250 OK')
+            elif verb == 'RSET':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Not implemented')
@@ -0,0 +1,57 @@
+import pytest
+from app import db
+from benchmark import compare, parse_args, run_route, track_statements
+
+
+@pytest.fixture
+def counter(app):
+    """A benchmark statement counter on the test engines, removed afterwards."""
+    with app.app_context():
+        engines = list(db.engines.values())
+    with track_statements(engines) as counter:
+        yield counter
+
+
+def test_statements_on_replicas_are_counted(app, client, make_items, counter):
+    item_id, = make_items(1)
+    before = counter['statements']
+    client.get(f'/product/{item_id}')
+    # The test app reads product pages from its replica
+    assert counter['statements'] > before
+
+
+def test_run_route_reports_latency_and_queries(client, make_items, counter):
+    make_items(3)
+    args = parse_args(['--requests', '8', '--warmup', '1'])
+    stats = run_route('index', [client], args, counter)
+
+    assert stats['requests'] == 8
+    assert 0 < stats['p50_ms'] <= stats['p95_ms'] <= stats['p99_ms']
+    assert stats['queries_per_request'] >= 1
+    assert stats['max_queries'] >= stats['queries_per_request']
+    assert stats['peak_alloc_kb'] > 0
+
+
+def test_run_route_fails_on_error_responses(client, counter):
+    args = parse_args(['--requests', '2', '--warmup', '0', '--items', '1'])
+    with pytest.raises(RuntimeError, match='product_details returned 404'):
+        run_route('product_details', [client], args, counter)
+
+
+def test_compare_flags_regressions_beyond_the_threshold():
+    baseline = {
+        'index': {'p95_ms': 10.0, 'queries_per_request': 4},
+        'cart': {'p95_ms': 0, 'queries_per_request': 2},
+    }
+    results = {
+        'index': {'p95_ms': 12.5, 'queries_per_request': 4.8},
+        'cart': {'p95_ms': 50.0, 'queries_per_request': 2.4},
+        'checkout': {'p95_ms': 99.0, 'queries_per_request': 9},
+    }
+
+    assert compare(results, baseline, 0.2) == ['index: p95_ms 10.0 -> 12.5']
+    assert compare(results, baseline, 0.1) == [
+        'index: p95_ms 10.0 -> 12.5',
+        'index: queries_per_request 4 -> 4.8',
+        'cart: queries_per_request 2 -> 2.4',
+    ]
@@ -0,0 +1,56 @@
+import os
+import time
+import pytest
+from app import response_cache
+from caching import FileSystemBackend, MemoryBackend
+
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    monkeypatch.setattr(response_cache, 'backend', MemoryBackend())
+
+
+@pytest.mark.parametrize('url', ['/index', '/api/v1/items', '/api/v1/categories'])
+def test_hit_and_miss_send_the_same_weak_etag(
+    app, client, make_items, memory_cache, monkeypatch, url
+):
+    make_items(3)
+    monkeypatch.setitem(app.config, 'API_COMPRESS_MIN_SIZE', 1)
+    headers = {'Accept-Encoding': 'gzip'}
+
+    miss = client.get(url, headers=headers)
+    hit = client.get(url, headers=headers)
+    assert (miss.headers['X-Cache'], hit.headers['X-Cache']) == ('MISS', 'HIT')
+    assert miss.headers['ETag'] == hit.headers['ETag']
+    assert hit.headers['ETag'].startswith('W/')
+
+    revalidated = client.get(url, headers={**headers, 'If-None-Match': miss.headers['ETag']})
+    assert revalidated.status_code == 304
+
+
+def test_generation_counters_expire_without_reusing_values(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: clock[0])
+    backend = MemoryBackend(max_counters=2, counter_ttl=60)
+
+    first = backend.incr('generation:cart:1')
+    clock[0] += 61
+    assert backend.counter('generation:cart:1') == 0
+    assert backend.incr('generation:cart:1') not in (0, first)
+
+    backend.incr('generation:cart:2')
+    backend.incr('generation:cart:3')
+    assert backend.counter('generation:cart:1') == 0
+    assert len(backend._counters) == 2
+
+
+def test_filesystem_sweep_removes_stale_counters(tmp_path):
+    backend = FileSystemBackend(str(tmp_path), counter_ttl=60)
+    backend.incr('generation:cart:1')
+    fresh = backend.incr('generation:cart:2')
+    stale = time.time() - 120
+    os.utime(backend._path('counter:generation:cart:1'), (stale, stale))
+
+    assert backend.sweep() == 1
+    assert backend.counter('generation:cart:1') == 0
+    assert backend.counter('generation:cart:2') == fresh
@@ -0,0 +1,183 @@
+import threading
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import db, response_cache
+from caching import FileSystemBackend
+from cart import add_cart_item, get_cart_item_count, invalidate_cart
+from models import CartItem
+
+
+@contextmanager
+def count_statements(app):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def _cart_page_statements(app, client, user_id, item_ids):
+    with app.app_context():
+        for item_id in item_ids:
+            add_cart_item(user_id, item_id, 2)
+        db.session.commit()
+    with count_statements(app) as statements:
+        response = client.get('/cart')
+    assert response.status_code == 200
+    for n in range(len(item_ids)):
+        assert f'Stone {n}'.encode() in response.data
+    return len(statements)
+
+
+def test_cart_page_queries_do_not_grow_with_lines(app, client, login, make_user, make_items):
+    item_ids = make_items(10)
+    user_id = make_user()
+    login()
+    # Warm up once so per-process caches (e.g. categories) are filled
+    client.get('/cart')
+
+    one_line = _cart_page_statements(app, client, user_id, item_ids[:1])
+    ten_lines = _cart_page_statements(app, client, user_id, item_ids[1:])
+    assert ten_lines == one_line
+
+
+def test_anonymous_cart_page_queries_do_not_grow_with_lines(app, client, make_items):
+    item_ids = make_items(10)
+    headers = {'Origin': 'http://localhost'}
+    client.post(f'/add_to_cart/{item_ids[0]}', headers=headers)
+    with count_statements(app) as statements:
+        client.get('/cart')
+    one_line = len(statements)
+
+    for item_id in item_ids[1:]:
+        client.post(f'/add_to_cart/{item_id}', headers=headers)
+    with count_statements(app) as statements:
+        response = client.get('/cart')
+    assert b'Stone 9' in response.data
+    assert len(statements) == one_line
+
+
+def test_cart_count_invalidation_reaches_other_processes(
+    app, make_user, make_items, monkeypatch, tmp_path
+):
+    item_id, = make_items(1)
+    user_id = make_user()
+    monkeypatch.setattr(response_cache, 'backend', FileSystemBackend(str(tmp_path)))
+
+    with app.app_context():
+        assert get_cart_item_count(user_id) == 0
+        # Another worker process adds to the cart and invalidates through the
+        # shared backend; this process's cached count must not be served again
+        add_cart_item(user_id, item_id, 3)
+        db.session.commit()
+        FileSystemBackend(str(tmp_path)).incr(f'generation:cart:{user_id}')
+        assert get_cart_item_count(user_id) == 3
+
+        add_cart_item(user_id, item_id, 1)
+        db.session.commit()
+        invalidate_cart(user_id)
+        assert get_cart_item_count(user_id) == 4
+
+
+def test_anonymous_add_to_cart_requires_our_origin(client, make_items):
+    item_id, = make_items(1)
+    assert client.post(f'/add_to_cart/{item_id}').status_code == 403
+    assert client.post(
+        f'/add_to_cart/{item_id}', headers={'Origin': 'https://evil.example'}
+    ).status_code == 403
+    assert client.post(
+        f'/add_to_cart/{item_id}', headers={'Referer': 'https://evil.example/page'}
+    ).status_code == 403
+    assert client.post(
+        f'/add_to_cart/{item_id}', headers={'Referer': 'http://localhost/index'}
+    ).status_code == 302
+    assert client.post(
+        f'/add_to_cart/{item_id}', headers={'Origin': 'http://localhost'}
+    ).status_code == 302
+
+
+def _cart_lines(app, user_id):
+    with app.app_context():
+        return [
+            (line.item_id, line.quantity)
+            for line in CartItem.query.filter_by(user_id=user_id).order_by(CartItem.item_id)
+        ]
+
+
+def test_concurrent_adds_end_in_one_line(app, make_user, make_items):
+    item_id, = make_items(1)
+    user_id = make_user()
+    clients = [app.test_client() for _ in range(20)]
+    for client in clients:
+        client.post('/login', data={'username': 'bob', 'password': 'pw'})
+
+    start = threading.Barrier(len(clients))
+    statuses = []
+
+    def add(client):
+        start.wait()
+        statuses.append(client.post(f'/add_to_cart/{item_id}').status_code)
+
+    threads = [threading.Thread(target=add, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [302] * len(clients)
+    assert _cart_lines(app, user_id) == [(item_id, len(clients))]
+
+
+def test_cart_changes_report_the_new_quantity(app, client, login, make_user, make_items):
+    item_id, = make_items(1)
+    user_id = make_user()
+    login()
+    headers = {'Accept': 'application/json'}
+
+    for quantity in (1, 2):
+        response = client.post(f'/add_to_cart/{item_id}', headers=headers)
+        assert response.json == {'item_id': item_id, 'quantity': quantity, 'cart_count': quantity}
+    assert client.post('/add_to_cart/999999', headers=headers).status_code == 404
+    assert _cart_lines(app, user_id) == [(item_id, 2)]
+
+    with app.app_context():
+        line_id = CartItem.query.filter_by(user_id=user_id).one().id
+    for action, quantity in (('increase', 3), ('decrease', 2)):
+        response = client.post(
+            f'/update_cart/{line_id}', data={'action': action}, headers=headers
+        )
+        assert response.json == {'cart_item_id': line_id, 'quantity': quantity, 'cart_count': quantity}
+
+
+def test_decreasing_to_zero_removes_the_line(app, client, login, make_user, make_items):
+    item_id, = make_items(1)
+    user_id = make_user()
+    login()
+    client.post(f'/add_to_cart/{item_id}')
+    with app.app_context():
+        line_id = CartItem.query.filter_by(user_id=user_id).one().id
+
+    assert client.post(f'/update_cart/{line_id}', data={'action': 'decrease'}).status_code == 302
+    assert _cart_lines(app, user_id) == []
+    assert client.post(f'/update_cart/{line_id}', data={'action': 'decrease'}).status_code == 404
+
+
+def test_other_users_lines_cannot_be_changed(app, client, login, make_user, make_items):
+    item_id, = make_items(1)
+    owner_id = make_user('alice')
+    with app.app_context():
+        add_cart_item(owner_id, item_id)
+        db.session.commit()
+        line_id = CartItem.query.filter_by(user_id=owner_id).one().id
+    make_user()
+    login()
+
+    assert client.post(f'/update_cart/{line_id}', data={'action': 'increase'}).status_code == 404
+    assert _cart_lines(app, owner_id) == [(item_id, 1)]
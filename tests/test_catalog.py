@@ -0,0 +1,84 @@
+import io
+import json
+import pytest
+from sqlalchemy import delete
+from app import db
+from catalog import CategoryResolver, RowError, export_items, import_items, validate_row
+from models import Category, Item
+
+ROW = {
+    'name': 'Slate',
+    'description': 'Grey slate',
+    'price': '12.50',
+    'image': 'http://example.com/slate.png',
+    'stock': '3',
+    'weight': '2.5',
+    'category': 'Slate',
+}
+
+
+@pytest.mark.parametrize(
+    'field, value',
+    [
+        ('price', 'NaN'),
+        ('price', 'sNaN'),
+        ('price', 'Infinity'),
+        ('weight', 'nan'),
+        ('weight', 'inf'),
+        ('weight', '-inf'),
+    ],
+)
+def test_non_finite_numbers_are_row_errors(field, value):
+    with pytest.raises(RowError, match='finite'):
+        validate_row({**ROW, field: value})
+
+
+def test_resolver_forgets_categories_of_a_rolled_back_chunk(app):
+    with app.app_context():
+        categories = CategoryResolver(create=True)
+        categories.resolve({'Slate'})
+        db.session.rollback()
+        categories.rollback()
+
+        slate_id = categories.resolve({'Slate'})['Slate']
+        assert db.session.get(Category, slate_id).name == 'Slate'
+
+
+def test_dry_run_writes_nothing(app):
+    rows = [{**ROW, 'name': f'Slate {n}'} for n in range(5)]
+    stream = io.StringIO(''.join(json.dumps(row) + '\n' for row in rows))
+    with app.app_context():
+        read, written, errors = import_items(
+            stream, 'jsonl', chunk_size=2, create_categories=True, dry_run=True
+        )
+        assert (read, written, errors) == (5, 5, [])
+        assert Item.query.count() == 0
+        assert Category.query.count() == 0
+
+
+def test_export_includes_items_without_a_category(app, make_items):
+    make_items(1)
+    with app.app_context():
+        # SQLite does not enforce the foreign key, so items can outlive their category
+        orphan = Category(name='Gone')
+        db.session.add(
+            Item(
+                name='Loose pebble',
+                description='d',
+                price=1,
+                image='i',
+                stock=1,
+                weight=0.1,
+                category=orphan,
+            )
+        )
+        db.session.commit()
+        db.session.execute(delete(Category).where(Category.id == orphan.id))
+        db.session.commit()
+        stream = io.StringIO()
+        assert export_items(stream, 'jsonl', chunk_size=1) == 2
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(r['name'], r['category']) for r in records] == [
+        ('Stone 0', 'Marble'),
+        ('Loose pebble', ''),
+    ]
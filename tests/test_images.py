@@ -0,0 +1,168 @@
+import hashlib
+import http.server
+import threading
+from io import BytesIO
+import pytest
+from PIL import Image
+from app import db
+from images import ImageError, fetch_image, render_variants, variant_name
+from models import Item
+
+WIDTHS = [320, 640, 1280]
+
+
+def _png(size, mode='RGB', color=(120, 90, 60)):
+    buffer = BytesIO()
+    Image.new(mode, size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def photo():
+    """A 1600x1000 original, larger than every configured width."""
+    image = Image.linear_gradient('L').resize((1600, 1000)).convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def image_server(photo):
+    """Serve a few canned responses over HTTP on a free local port."""
+    responses = {
+        '/photo.png': (200, 'image/png', photo),
+        '/page': (200, 'text/html; charset=utf-8', b'<html>Not found, sorry</html>'),
+        '/huge.png': (200, 'image/png', b'\0' * 4096),
+        '/untyped': (200, None, photo),
+    }
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, content_type, body = responses.get(self.path, (404, 'text/plain', b''))
+            self.send_response(status)
+            if content_type:
+                self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_variants_are_rendered_at_each_width(tmp_path, photo):
+    digest, width = render_variants(photo, str(tmp_path), WIDTHS, quality=80)
+
+    assert digest == hashlib.sha256(photo).hexdigest()
+    assert width == 1280
+    for variant_width in WIDTHS:
+        for fmt in ('webp', 'jpg'):
+            with Image.open(tmp_path / variant_name(digest, variant_width, fmt)) as variant:
+                assert variant.size == (variant_width, variant_width * 10 // 16)
+    assert len(list(tmp_path.rglob('*.*'))) == 6
+
+
+def test_small_originals_are_not_upscaled(tmp_path):
+    digest, width = render_variants(_png((500, 300)), str(tmp_path), WIDTHS, quality=80)
+    assert width == 500
+    assert sorted(path.name for path in tmp_path.rglob('*.jpg')) == [
+        f'{digest}-320.jpg',
+        f'{digest}-500.jpg',
+    ]
+
+
+def test_variant_names_are_content_addressed(tmp_path):
+    red, blue = _png((400, 400), color=(255, 0, 0)), _png((400, 400), color=(0, 0, 255))
+    red_digest, _ = render_variants(red, str(tmp_path), WIDTHS, quality=80)
+    blue_digest, _ = render_variants(blue, str(tmp_path), WIDTHS, quality=80)
+
+    assert red_digest != blue_digest
+    assert variant_name(red_digest, 320, 'webp') == f'{red_digest[:2]}/{red_digest}-320.webp'
+    assert (tmp_path / variant_name(blue_digest, 400, 'jpg')).is_file()
+
+
+def test_rendering_again_is_a_no_op(tmp_path, photo, monkeypatch):
+    render_variants(photo, str(tmp_path), WIDTHS, quality=80)
+    written = {path: path.stat().st_mtime_ns for path in tmp_path.rglob('*.*')}
+
+    def refuse(*args, **kwargs):
+        raise AssertionError('the original was decoded again')
+
+    monkeypatch.setattr(Image, 'open', refuse)
+    assert render_variants(photo, str(tmp_path), WIDTHS, quality=80)[1] == 1280
+    assert {path: path.stat().st_mtime_ns for path in tmp_path.rglob('*.*')} == written
+
+
+def test_transparent_images_are_flattened_for_jpeg(tmp_path):
+    data = _png((400, 400), mode='RGBA', color=(0, 0, 0, 0))
+    digest, _ = render_variants(data, str(tmp_path), WIDTHS, quality=80)
+    with Image.open(tmp_path / variant_name(digest, 400, 'webp')) as webp:
+        assert webp.mode == 'RGBA'
+    with Image.open(tmp_path / variant_name(digest, 400, 'jpg')) as jpeg:
+        assert jpeg.getpixel((200, 200)) == (255, 255, 255)
+
+
+def test_non_image_data_is_refused(tmp_path):
+    with pytest.raises(ImageError):
+        render_variants(b'<html></html>', str(tmp_path), WIDTHS, quality=80)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_fetch_image(image_server, photo):
+    assert fetch_image(f'{image_server}/photo.png', max_bytes=len(photo), timeout=5) == photo
+    # Servers that do not say what they send are given a chance
+    assert fetch_image(f'{image_server}/untyped', max_bytes=len(photo), timeout=5) == photo
+
+
+@pytest.mark.parametrize(
+    'path, message',
+    [
+        ('/huge.png', 'larger than 1024 bytes'),
+        ('/page', 'text/html, not an image'),
+        ('/missing.png', '404'),
+    ],
+)
+def test_fetch_image_refuses_bad_responses(image_server, path, message):
+    with pytest.raises(ImageError, match=message):
+        fetch_image(f'{image_server}{path}', max_bytes=1024, timeout=5)
+
+
+def test_fetch_image_reads_local_files_only_when_allowed(tmp_path, photo):
+    path = tmp_path / 'photo.png'
+    path.write_bytes(photo)
+    with pytest.raises(ImageError):
+        fetch_image(str(path), max_bytes=len(photo), timeout=5)
+    assert fetch_image(f'file://{path}', max_bytes=len(photo), timeout=5, allow_files=True) == photo
+    with pytest.raises(ImageError, match='larger than'):
+        fetch_image(str(path), max_bytes=len(photo) - 1, timeout=5, allow_files=True)
+
+
+def test_ingest_renders_each_image_once(app, make_items, tmp_path, photo, monkeypatch):
+    image_dir = tmp_path / 'images'
+    monkeypatch.setitem(app.config, 'IMAGE_DIR', str(image_dir))
+    original = tmp_path / 'photo.png'
+    original.write_bytes(photo)
+    item_ids = make_items(2)
+    with app.app_context():
+        for item_id in item_ids:
+            db.session.get(Item, item_id).image = str(original)
+        db.session.commit()
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['images', 'ingest'])
+    assert 'Processed 2 image(s)' in result.output
+    with app.app_context():
+        digests = {db.session.get(Item, item_id).image_digest for item_id in item_ids}
+    assert digests == {hashlib.sha256(photo).hexdigest()}
+    written = {path: path.stat().st_mtime_ns for path in image_dir.rglob('*.*')}
+    assert len(written) == 6
+
+    result = runner.invoke(args=['images', 'ingest'])
+    assert 'Processed 0 image(s)' in result.output
+    assert {path: path.stat().st_mtime_ns for path in image_dir.rglob('*.*')} == written
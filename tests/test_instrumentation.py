@@ -0,0 +1,48 @@
+import pytest
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import instrumentation
+
+
+@pytest.fixture
+def metrics_client(monkeypatch):
+    """Return a client of a small instrumented app with the given METRICS_TOKEN."""
+    monkeypatch.setattr(instrumentation, '_enabled', False)
+
+    def make(token):
+        app = Flask(__name__)
+        app.config.update(
+            INSTRUMENTATION_ENABLED=True,
+            METRICS_TOKEN=token,
+            SLOW_QUERY_THRESHOLD=0.5,
+            PROFILE_SAMPLE_RATE=0.0,
+            PROFILE_ENDPOINTS='',
+            PROFILE_DIR=None,
+        )
+        instrumentation.init_app(app)
+        return app.test_client()
+
+    yield make
+    for name, listener in (
+        ('before_cursor_execute', instrumentation._before_cursor_execute),
+        ('after_cursor_execute', instrumentation._after_cursor_execute),
+    ):
+        if event.contains(Engine, name, listener):
+            event.remove(Engine, name, listener)
+
+
+def test_metrics_are_not_served_without_a_token(metrics_client):
+    client = metrics_client(None)
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 404
+
+
+def test_metrics_require_the_token(metrics_client):
+    client = metrics_client('s3cret')
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
@@ -0,0 +1,133 @@
+import threading
+from datetime import datetime, timedelta, UTC
+import pytest
+from sqlalchemy import func, select, update
+from app import db
+import inventory
+from cart import load_cart
+from models import CartItem, Item, StockReservation, User
+
+
+def _fill_carts(app, user_ids, quantities):
+    with app.app_context():
+        for user_id in user_ids:
+            for item_id, quantity in quantities.items():
+                db.session.add(CartItem(user_id=user_id, item_id=item_id, quantity=quantity))
+        db.session.commit()
+
+
+def _stock(item_id):
+    return db.session.scalar(select(Item.stock).where(Item.id == item_id))
+
+
+def test_concurrent_checkouts_never_oversell(app, make_user, make_items):
+    scarce, plenty = make_items(2)
+    with app.app_context():
+        db.session.get(Item, scarce).stock = 5
+        db.session.commit()
+    user_ids = [make_user(f'buyer{n}') for n in range(12)]
+    _fill_carts(app, user_ids, {scarce: 1, plenty: 2})
+
+    reserved, refused, errors = [], [], []
+    start = threading.Barrier(len(user_ids))
+
+    def checkout(user_id):
+        with app.app_context():
+            cart_items = load_cart(user_id)
+            start.wait()
+            try:
+                inventory.reserve_cart(user_id, cart_items)
+                db.session.commit()
+                reserved.append(user_id)
+            except inventory.InsufficientStock:
+                db.session.rollback()
+                refused.append(user_id)
+            except Exception as e:
+                db.session.rollback()
+                errors.append(e)
+
+    threads = [threading.Thread(target=checkout, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(reserved) == 5
+    assert len(refused) == 7
+    with app.app_context():
+        assert _stock(scarce) == 0
+        assert _stock(plenty) == 50 - 2 * 5
+        assert db.session.scalar(
+            select(func.sum(StockReservation.quantity)).where(StockReservation.item_id == scarce)
+        ) == 5
+        assert {
+            reservation.user_id for reservation in StockReservation.query
+        } == set(reserved)
+
+
+def test_reserve_cart_is_all_or_nothing(app, make_user, make_items):
+    first, second = make_items(2)
+    user_id = make_user()
+    with app.app_context():
+        db.session.get(Item, second).stock = 1
+        db.session.commit()
+    _fill_carts(app, [user_id], {first: 3, second: 2})
+
+    with app.app_context():
+        with pytest.raises(inventory.InsufficientStock) as error:
+            inventory.reserve_cart(user_id, load_cart(user_id))
+        db.session.rollback()
+        assert error.value.item_name == 'Stone 1'
+        assert (_stock(first), _stock(second)) == (50, 1)
+        assert StockReservation.query.count() == 0
+
+
+def test_checkout_again_keeps_open_reservations(app, make_user, make_items):
+    item_id, = make_items(1)
+    user_id = make_user()
+    _fill_carts(app, [user_id], {item_id: 4})
+
+    with app.app_context():
+        first_id = inventory.reserve_cart(user_id, load_cart(user_id))
+        inventory.assign_checkout_session(first_id, 'cs_first')
+        db.session.commit()
+        # The first payment page may still be paid, so its units stay reserved
+        second_id = inventory.reserve_cart(user_id, load_cart(user_id))
+        inventory.assign_checkout_session(second_id, 'cs_second')
+        db.session.commit()
+        assert _stock(item_id) == 42
+        assert sorted(r.checkout_session_id for r in StockReservation.query) == [
+            'cs_first', 'cs_second'
+        ]
+
+        assert inventory.release_session_reservations('cs_first') == 1
+        db.session.commit()
+        assert _stock(item_id) == 46
+        assert db.session.get(User, user_id).cart_items[0].quantity == 4
+
+
+def test_checkout_again_releases_expired_reservations(app, make_user, make_items):
+    item_id, = make_items(1)
+    user_id = make_user()
+    other_id = make_user('alice')
+    _fill_carts(app, [user_id, other_id], {item_id: 4})
+
+    with app.app_context():
+        for reserving_id in (user_id, other_id):
+            inventory.reserve_cart(reserving_id, load_cart(reserving_id))
+        db.session.execute(
+            update(StockReservation).values(expires_at=datetime.now(UTC) - timedelta(seconds=1))
+        )
+        db.session.commit()
+
+        inventory.reserve_cart(user_id, load_cart(user_id))
+        db.session.commit()
+        # Only the user's own expired reservation is returned
+        assert _stock(item_id) == 42
+        assert sorted(r.user_id for r in StockReservation.query) == [user_id, other_id]
+
+        assert inventory.release_expired_reservations() == 1
+        db.session.commit()
+        assert _stock(item_id) == 46
+        assert StockReservation.query.one().user_id == user_id
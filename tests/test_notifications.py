@@ -0,0 +1,53 @@
+import smtplib
+import socket
+import pytest
+from notification_manager import EmailMessage, NotificationManager
+
+
+def test_refused_recipient_keeps_the_pooled_connection(smtp_server):
+    smtp_server.refused.add('nobody@example.com')
+    manager = NotificationManager.instance()
+
+    results = manager.send_many(
+        [
+            EmailMessage('One', 'body', 'alice@example.com'),
+            EmailMessage('Two', 'body', 'nobody@example.com'),
+            EmailMessage('Three', 'body', 'carol@example.com'),
+        ]
+    )
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], smtplib.SMTPRecipientsRefused)
+    assert [recipients for recipients, _ in smtp_server.messages] == [
+        ['alice@example.com'],
+        ['carol@example.com'],
+    ]
+    assert smtp_server.connections == 1
+
+    # The session went back to the pool and serves the next batch too
+    assert manager.send_many([EmailMessage('Four', 'body', 'dave@example.com')]) == [None]
+    assert smtp_server.connections == 1
+
+
+def test_send_email_reuses_the_connection_after_a_refusal(smtp_server):
+    smtp_server.refused.add('nobody@example.com')
+    manager = NotificationManager.instance()
+
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        manager.send_email('Hello', 'body', 'nobody@example.com')
+    manager.send_email('Hello', 'body', 'alice@example.com')
+
+    assert len(smtp_server.messages) == 1
+    assert smtp_server.connections == 1
+
+
+def test_dropped_idle_connection_is_replaced(smtp_server):
+    manager = NotificationManager.instance()
+    manager.send_many([EmailMessage('One', 'body', 'alice@example.com')])
+    # Simulate the server closing the idle session
+    _, connection = manager.smtp_pool._idle.queue[0]
+    connection.sock.shutdown(socket.SHUT_RDWR)
+
+    assert manager.send_many([EmailMessage('Two', 'body', 'bob@example.com')]) == [None]
+    assert len(smtp_server.messages) == 2
+    assert smtp_server.connections == 2
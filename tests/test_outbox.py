@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta, UTC
+import pytest
+from sqlalchemy import update
+from app import db
+import outbox
+from models import OutboxMessage
+
+
+@pytest.fixture
+def queue(app):
+    """Commit queued emails to the given recipients and return their ids."""
+
+    def queue(*recipients):
+        with app.app_context():
+            messages = [
+                outbox.enqueue_email('Order Confirmation', '<p>Thanks</p>', recipient, html=True)
+                for recipient in recipients
+            ]
+            db.session.commit()
+            return [message.id for message in messages]
+
+    return queue
+
+
+def _now():
+    # SQLite hands DateTime columns back without a timezone
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+def _make_due(*message_ids):
+    db.session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(message_ids))
+        .values(next_attempt_at=datetime.now(UTC) - timedelta(seconds=1))
+    )
+    db.session.commit()
+
+
+def test_email_is_queued_in_the_callers_transaction(app):
+    with app.app_context():
+        outbox.enqueue_email('Order Confirmation', 'body', 'bob@example.com')
+        db.session.rollback()
+        assert OutboxMessage.query.count() == 0
+
+        outbox.enqueue_email('Order Confirmation', 'body', 'bob@example.com')
+        db.session.commit()
+        message = OutboxMessage.query.one()
+        assert (message.status, message.attempts) == ('pending', 0)
+
+
+def test_drain_delivers_due_messages(app, smtp_server, queue):
+    queue('alice@example.com', 'bob@example.com')
+    with app.app_context():
+        assert outbox.drain() == 2
+        assert {message.status for message in OutboxMessage.query} == {'sent'}
+        assert all(message.sent_at is not None for message in OutboxMessage.query)
+        assert outbox.drain() == 0
+    assert [recipients for recipients, _ in smtp_server.messages] == [
+        ['alice@example.com'],
+        ['bob@example.com'],
+    ]
+    assert smtp_server.connections == 1
+
+
+def test_claimed_messages_are_leased(app, queue, monkeypatch):
+    monkeypatch.setitem(app.config, 'OUTBOX_LEASE', 300)
+    first, second = queue('alice@example.com', 'bob@example.com')
+    with app.app_context():
+        db.session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id == second)
+            .values(next_attempt_at=datetime.now(UTC) + timedelta(minutes=5))
+        )
+        db.session.commit()
+
+        started = _now()
+        claimed = outbox._claim_due_messages(10)
+        assert [message.id for message in claimed] == [first]
+        assert claimed[0].status == 'sending'
+        lease = (claimed[0].next_attempt_at - started).total_seconds()
+        assert 299 <= lease <= 301
+        # Another worker finds nothing while the lease holds
+        assert outbox._claim_due_messages(10) == []
+
+        # A worker that died mid-send leaves the message to the next one
+        _make_due(first)
+        assert [message.id for message in outbox._claim_due_messages(10)] == [first]
+
+
+def test_failed_delivery_is_retried_with_backoff(app, smtp_server, queue, monkeypatch):
+    monkeypatch.setitem(app.config, 'OUTBOX_BACKOFF_BASE', 10)
+    monkeypatch.setitem(app.config, 'OUTBOX_MAX_ATTEMPTS', 5)
+    smtp_server.refused.add('nobody@example.com')
+    message_id, = queue('nobody@example.com')
+
+    with app.app_context():
+        for attempts, base_delay in ((1, 10), (2, 20), (3, 40)):
+            started = _now()
+            assert outbox.drain() == 0
+            message = db.session.get(OutboxMessage, message_id)
+            assert (message.status, message.attempts) == ('pending', attempts)
+            assert '550' in message.last_error
+            delay = (message.next_attempt_at - started).total_seconds()
+            assert base_delay * 0.8 - 1 <= delay <= base_delay * 1.2 + 1
+            # Not retried before its time
+            assert outbox.drain() == 0
+            assert db.session.get(OutboxMessage, message_id).attempts == attempts
+            _make_due(message_id)
+
+        # Delivered once the server accepts the recipient again
+        smtp_server.refused.clear()
+        assert outbox.drain() == 1
+        assert db.session.get(OutboxMessage, message_id).status == 'sent'
+
+
+def test_message_is_dead_lettered_after_max_attempts(app, smtp_server, queue, monkeypatch):
+    monkeypatch.setitem(app.config, 'OUTBOX_MAX_ATTEMPTS', 2)
+    smtp_server.refused.add('nobody@example.com')
+    failing, delivered = queue('nobody@example.com', 'alice@example.com')
+
+    with app.app_context():
+        assert outbox.drain() == 1
+        _make_due(failing)
+        assert outbox.drain() == 0
+        message = db.session.get(OutboxMessage, failing)
+        assert (message.status, message.attempts) == ('failed', 2)
+        assert db.session.get(OutboxMessage, delivered).status == 'sent'
+
+        # A failed message is never claimed again
+        _make_due(failing)
+        assert outbox._claim_due_messages(10) == []
+    assert len(smtp_server.messages) == 1
+
+
+def test_requests_do_not_start_a_worker(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'OUTBOX_WORKER', 'thread')
+    monkeypatch.setattr(outbox, '_worker', None)
+    client.get('/')
+    with app.app_context():
+        outbox.wake()
+    assert outbox._worker is None
@@ -0,0 +1,56 @@
+import base64
+from datetime import datetime
+import pytest
+from models import Item, Order
+from pagination import decode_cursor, encode_cursor
+
+
+def _cursor(raw: str) -> str:
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2026, 10, 18, 12, 30)
+    cursor = encode_cursor([timestamp, 7])
+    assert decode_cursor(cursor, [Order.timestamp, Order.id]) == [timestamp, 7]
+    assert decode_cursor(encode_cursor(['Slate', 3]), [Item.name, Item.id]) == ['Slate', 3]
+
+
+@pytest.mark.parametrize(
+    'raw, columns',
+    [
+        ('[1]', [Item.price_cents, Item.id]),
+        ('[1, 2, 3]', [Item.price_cents, Item.id]),
+        ('["10", 2]', [Item.price_cents, Item.id]),
+        ('[1.5, 2]', [Item.price_cents, Item.id]),
+        ('[true]', [Item.id]),
+        ('[null]', [Item.id]),
+        ('[[1], 2]', [Item.price_cents, Item.id]),
+        ('[99999999999999999999999]', [Item.id]),
+        ('[5, 2]', [Item.name, Item.id]),
+        ('["2026-10-18", 2]', [Order.timestamp, Order.id]),
+        ('[{"$dt": "yesterday"}, 2]', [Order.timestamp, Order.id]),
+        ('[{"$dt": 5}, 2]', [Order.timestamp, Order.id]),
+        ('[{"a": 1}, 2]', [Order.timestamp, Order.id]),
+        ('{"a": 1}', [Item.id]),
+        ('not json', [Item.id]),
+    ],
+)
+def test_malformed_cursors_are_ignored(raw, columns):
+    assert decode_cursor(_cursor(raw), columns) is None
+
+
+@pytest.mark.parametrize(
+    'url',
+    [
+        '/index?sort=price_asc&after=' + _cursor('["cheap", 1]'),
+        '/index?sort=name&after=' + _cursor('[{"$dt": "2026-10-18T00:00:00"}, 1]'),
+        '/api/v1/items?sort=price_desc&after=' + _cursor('[[1, 2], 3]'),
+        '/api/v1/items?after=' + _cursor('[99999999999999999999999]'),
+    ],
+)
+def test_crafted_cursor_shows_first_page(client, make_items, url):
+    make_items(3)
+    response = client.get(url)
+    assert response.status_code == 200
+    assert b'Stone 0' in response.data
@@ -0,0 +1,107 @@
+import pytest
+from sqlalchemy import delete, event, select, text
+from app import db
+from db_replicas import STICKY_KEY, is_write
+from models import CartItem, Item
+from search import get_search_backend
+
+
+@pytest.fixture
+def statements(app):
+    """Record ('primary' or 'replica', SQL) for every statement run during a test."""
+    with app.app_context():
+        engines = {'primary': db.engines[None], 'replica': db.engines['replica_0']}
+    log = []
+    listeners = []
+    for name, engine in engines.items():
+        def record(conn, cursor, statement, parameters, context, executemany, name=name):
+            log.append((name, statement))
+
+        event.listen(engine, 'before_cursor_execute', record)
+        listeners.append((engine, record))
+    yield log
+    for engine, record in listeners:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+@pytest.fixture
+def indexed_items(app, make_items):
+    """Like `make_items`, but also adds the items to the full-text index."""
+
+    def indexed_items(count):
+        item_ids = make_items(count)
+        with app.app_context():
+            get_search_backend().rebuild()
+            db.session.commit()
+        return item_ids
+
+    yield indexed_items
+    with app.app_context():
+        get_search_backend().rebuild()
+        db.session.commit()
+
+
+def _engines(log, table):
+    """Return the engines that ran the logged statements reading `table`."""
+    return {name for name, sql in log if f'FROM {table}' in sql}
+
+
+def test_is_write():
+    assert not is_write(select(Item.id))
+    assert not is_write(text('  select rowid FROM items_fts WHERE items_fts MATCH :m'))
+    assert is_write(delete(Item))
+    assert is_write(text('DELETE FROM items_fts'))
+    assert is_write(text('INSERT INTO items_fts (rowid) VALUES (1)'))
+
+
+def test_catalog_reads_go_to_the_replica(client, make_items, statements):
+    item_id, = make_items(1)
+    statements.clear()
+    assert client.get(f'/product/{item_id}').status_code == 200
+    assert client.get('/api/v1/items').status_code == 200
+    assert _engines(statements, 'items') == {'replica'}
+
+
+def test_raw_text_selects_stay_on_the_replica(client, indexed_items, statements):
+    item_id, = indexed_items(1)
+    statements.clear()
+    response = client.get('/search?q=stone')
+    assert b'Stone 0' in response.data
+    assert _engines(statements, 'items_fts') == {'replica'}
+    assert _engines(statements, 'items') == {'replica'}
+    with client.session_transaction() as session:
+        assert STICKY_KEY not in session
+
+    # The search did not make the visitor read from the primary afterwards
+    statements.clear()
+    client.get(f'/product/{item_id}')
+    assert _engines(statements, 'items') == {'replica'}
+
+
+def test_writes_and_own_reads_go_to_the_primary(
+    app, client, login, make_user, make_items, statements
+):
+    item_id, = make_items(1)
+    user_id = make_user()
+    login()
+    with client.session_transaction() as session:
+        session.pop(STICKY_KEY, None)
+
+    statements.clear()
+    client.get('/order_history')
+    assert _engines(statements, 'orders') == {'replica'}
+
+    statements.clear()
+    client.post(f'/add_to_cart/{item_id}')
+    assert {name for name, sql in statements if sql.startswith('INSERT INTO cart_items')} == {'primary'}
+    with client.session_transaction() as session:
+        assert STICKY_KEY in session
+
+    # Read-your-writes: the next reads come from the primary too
+    statements.clear()
+    client.get('/order_history')
+    client.get(f'/product/{item_id}')
+    assert _engines(statements, 'orders') == {'primary'}
+    assert _engines(statements, 'items') == {'primary'}
+    with app.app_context():
+        assert db.session.scalar(select(CartItem.quantity).where(CartItem.user_id == user_id)) == 1
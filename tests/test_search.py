@@ -0,0 +1,79 @@
+import pytest
+from sqlalchemy import update
+from app import db, response_cache
+from caching import FileSystemBackend
+from models import Item
+import search
+
+
+@pytest.fixture
+def memory_index(app, monkeypatch):
+    """Make the app search with the in-memory index instead of FTS5."""
+    index = search.InMemorySearchBackend()
+    monkeypatch.setitem(app.extensions, 'search', index)
+    return index
+
+
+def _search(app, query):
+    with app.app_context():
+        items, total = search.search_items(query, page=1, per_page=10)
+        return [item.name for item in items]
+
+
+def _rename(app, item_id, name, commit=True):
+    with app.app_context():
+        item = db.session.get(Item, item_id)
+        item.name = name
+        search.index_item(item)
+        if commit:
+            db.session.commit()
+        else:
+            db.session.rollback()
+
+
+def test_committed_changes_are_searchable(app, make_items, memory_index):
+    item_id, other_id = make_items(2)
+    assert _search(app, 'stone') == ['Stone 0', 'Stone 1']
+
+    _rename(app, item_id, 'Granite')
+    assert _search(app, 'granite') == ['Granite']
+    with app.app_context():
+        search.remove_item(other_id)
+        db.session.delete(db.session.get(Item, other_id))
+        db.session.commit()
+    assert _search(app, 'stone') == ['Granite']
+
+
+def test_rolled_back_changes_are_not_searchable(app, make_items, memory_index):
+    (item_id,) = make_items(1)
+    assert _search(app, 'stone') == ['Stone 0']
+
+    _rename(app, item_id, 'Granite', commit=False)
+    assert _search(app, 'granite') == []
+    assert _search(app, 'stone') == ['Stone 0']
+
+
+def test_changes_reach_other_processes(app, make_items, memory_index, monkeypatch, tmp_path):
+    monkeypatch.setattr(response_cache, 'backend', FileSystemBackend(str(tmp_path)))
+    (item_id,) = make_items(1)
+    assert _search(app, 'stone') == ['Stone 0']
+
+    # Another worker renames the item; this process only sees the shared generation
+    with app.app_context():
+        db.session.execute(update(Item).where(Item.id == item_id).values(name='Granite'))
+        db.session.commit()
+    assert _search(app, 'granite') == []
+    FileSystemBackend(str(tmp_path)).incr('generation:search')
+    assert _search(app, 'granite') == ['Granite']
+
+
+def test_ttl_bounds_staleness_without_a_shared_cache(app, make_items, memory_index):
+    (item_id,) = make_items(1)
+    assert _search(app, 'stone') == ['Stone 0']
+    with app.app_context():
+        db.session.execute(update(Item).where(Item.id == item_id).values(name='Granite'))
+        db.session.commit()
+    assert _search(app, 'granite') == []
+
+    memory_index.ttl = 0
+    assert _search(app, 'granite') == ['Granite']
@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import update
+from app import db, response_cache
+from caching import FileSystemBackend, MemoryBackend
+from models import User
+
+
+def _user_lookups(app):
+    stats = app.extensions['users'].stats()
+    return stats['hits'], stats['misses']
+
+
+@pytest.fixture
+def admin(app, client, login, make_user):
+    user_id = make_user(is_admin=True)
+    login()
+    assert client.get('/manage_categories').status_code == 200
+    return user_id
+
+
+def test_logged_in_requests_reuse_the_cached_user(app, client, admin):
+    hits, misses = _user_lookups(app)
+    client.get('/manage_categories')
+    client.get('/manage_categories')
+    assert _user_lookups(app) == (hits + 2, misses)
+
+
+def test_revoked_admin_is_signed_out_of_this_process(app, client, admin):
+    with app.app_context():
+        db.session.get(User, admin).is_admin = False
+        db.session.commit()
+    response = client.get('/manage_categories')
+    assert response.status_code == 302
+    assert '/login' in response.location
+
+
+def test_user_changes_reach_other_processes(app, client, admin, monkeypatch, tmp_path):
+    monkeypatch.setattr(response_cache, 'backend', FileSystemBackend(str(tmp_path)))
+    assert client.get('/manage_categories').status_code == 200
+
+    # Another worker revokes the flag; this process only sees the shared generation
+    with app.app_context():
+        db.session.execute(update(User).where(User.id == admin).values(is_admin=False))
+        db.session.commit()
+    assert client.get('/manage_categories').status_code == 200
+    FileSystemBackend(str(tmp_path)).incr(f'generation:user:{admin}')
+    assert client.get('/manage_categories').status_code == 403
+
+
+def test_committed_user_changes_bump_the_generation(app, make_user, monkeypatch):
+    monkeypatch.setattr(response_cache, 'backend', MemoryBackend())
+    user_id = make_user()
+    with app.app_context():
+        before = response_cache.generation(f'user:{user_id}')
+
+        db.session.get(User, user_id).email = 'robert@example.com'
+        db.session.flush()
+        db.session.rollback()
+        assert response_cache.generation(f'user:{user_id}') == before
+
+        db.session.get(User, user_id).email = 'robert@example.com'
+        db.session.commit()
+        assert response_cache.generation(f'user:{user_id}') != before
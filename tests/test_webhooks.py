@@ -0,0 +1,209 @@
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+import pytest
+from sqlalchemy import select
+from app import db
+import inventory
+from cart import load_cart
+from models import CartItem, Item, Order, OutboxMessage, StockReservation
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'stripe')
+SECRET = 'whsec_test_secret'
+
+
+def _payload(event_type, session_id, user_id):
+    """Load a recorded Stripe event, pointed at a local checkout session and user."""
+    with open(os.path.join(FIXTURES, f'{event_type}.json')) as f:
+        event = json.load(f)
+    event['data']['object']['id'] = session_id
+    event['data']['object']['client_reference_id'] = str(user_id)
+    return json.dumps(event).encode()
+
+
+def _signature(payload, secret=SECRET):
+    timestamp = int(time.time())
+    digest = hmac.new(
+        secret.encode(), f'{timestamp}.'.encode() + payload, hashlib.sha256
+    ).hexdigest()
+    return f't={timestamp},v1={digest}'
+
+
+@pytest.fixture
+def webhook_secret(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'STRIPE_WEBHOOK_SECRET', SECRET)
+
+
+@pytest.fixture
+def deliver(client):
+    """Post a recorded Stripe event to the webhook, signed like Stripe signs it."""
+
+    def deliver(event_type, session_id, user_id, secret=SECRET, client=client):
+        payload = _payload(event_type, session_id, user_id)
+        return client.post(
+            '/stripe/webhook',
+            data=payload,
+            headers={'Stripe-Signature': _signature(payload, secret)},
+            content_type='application/json',
+        )
+
+    return deliver
+
+
+@pytest.fixture
+def checkout_session(app, make_user, make_items):
+    """Reserve the cart of a new user for a Stripe checkout session, as checkout does."""
+    first, second = make_items(2)
+    user_id = make_user()
+    with app.app_context():
+        db.session.add_all(
+            [
+                CartItem(user_id=user_id, item_id=first, quantity=2),
+                CartItem(user_id=user_id, item_id=second, quantity=1),
+            ]
+        )
+        db.session.commit()
+        provisional_id = inventory.reserve_cart(user_id, load_cart(user_id))
+        inventory.assign_checkout_session(provisional_id, 'cs_test_webhook')
+        db.session.commit()
+    return 'cs_test_webhook', user_id, (first, second)
+
+
+def _state(user_id, item_ids):
+    """Return the orders, queued emails, stock, reservations and cart lines."""
+    return (
+        Order.query.count(),
+        OutboxMessage.query.count(),
+        [db.session.scalar(select(Item.stock).where(Item.id == item_id)) for item_id in item_ids],
+        StockReservation.query.count(),
+        CartItem.query.filter_by(user_id=user_id).count(),
+    )
+
+
+def test_invalid_signature_is_rejected(app, client, webhook_secret, deliver, checkout_session):
+    session_id, user_id, item_ids = checkout_session
+    response = deliver('checkout.session.completed', session_id, user_id, secret='whsec_wrong')
+    assert response.status_code == 400
+
+    payload = _payload('checkout.session.completed', session_id, user_id)
+    response = client.post(
+        '/stripe/webhook',
+        data=payload.replace(b'"paid"', b'"unpaid"'),
+        headers={'Stripe-Signature': _signature(payload)},
+    )
+    assert response.status_code == 400
+    with app.app_context():
+        assert _state(user_id, item_ids) == (0, 0, [48, 49], 2, 2)
+
+
+def test_webhook_is_not_served_without_a_secret(deliver, checkout_session):
+    session_id, user_id, _ = checkout_session
+    assert deliver('checkout.session.completed', session_id, user_id).status_code == 404
+
+
+def test_duplicate_completed_event_creates_one_order(
+    app, webhook_secret, deliver, checkout_session
+):
+    session_id, user_id, item_ids = checkout_session
+    for _ in range(2):
+        response = deliver('checkout.session.completed', session_id, user_id)
+        assert response.status_code == 200
+        assert response.json == {'received': True}
+
+    with app.app_context():
+        assert _state(user_id, item_ids) == (1, 1, [48, 49], 0, 0)
+        order = Order.query.one()
+        assert (order.user_id, order.checkout_session_id) == (user_id, session_id)
+        assert (order.total_amount_cents, order.status) == (3100, 'Pending')
+        assert sorted((line.item_id, line.quantity) for line in order.line_items) == [
+            (item_ids[0], 2),
+            (item_ids[1], 1),
+        ]
+
+
+def test_concurrent_deliveries_create_one_order(
+    app, webhook_secret, deliver, checkout_session
+):
+    session_id, user_id, item_ids = checkout_session
+    start = threading.Barrier(4)
+    statuses = []
+
+    def delivery():
+        start.wait()
+        response = deliver(
+            'checkout.session.completed', session_id, user_id, client=app.test_client()
+        )
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=delivery) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * 4
+    with app.app_context():
+        assert _state(user_id, item_ids) == (1, 1, [48, 49], 0, 0)
+
+
+def test_expired_event_releases_reservations(app, webhook_secret, deliver, checkout_session):
+    session_id, user_id, item_ids = checkout_session
+    assert deliver('checkout.session.expired', session_id, user_id).status_code == 200
+    with app.app_context():
+        # The units go back on the shelf and the cart is left for another try
+        assert _state(user_id, item_ids) == (0, 0, [50, 50], 0, 2)
+
+
+def test_late_expired_event_leaves_the_order_alone(
+    app, webhook_secret, deliver, checkout_session
+):
+    session_id, user_id, item_ids = checkout_session
+    deliver('checkout.session.completed', session_id, user_id)
+    assert deliver('checkout.session.expired', session_id, user_id).status_code == 200
+    with app.app_context():
+        assert _state(user_id, item_ids) == (1, 1, [48, 49], 0, 0)
+
+
+def test_success_redirect_before_the_webhook_waits_for_it(
+    app, client, login, webhook_secret, deliver, checkout_session
+):
+    session_id, user_id, item_ids = checkout_session
+    login()
+    response = client.get(f'/order_confirmation?session_id={session_id}')
+    assert b'We are confirming your payment' in response.data
+    with app.app_context():
+        assert _state(user_id, item_ids) == (0, 0, [48, 49], 2, 2)
+
+    deliver('checkout.session.completed', session_id, user_id)
+    response = client.get(f'/order_confirmation?session_id={session_id}')
+    assert b'Thank you for your purchase' in response.data
+
+
+def test_webhook_after_the_redirect_finalized_is_a_no_op(
+    app, client, login, monkeypatch, deliver, checkout_session
+):
+    import stripe
+
+    session_id, user_id, item_ids = checkout_session
+    recorded = json.loads(_payload('checkout.session.completed', session_id, user_id))
+    monkeypatch.setattr(
+        stripe.checkout.Session,
+        'retrieve',
+        lambda id: stripe.checkout.Session.construct_from(recorded['data']['object'], 'sk_test'),
+    )
+
+    # Without a webhook secret the success redirect creates the order itself
+    login()
+    response = client.get(f'/order_confirmation?session_id={session_id}')
+    assert b'Thank you for your purchase' in response.data
+    with app.app_context():
+        assert _state(user_id, item_ids) == (1, 1, [48, 49], 0, 0)
+
+    # The event arrives only after the endpoint was configured
+    monkeypatch.setitem(app.config, 'STRIPE_WEBHOOK_SECRET', SECRET)
+    assert deliver('checkout.session.completed', session_id, user_id).status_code == 200
+    with app.app_context():
+        assert _state(user_id, item_ids) == (1, 1, [48, 49], 0, 0)
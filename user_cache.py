@@ -0,0 +1,104 @@
+from typing import Optional
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+from app import db, response_cache
+from caching import TTLCache
+from models import User
+
+# `Session.info` key of the users changed by the transaction in progress
+CHANGED_USERS = 'changed_users'
+
+
+def _user_cache() -> TTLCache:
+    cache = current_app.extensions.get('users')
+    if cache is None:
+        cache = current_app.extensions['users'] = TTLCache(
+            maxsize=current_app.config['USER_CACHE_SIZE'],
+            ttl=current_app.config['USER_CACHE_TTL'],
+        )
+    return cache
+
+
+def _user_namespace(user_id: int) -> str:
+    return f'user:{user_id}'
+
+
+def _cache_key(user_id: int, version: int):
+    return user_id, version, response_cache.generation(_user_namespace(user_id))
+
+
+def _parse_session_id(session_id: str):
+    # Sessions from before `User.get_id` included a version hold a bare user id
+    user_id, _, version = session_id.partition(':')
+    try:
+        return int(user_id), int(version or 0)
+    except ValueError:
+        return None
+
+
+def load_user(session_id: str) -> Optional[User]:
+    """Return the user a Flask-Login session id belongs to, or None if it is stale.
+
+    Session ids are 'user_id:session_version' (see `User.get_id`), and the
+    user's column values are cached per process under that pair and the
+    user's 'user:<id>' generation of the response cache. A hit is attached to
+    the request's session with `merge(load=False)`, which issues no query, so
+    relationships still lazy load as usual.
+
+    Committing any change to a user, e.g. a new password or admin flag, bumps
+    the generation. Other processes see that when the response cache backend
+    is shared; with the per-process memory backend they may serve the old
+    values, and a session the change revoked, for up to `USER_CACHE_TTL`.
+    """
+    parsed = _parse_session_id(session_id)
+    if parsed is None:
+        return None
+    user_id, version = parsed
+    key = _cache_key(user_id, version)
+    cache = _user_cache()
+    values = cache.get(key)
+    if values is not None:
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    user = db.session.get(User, user_id)
+    if user is None or (user.session_version or 0) != version:
+        return None
+    cache.set(
+        key, {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+    )
+    return user
+
+
+def invalidate_user(user: User) -> None:
+    """Drop a user's cached identity in this process, e.g. on logout."""
+    _user_cache().delete(_cache_key(user.id, user.session_version or 0))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_changed_users(session, flush_context) -> None:
+    # Flushed changes are still visible here, including the previous session_version
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, User) and (obj in session.deleted or session.is_modified(obj)):
+            history = inspect(obj).attrs.session_version.history
+            version = history.deleted[0] if history.deleted else obj.session_version
+            session.info.setdefault(CHANGED_USERS, set()).add((obj.id, version or 0))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_users(session) -> None:
+    for user_id, version in session.info.pop(CHANGED_USERS, ()):
+        _user_cache().delete(_cache_key(user_id, version))
+        response_cache.invalidate(_user_namespace(user_id))
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_changed_users(session, previous_transaction) -> None:
+    if previous_transaction.parent is None:
+        session.info.pop(CHANGED_USERS, None)
+
+
+def user_cache_stats() -> dict:
+    return _user_cache().stats()